@@ -2,7 +2,9 @@
 FiberQ API Client – HTTP communication with the FiberQ server.
 
 Uses urllib (stdlib) to avoid external dependencies in the QGIS plugin.
-All methods return parsed JSON or raise RuntimeError on failure.
+All methods return parsed JSON or raise RuntimeError on failure
+(TransientApiError for connection errors and 5xx responses, which are
+worth retrying).
 """
 
 import json
@@ -12,8 +14,11 @@ import urllib.error
 import urllib.parse
 import urllib.request
 import configparser
+import http.client
 from typing import Optional
 
+# Server's write position, echoed back for read-your-writes
+WRITE_LSN_HEADER = "X-FiberQ-Write-LSN"
 
 def _plugin_root_dir():
     return os.path.dirname(os.path.dirname(__file__))
@@ -46,8 +51,39 @@ def _load_server_config():
     }
 
 
+class TransientApiError(RuntimeError):
+    """Connection error or 5xx response; the request may be retried."""
+
+
+def _http_error(prefix: str, e: urllib.error.HTTPError) -> RuntimeError:
+    err_body = ""
+    try:
+        err_body = e.read().decode("utf-8", errors="replace")
+    except Exception:
+        pass
+    cls = TransientApiError if e.code >= 500 else RuntimeError
+    return cls(f"{prefix} {e.code}: {err_body}")
+
+
+def _file_sha256(file_path: str) -> str:
+    import hashlib
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 class FiberQApiClient:
-    """Stateless HTTP client for the FiberQ REST API."""
+    """HTTP client for the FiberQ REST API.
+
+    The only state besides the token is the server's last write position
+    (``X-FiberQ-Write-LSN``), which is sent back so reads after an upload
+    or edit see it even when served from a read replica.
+    """
 
     def __init__(self, base_url: Optional[str] = None, token: Optional[str] = None):
         if base_url:
@@ -56,6 +92,7 @@ class FiberQApiClient:
             cfg = _load_server_config()
             self.base_url = cfg["api_url"]
         self.token = token
+        self.write_lsn: Optional[str] = None
         self._ssl_ctx = ssl.create_default_context()
 
     def set_token(self, token: str):
@@ -65,6 +102,20 @@ class FiberQApiClient:
     # Low-level HTTP
     # ------------------------------------------------------------------
 
+    def _headers(self, **extra) -> dict:
+        headers = {"User-Agent": "FiberQ-QGIS-Plugin/1.0"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if self.write_lsn:
+            headers[WRITE_LSN_HEADER] = self.write_lsn
+        headers.update(extra)
+        return headers
+
+    def _note_write(self, resp):
+        lsn = resp.headers.get(WRITE_LSN_HEADER)
+        if lsn:
+            self.write_lsn = lsn
+
     def _request(self, method: str, path: str, body=None,
                  query: Optional[dict] = None, timeout: int = 30) -> dict:
         url = f"{self.base_url}{path}"
@@ -73,9 +124,7 @@ class FiberQApiClient:
                 {k: v for k, v in query.items() if v is not None}
             )
 
-        headers = {"User-Agent": "FiberQ-QGIS-Plugin/1.0"}
-        if self.token:
-            headers["Authorization"] = f"Bearer {self.token}"
+        headers = self._headers()
 
         data = None
         if body is not None:
@@ -86,21 +135,15 @@ class FiberQApiClient:
 
         try:
             with urllib.request.urlopen(req, context=self._ssl_ctx, timeout=timeout) as resp:
+                self._note_write(resp)
                 raw = resp.read().decode("utf-8")
                 if not raw:
                     return {}
                 return json.loads(raw)
         except urllib.error.HTTPError as e:
-            err_body = ""
-            try:
-                err_body = e.read().decode("utf-8", errors="replace")
-            except Exception:
-                pass
-            raise RuntimeError(
-                f"API error {e.code} {method} {path}: {err_body}"
-            ) from e
+            raise _http_error(f"API error {method} {path}", e) from e
         except urllib.error.URLError as e:
-            raise RuntimeError(f"Connection error: {e.reason}") from e
+            raise TransientApiError(f"Connection error: {e.reason}") from e
 
     def get(self, path: str, query: Optional[dict] = None, timeout: int = 30) -> dict:
         return self._request("GET", path, query=query, timeout=timeout)
@@ -135,16 +178,12 @@ class FiberQApiClient:
         ).encode("utf-8") + file_data + f"\r\n--{boundary}--\r\n".encode("utf-8")
 
         url = f"{self.base_url}{path}"
-        headers = {
-            "User-Agent": "FiberQ-QGIS-Plugin/1.0",
-            "Content-Type": f"multipart/form-data; boundary={boundary}",
-        }
-        if self.token:
-            headers["Authorization"] = f"Bearer {self.token}"
+        headers = self._headers(**{"Content-Type": f"multipart/form-data; boundary={boundary}"})
 
         req = urllib.request.Request(url, data=body, headers=headers, method="POST")
         try:
             with urllib.request.urlopen(req, context=self._ssl_ctx, timeout=timeout) as resp:
+                self._note_write(resp)
                 raw = resp.read().decode("utf-8")
                 return json.loads(raw) if raw else {}
         except urllib.error.HTTPError as e:
@@ -155,11 +194,95 @@ class FiberQApiClient:
                 pass
             raise RuntimeError(f"Upload error {e.code}: {err_body}") from e
 
-    def download_file(self, path: str, dest_path: str, timeout: int = 120):
+    # ------------------------------------------------------------------
+    # Resumable (chunked) upload
+    # ------------------------------------------------------------------
+
+    def upload_resumable(self, file_path: str, kind: str, params: dict,
+                         upload_id: Optional[str] = None,
+                         max_retries: int = 5, timeout: int = 120,
+                         progress=None) -> dict:
+        """Upload a file through the /sync/uploads/ session protocol.
+
+        The file is sent in chunks of the size the server suggests. After a
+        dropped connection the client asks the server for the last
+        acknowledged offset and continues from there, up to ``max_retries``
+        consecutive failures. Only connection errors and 5xx responses are
+        retried (finalize included, which is idempotent); a 4xx response is
+        raised at once. Pass ``upload_id`` to resume a session started
+        earlier. ``progress(sent_bytes, total_bytes)`` is called after every
+        acknowledged chunk. Returns the finalize response.
+        """
+        import time
+
+        size = os.path.getsize(file_path)
+        sha256 = _file_sha256(file_path)
+
+        if upload_id:
+            session = self.get(f"/sync/uploads/{upload_id}")
+        else:
+            body = dict(params)
+            body.update({
+                "kind": kind,
+                "filename": os.path.basename(file_path),
+                "size": size,
+                "sha256": sha256,
+            })
+            session = self.post("/sync/uploads/", body)
+            upload_id = session["upload_id"]
+
+        offset = session["offset"]
+        chunk_size = session.get("chunk_size") or 4 * 1024 * 1024
+        failures = 0
+        resync = False
+
+        with open(file_path, "rb") as f:
+            while True:
+                try:
+                    if resync:
+                        # Resume from whatever the server acknowledged
+                        offset = self.get(f"/sync/uploads/{upload_id}")["offset"]
+                        resync = False
+                    if offset >= size:
+                        return self.post(f"/sync/uploads/{upload_id}/finalize", timeout=timeout)
+                    f.seek(offset)
+                    chunk = f.read(chunk_size)
+                    session = self._put_chunk(upload_id, offset, chunk, timeout)
+                    offset = session["offset"]
+                    failures = 0
+                    if progress:
+                        progress(offset, size)
+                except TransientApiError:
+                    failures += 1
+                    if failures > max_retries:
+                        raise
+                    time.sleep(min(2 ** failures, 30))
+                    resync = True
+
+    def _put_chunk(self, upload_id: str, offset: int, chunk: bytes,
+                   timeout: int) -> dict:
+        url = f"{self.base_url}/sync/uploads/{upload_id}?offset={offset}"
+        headers = self._headers(**{"Content-Type": "application/octet-stream"})
+
+        req = urllib.request.Request(url, data=chunk, headers=headers, method="PUT")
+        try:
+            with urllib.request.urlopen(req, context=self._ssl_ctx, timeout=timeout) as resp:
+                self._note_write(resp)
+                return json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            raise _http_error("Upload error", e) from e
+        except (urllib.error.URLError, OSError) as e:
+            raise TransientApiError(f"Connection error: {e}") from e
+
+    def download_file(self, path: str, dest_path: str, timeout: int = 120,
+                      extra_headers: Optional[dict] = None) -> Optional[http.client.HTTPMessage]:
+        """Stream a response body to ``dest_path``; returns the response headers
+        (looked up case-insensitively: the server sends lowercase names).
+
+        Returns None on ``304 Not Modified`` without touching ``dest_path``.
+        """
         url = f"{self.base_url}{path}"
-        headers = {"User-Agent": "FiberQ-QGIS-Plugin/1.0"}
-        if self.token:
-            headers["Authorization"] = f"Bearer {self.token}"
+        headers = self._headers(**(extra_headers or {}))
 
         req = urllib.request.Request(url, headers=headers, method="GET")
         try:
@@ -170,7 +293,10 @@ class FiberQApiClient:
                         if not chunk:
                             break
                         f.write(chunk)
+                return resp.headers
         except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
             raise RuntimeError(f"Download error {e.code}") from e
 
     # ------------------------------------------------------------------
@@ -313,22 +439,78 @@ class FiberQApiClient:
 
     def upload_photo(self, file_path: str, related_type: str,
                      related_id: int, caption: str = "") -> dict:
-        # Use multipart upload
-        return self.upload_file(
-            f"/photos/upload?related_type={related_type}"
-            f"&related_id={related_id}&caption={urllib.parse.quote(caption)}",
-            file_path, field_name="file"
-        )
+        return self.upload_resumable(file_path, "photo", {
+            "related_type": related_type,
+            "related_id": related_id,
+            "caption": caption,
+        })
 
     # ------------------------------------------------------------------
     # Sync
     # ------------------------------------------------------------------
 
-    def sync_upload(self, gpkg_path: str, project_id: int) -> dict:
-        return self.upload_file(
-            f"/sync/upload?project_id={project_id}",
-            gpkg_path, field_name="file", timeout=300
+    def sync_upload(self, gpkg_path: str, project_id: int, progress=None,
+                    wait_timeout: int = 1800, poll_interval: float = 2.0) -> dict:
+        """Upload a GPKG resumably and wait for the server to merge it.
+
+        Returns ``{"status": "ok", "sync_id", "features_merged",
+        "conflicts"}`` like the former synchronous upload; raises
+        RuntimeError when the merge fails or does not finish within
+        ``wait_timeout`` seconds. Use upload_resumable() and sync_job()
+        directly to avoid blocking.
+        """
+        import time
+
+        queued = self.upload_resumable(
+            gpkg_path, "gpkg", {"project_id": project_id},
+            timeout=300, progress=progress,
         )
-
-    def sync_download(self, project_id: int, dest_path: str):
-        self.download_file(f"/sync/download/{project_id}", dest_path, timeout=300)
+        sync_id = queued["sync_id"]
+        deadline = time.monotonic() + wait_timeout
+        while True:
+            try:
+                job = self.sync_job(sync_id)
+            except TransientApiError:
+                job = None
+            if job and job["status"] == "completed":
+                return {
+                    "status": "ok",
+                    "sync_id": sync_id,
+                    "features_merged": job.get("features_uploaded") or 0,
+                    "conflicts": job.get("conflicts_resolved") or 0,
+                }
+            if job and job["status"] == "failed":
+                error = (job.get("details") or {}).get("error", "merge failed")
+                raise RuntimeError(f"Sync {sync_id} failed: {error}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Sync {sync_id} did not finish within {wait_timeout} s")
+            time.sleep(poll_interval)
+
+    def sync_job(self, sync_id: int) -> dict:
+        """Status and per-layer progress of a queued upload merge."""
+        return self.get(f"/sync/jobs/{sync_id}")
+
+    def sync_download(self, project_id: int, dest_path: str,
+                      since: Optional[str] = None,
+                      etag: Optional[str] = None) -> dict:
+        """Download the project GPKG.
+
+        ``since`` (ISO timestamp or the sync_id of an earlier download)
+        requests only the changes after it. ``etag`` from an earlier full
+        download skips the transfer when the project is unchanged.
+
+        Returns ``{"sync_id", "etag", "not_modified"}``; pass ``sync_id`` as
+        ``since`` and ``etag`` as ``etag`` on the next call.
+        """
+        path = f"/sync/download/{project_id}"
+        if since is not None:
+            path += "?" + urllib.parse.urlencode({"since": since})
+        extra = {"If-None-Match": f'"{etag}"'} if etag else None
+        headers = self.download_file(path, dest_path, timeout=300, extra_headers=extra)
+        if headers is None:
+            return {"sync_id": None, "etag": etag, "not_modified": True}
+        return {
+            "sync_id": headers.get("X-Sync-Id"),
+            "etag": (headers.get("ETag") or "").strip('"') or None,
+            "not_modified": False,
+        }
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends
 
-from auth.zitadel import get_current_user
+from auth.zitadel import get_current_user, token_cache
 from auth.models import UserInfo
+from auth.roles import require_admin
 
 router = APIRouter()
 
@@ -22,3 +23,9 @@ async def get_my_roles(user: UserInfo = Depends(get_current_user)):
         "is_engineer": user.is_engineer,
         "is_field_worker": user.is_field_worker,
     }
+
+
+@router.get("/token-cache")
+async def get_token_cache_stats(user: UserInfo = Depends(require_admin)):
+    """Verified-token cache metrics of the API worker serving the request."""
+    return token_cache.stats()
@@ -1,7 +1,11 @@
+import asyncio
+import hashlib
 import logging
+import time
+from collections import OrderedDict
 
 import httpx
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
 
@@ -12,35 +16,119 @@ logger = logging.getLogger("fiberq.auth")
 
 security = HTTPBearer()
 
-_jwks_cache: dict | None = None
-_openid_config_cache: dict | None = None
+_http_client: httpx.AsyncClient | None = None
 
 
-async def _get_openid_config() -> dict:
-    global _openid_config_cache
-    if _openid_config_cache:
-        return _openid_config_cache
+class _KeyCache:
+    """OpenID configuration and JWKS with a TTL.
 
-    url = f"https://{settings.zitadel_domain}/.well-known/openid-configuration"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url)
-        resp.raise_for_status()
-        _openid_config_cache = resp.json()
-    return _openid_config_cache
+    Refreshes are single-flight: concurrent misses wait for one fetch.
+    Unknown ``kid`` values force at most one refresh per
+    ``oidc_refresh_min_interval_s`` and are then remembered (bounded, for
+    ``oidc_unknown_kid_ttl_s``), so a burst of tokens signed with a bogus
+    or not yet published key cannot turn into a JWKS fetch per request.
 
+    While the identity provider is unreachable the last keys stay in use
+    and fetches are retried at most every ``oidc_refresh_retry_s``;
+    without any keys, requests fail with 503.
+    """
 
-async def _get_jwks() -> dict:
-    global _jwks_cache
-    if _jwks_cache:
-        return _jwks_cache
+    def __init__(self):
+        self.openid_config: dict | None = None
+        self.jwks: dict | None = None
+        self.fetched_at = 0.0
+        self.failed_at: float | None = None
+        self.unknown_kids: OrderedDict[str, float] = OrderedDict()
+        self._lock = asyncio.Lock()
 
-    config = await _get_openid_config()
-    jwks_uri = config["jwks_uri"]
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(jwks_uri)
-        resp.raise_for_status()
-        _jwks_cache = resp.json()
-    return _jwks_cache
+    def _fresh(self) -> bool:
+        return (self.jwks is not None
+                and time.monotonic() - self.fetched_at < settings.oidc_cache_ttl_s)
+
+    async def _refresh(self, min_age: float = 0.0):
+        """Fetch config and keys unless another caller just tried.
+
+        Failures are logged and leave the cached keys in place.
+        """
+        started = time.monotonic()
+        async with self._lock:
+            if self.fetched_at >= started or (
+                self.jwks is not None and started - self.fetched_at < min_age
+            ):
+                return
+            if self.failed_at is not None and started - self.failed_at < settings.oidc_refresh_retry_s:
+                return
+            try:
+                client = _get_http_client()
+                resp = await client.get(f"{_issuer()}/.well-known/openid-configuration")
+                resp.raise_for_status()
+                openid_config = resp.json()
+                resp = await client.get(openid_config["jwks_uri"])
+                resp.raise_for_status()
+                jwks = resp.json()
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                self.failed_at = time.monotonic()
+                logger.warning("JWKS refresh failed%s: %s",
+                               ", using cached keys" if self.jwks is not None else "", e)
+                return
+            self.openid_config, self.jwks = openid_config, jwks
+            self.fetched_at = time.monotonic()
+            self.failed_at = None
+            logger.info("Fetched JWKS (%d keys)", len(self.jwks.get("keys", [])))
+
+    async def get_key(self, kid: str) -> dict | None:
+        """The signing key ``kid``, or None when the JWKS does not have it.
+
+        Raises a 503 ``HTTPException`` when no JWKS could be fetched yet.
+        """
+        if not self._fresh():
+            await self._refresh()
+        if self.jwks is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Identity provider unavailable",
+            )
+        key = _find_key(self.jwks, kid)
+        if key:
+            return key
+
+        seen = self.unknown_kids.get(kid)
+        if seen is not None and time.monotonic() - seen < settings.oidc_unknown_kid_ttl_s:
+            return None
+
+        # Keys may have rotated
+        await self._refresh(min_age=settings.oidc_refresh_min_interval_s)
+        key = _find_key(self.jwks, kid)
+        if key:
+            self.unknown_kids.pop(kid, None)
+            return key
+
+        self.unknown_kids[kid] = time.monotonic()
+        self.unknown_kids.move_to_end(kid)
+        while len(self.unknown_kids) > settings.oidc_unknown_kid_cache_size:
+            self.unknown_kids.popitem(last=False)
+        return None
+
+
+_key_cache = _KeyCache()
+
+
+def _issuer() -> str:
+    return settings.zitadel_issuer_url.rstrip("/") or f"https://{settings.zitadel_domain}"
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=10.0)
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client:
+        await _http_client.aclose()
+        _http_client = None
 
 
 def _find_key(jwks: dict, kid: str) -> dict | None:
@@ -52,7 +140,7 @@ def _find_key(jwks: dict, kid: str) -> dict | None:
 
 async def validate_token(token: str) -> dict:
     """Validate a Zitadel OIDC Bearer token and return claims."""
-    if not settings.zitadel_domain:
+    if not settings.zitadel_domain and not settings.zitadel_issuer_url:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Zitadel not configured",
@@ -66,20 +154,12 @@ async def validate_token(token: str) -> dict:
             detail="Invalid token header",
         )
 
-    jwks = await _get_jwks()
-    key = _find_key(jwks, unverified_header.get("kid", ""))
-
+    key = await _key_cache.get_key(unverified_header.get("kid", ""))
     if not key:
-        # Refresh JWKS cache in case keys rotated
-        global _jwks_cache
-        _jwks_cache = None
-        jwks = await _get_jwks()
-        key = _find_key(jwks, unverified_header.get("kid", ""))
-        if not key:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token signing key not found",
-            )
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token signing key not found",
+        )
 
     try:
         claims = jwt.decode(
@@ -87,7 +167,7 @@ async def validate_token(token: str) -> dict:
             key,
             algorithms=["RS256"],
             audience=settings.zitadel_client_id,
-            issuer=f"https://{settings.zitadel_domain}",
+            issuer=_issuer(),
         )
     except JWTError as e:
         logger.warning("Token validation failed: %s", e)
@@ -120,15 +200,84 @@ def _extract_roles(claims: dict) -> list[str]:
     return roles
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-) -> UserInfo:
-    """FastAPI dependency that validates token and returns user info."""
-    claims = await validate_token(credentials.credentials)
+class _TokenCache:
+    """Bounded LRU of verified tokens, keyed by the token's SHA-256.
+
+    A hit returns the ``UserInfo`` built when the token was first verified,
+    skipping the RS256 check and role extraction; entries expire with the
+    token's ``exp``. Hit/miss counters are per API worker.
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[str, tuple[UserInfo, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> UserInfo | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            user, exp = entry
+            if exp > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return user
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, user: UserInfo, exp: float):
+        self._entries[key] = (user, exp)
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.auth_token_cache_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": settings.auth_token_cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
 
-    return UserInfo(
+token_cache = _TokenCache()
+
+
+async def user_from_token(token: str) -> UserInfo:
+    """Verify a bearer token and return its user (cached until ``exp``).
+
+    Raises ``HTTPException`` when the token is not valid.
+    """
+    cache_key = token_cache.key(token)
+    user = token_cache.get(cache_key)
+    if user is not None:
+        return user
+
+    claims = await validate_token(token)
+
+    user = UserInfo(
         sub=claims.get("sub", ""),
         email=claims.get("email", claims.get("preferred_username", "")),
         name=claims.get("name", claims.get("given_name", "")),
         roles=_extract_roles(claims),
     )
+    if settings.auth_token_cache_size > 0 and isinstance(claims.get("exp"), (int, float)):
+        token_cache.put(cache_key, user, float(claims["exp"]))
+    return user
+
+
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> UserInfo:
+    """FastAPI dependency that validates token and returns user info."""
+    user = await user_from_token(credentials.credentials)
+    # Read by the write tracking middleware (see main.py)
+    request.state.user = user
+    return user
@@ -0,0 +1,236 @@
+"""Change feed: push committed network edits to connected clients.
+
+Statement triggers (``record_changes``, see db/migrations/008) write one
+``change_outbox`` row per changed feature and ``NOTIFY fiberq_changes``
+with the statement's outbox id range, ``"first:last"``. Notifications are
+delivered on commit, so a range is always readable when it arrives.
+
+Each API worker holds one listening connection outside the pool. A
+dispatcher task reads the notified ranges from the outbox (only while
+clients are connected) and fans the events out to subscribers of the
+event's project. Rows of tables without ``project_id`` (trays, splices,
+patch connections, work order items) are attributed to the project of
+their parent row by the trigger (see db/migrations/011); events without a
+project are never sent.
+
+Every subscriber has a bounded queue (``settings.change_feed_client_queue``).
+A client that falls that far behind gets its queue replaced by a single
+``{"op": "resync"}`` event and is expected to reload what it shows, so one
+slow client never holds back the others or grows the worker's memory.
+Clients are also told to resync when the listening connection drops,
+since notifications sent meanwhile are lost.
+"""
+import asyncio
+import logging
+
+import asyncpg
+
+from config import settings
+from database import get_pool
+
+logger = logging.getLogger("fiberq.changes.feed")
+
+CHANNEL = "fiberq_changes"
+RESYNC = {"op": "resync"}
+# Notified ranges read per outbox query
+DISPATCH_BATCH = 100
+RECONNECT_DELAY_S = 2.0
+PRUNE_INTERVAL_S = 3600
+
+EVENT_COLUMNS = "id, project_id, table_name, feature_id, op, changed_at"
+
+
+def _event(row) -> dict:
+    return {
+        "id": row["id"],
+        "table": row["table_name"],
+        "feature_id": row["feature_id"],
+        "op": row["op"],
+        "project_id": row["project_id"],
+        "at": row["changed_at"].isoformat() if row["changed_at"] else None,
+    }
+
+
+class Subscriber:
+    """Bounded event queue of one connected client."""
+
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(
+            maxsize=max(1, settings.change_feed_client_queue)
+        )
+        self.dropped = 0
+
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind: drop the backlog and ask for a reload
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(RESYNC)
+
+
+class ChangeFeed:
+    """LISTEN connection, outbox reader and per-project fan-out."""
+
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscriber]] = {}
+        self._ranges: asyncio.Queue[tuple[int, int]] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._dispatch()),
+            asyncio.create_task(self._prune()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def subscribe(self, project_id: int) -> Subscriber:
+        sub = Subscriber(project_id)
+        self._subscribers.setdefault(project_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        subs = self._subscribers.get(sub.project_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.project_id]
+
+    async def backlog(self, project_id: int, after: int) -> list[dict] | None:
+        """Events of a project the client may have missed since outbox id
+        ``after``, for a reconnecting client; None when more than
+        ``settings.change_feed_catchup_max`` (or pruned ones) are missing and
+        the client has to resync.
+
+        Ids are taken at insert, not at commit, so a lower id can commit
+        after ``after`` was sent. Besides the later ids this returns the
+        events of every transaction still running when ``after`` was written
+        (not visible in its ``xact_snapshot``, see db/migrations/015). Some
+        of those may have been sent before; clients skip ids they have.
+        """
+        pool = get_pool()
+        rows = await pool.fetch(
+            f"""SELECT {EVENT_COLUMNS} FROM change_outbox
+                WHERE id > $1 AND project_id = $2
+                UNION
+                SELECT {EVENT_COLUMNS} FROM change_outbox o
+                JOIN (SELECT xact_snapshot FROM change_outbox WHERE id = $1) a
+                  ON o._xid >= pg_snapshot_xmin(a.xact_snapshot)
+                 AND NOT pg_visible_in_snapshot(o._xid, a.xact_snapshot)
+                WHERE o.id <= $1 AND o.project_id = $2
+                ORDER BY id LIMIT $3""",
+            after,
+            project_id,
+            settings.change_feed_catchup_max + 1,
+        )
+        if len(rows) > settings.change_feed_catchup_max:
+            return None
+        oldest = await pool.fetchval("SELECT min(id) FROM change_outbox")
+        if oldest is not None and after < oldest - 1:
+            return None
+        return [_event(r) for r in rows]
+
+    def _broadcast(self, event: dict):
+        for sub in self._subscribers.get(event["project_id"], ()):
+            sub.push(event)
+
+    def _resync_all(self):
+        for subs in self._subscribers.values():
+            for sub in subs:
+                sub.push(RESYNC)
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        try:
+            first, _, last = payload.partition(":")
+            self._ranges.put_nowait((int(first), int(last)))
+        except ValueError:
+            logger.warning("Ignoring malformed %s payload: %r", CHANNEL, payload)
+
+    async def _listen(self):
+        while True:
+            lost = asyncio.Event()
+            conn = None
+            try:
+                conn = await asyncpg.connect(dsn=settings.asyncpg_dsn)
+                conn.add_termination_listener(lambda c: lost.set())
+                await conn.add_listener(CHANNEL, self._on_notify)
+                logger.info("Listening on %s", CHANNEL)
+                await lost.wait()
+                logger.warning("Change feed connection lost, reconnecting")
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Change feed connection failed: %s", e)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            # Notifications sent while disconnected are gone
+            self._resync_all()
+            await asyncio.sleep(RECONNECT_DELAY_S)
+
+    async def _dispatch(self):
+        while True:
+            ranges = [await self._ranges.get()]
+            while len(ranges) < DISPATCH_BATCH and not self._ranges.empty():
+                ranges.append(self._ranges.get_nowait())
+            if not self._subscribers:
+                continue
+            try:
+                rows = await get_pool().fetch(
+                    f"""SELECT {EVENT_COLUMNS} FROM change_outbox o
+                        JOIN unnest($1::bigint[], $2::bigint[]) AS r(first_id, last_id)
+                          ON o.id BETWEEN r.first_id AND r.last_id
+                        ORDER BY o.id""",
+                    [first for first, _ in ranges],
+                    [last for _, last in ranges],
+                )
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Failed to read change outbox: %s", e)
+                self._resync_all()
+                continue
+            for r in rows:
+                self._broadcast(_event(r))
+
+    async def _prune(self):
+        while True:
+            try:
+                result = await get_pool().execute(
+                    "DELETE FROM change_outbox WHERE changed_at < NOW() - make_interval(hours => $1)",
+                    settings.change_feed_retention_hours,
+                )
+                logger.debug("Pruned change outbox: %s", result)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Failed to prune change outbox: %s", e)
+            await asyncio.sleep(PRUNE_INTERVAL_S)
+
+
+# --- Module-level feed (one per API worker) ---------------------------------
+
+_feed: ChangeFeed | None = None
+
+
+def start_change_feed() -> ChangeFeed:
+    global _feed
+    _feed = ChangeFeed()
+    _feed.start()
+    return _feed
+
+
+async def stop_change_feed():
+    global _feed
+    if _feed:
+        await _feed.stop()
+        _feed = None
+
+
+def get_change_feed() -> ChangeFeed:
+    if _feed is None:
+        raise RuntimeError("Change feed not started")
+    return _feed
@@ -0,0 +1,144 @@
+"""WebSocket change feed.
+
+``/ws/changes?project_id=`` sends JSON arrays of change events of one
+project as they are committed::
+
+    [{"id": 812, "table": "ftth_okna", "feature_id": 4, "op": "U",
+      "project_id": 3, "at": "..."}, ...]
+
+``op`` is ``I``, ``U`` or ``D``, or ``resync`` when the client missed
+events and has to reload. A reconnecting client passes the highest ``id``
+it saw as ``?after=`` to receive what it missed. Ids do not follow commit
+order, so the catch-up may repeat events sent before the reconnect;
+clients skip ids they already have.
+
+The bearer token goes in the ``Authorization`` header. Browsers cannot set
+headers on a WebSocket, so they offer the subprotocols
+``["fiberq.bearer", <token>]`` instead (``new WebSocket(url, [...])``);
+the server selects ``fiberq.bearer``. The token never appears in the URL
+and so stays out of proxy access logs.
+
+Engineers and admins may watch any project; field workers only projects
+with a work order assigned to them.
+"""
+import asyncio
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+
+from auth.models import UserInfo
+from auth.zitadel import user_from_token
+from changes.feed import RESYNC, Subscriber, get_change_feed
+from database import get_read_pool
+
+router = APIRouter()
+
+# Events per WebSocket message
+FRAME_MAX_EVENTS = 100
+
+# Subprotocol offered by browsers, followed by the token itself
+BEARER_PROTOCOL = "fiberq.bearer"
+
+
+def _bearer(websocket: WebSocket) -> tuple[str | None, str | None]:
+    """The client's token and the subprotocol to accept (if it used one)."""
+    offered = websocket.scope.get("subprotocols") or []
+    if BEARER_PROTOCOL in offered:
+        i = offered.index(BEARER_PROTOCOL)
+        return (offered[i + 1] if i + 1 < len(offered) else None), BEARER_PROTOCOL
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    return (credentials if scheme.lower() == "bearer" and credentials else None), None
+
+
+async def _can_watch(user: UserInfo, project_id: int) -> bool:
+    pool = get_read_pool()
+    if user.is_engineer:
+        return await pool.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM projects WHERE id = $1)", project_id
+        )
+    if not user.is_field_worker:
+        return False
+    return await pool.fetchval(
+        """SELECT EXISTS (SELECT 1 FROM work_orders
+                          WHERE project_id = $1 AND assigned_to_sub = $2)""",
+        project_id,
+        user.sub,
+    )
+
+
+@router.websocket("/changes")
+async def change_stream(
+    websocket: WebSocket,
+    project_id: int = Query(..., description="Project ID"),
+    after: int | None = Query(None, description="Last event id received"),
+):
+    """Push committed changes of a project to the client."""
+    bearer, subprotocol = _bearer(websocket)
+    try:
+        if not bearer:
+            raise HTTPException(status_code=401, detail="Missing token")
+        user = await user_from_token(bearer)
+        if not await _can_watch(user, project_id):
+            raise HTTPException(status_code=403, detail="No access to this project")
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept(subprotocol=subprotocol)
+    feed = get_change_feed()
+    # Subscribe first so nothing committed during the catch-up is missed
+    sub = feed.subscribe(project_id)
+    try:
+        seen: set[int] = set()
+        if after is not None:
+            backlog = await feed.backlog(project_id, after)
+            if backlog is None:
+                await _send(websocket, [RESYNC])
+            else:
+                seen = {e["id"] for e in backlog}
+                for i in range(0, len(backlog), FRAME_MAX_EVENTS):
+                    await _send(websocket, backlog[i:i + FRAME_MAX_EVENTS])
+
+        sender = asyncio.create_task(_send_events(websocket, sub, seen))
+        receiver = asyncio.create_task(_wait_disconnect(websocket))
+        done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            if not task.cancelled() and not isinstance(task.exception(), (WebSocketDisconnect, type(None))):
+                raise task.exception()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        feed.unsubscribe(sub)
+
+
+async def _send(websocket: WebSocket, events: list[dict]):
+    await websocket.send_text(orjson.dumps(events).decode("utf-8"))
+
+
+async def _send_events(websocket: WebSocket, sub: Subscriber, seen: set[int]):
+    """Forward queued events, batching whatever is pending into one frame.
+
+    ``send_text`` waits for the client, so a slow client backs up only its
+    own queue (see ``Subscriber.push``).
+    """
+    while True:
+        events = [await sub.queue.get()]
+        while len(events) < FRAME_MAX_EVENTS and not sub.queue.empty():
+            events.append(sub.queue.get_nowait())
+        if seen:
+            # Already sent with the catch-up backlog
+            events = [e for e in events if e.get("id") not in seen]
+            if not events:
+                continue
+        await _send(websocket, events)
+
+
+async def _wait_disconnect(websocket: WebSocket):
+    # Clients do not send anything; reading notices the close
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
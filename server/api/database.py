@@ -1,24 +1,86 @@
-import asyncpg
+import asyncio
+import logging
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+import asyncpg
+from fastapi import Request, Response
 
 from config import settings
 
+logger = logging.getLogger("fiberq.database")
+
 _pool: asyncpg.Pool | None = None
 
+# Optional read replica (settings.database_read_url). Read-only routes use
+# it through get_read_pool()/get_read_connection(), which fall back to the
+# primary while the replica's measured lag exceeds
+# settings.read_replica_max_lag_s, and for a request that must see a write
+# the replica has not replayed yet (see read_after()).
+#
+# Read-your-writes works across API workers because the client carries the
+# marker: a successful write returns the primary's WAL position in the
+# X-FiberQ-Write-LSN header and cookie (see main.py), the client sends it
+# back, and its reads stay on the primary until the replica has replayed
+# that far.
+_read_pool: asyncpg.Pool | None = None
+_replica_lag: float | None = None  # seconds; None until measured or when unreachable
+_replica_replayed: int | None = None  # WAL position replayed; None when not a standby
+_lag_task: asyncio.Task | None = None
+_read_after: ContextVar[int | None] = ContextVar("read_after", default=None)
 
-async def create_pool() -> asyncpg.Pool:
-    global _pool
-    _pool = await asyncpg.create_pool(
-        dsn=settings.asyncpg_dsn,
-        min_size=2,
-        max_size=20,
+WRITE_LSN_HEADER = "X-FiberQ-Write-LSN"
+WRITE_LSN_COOKIE = "fiberq_write_lsn"
+
+# Lag is zero when the replica has replayed everything it received (or is
+# not a standby at all), else the age of the last replayed transaction.
+# WAL positions are compared as byte offsets (pg_lsn - '0/0').
+REPLICA_LAG_SQL = """
+SELECT CASE
+           WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+           ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+       END AS lag,
+       CASE WHEN pg_is_in_recovery() THEN (pg_last_wal_replay_lsn() - '0/0'::pg_lsn)::bigint END AS replayed
+"""
+
+
+async def _create(dsn: str) -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        dsn=dsn,
+        min_size=settings.db_pool_min_size,
+        max_size=settings.db_pool_max_size,
+        # Statement texts are fixed per table/route (no inlined values), so
+        # the per-connection cache keeps them prepared across requests
+        statement_cache_size=settings.db_statement_cache_size,
+        max_inactive_connection_lifetime=settings.db_max_inactive_connection_lifetime_s,
+        command_timeout=settings.db_command_timeout_s or None,
         server_settings={"search_path": f"{settings.db_schema},public"},
     )
+
+
+async def create_pool() -> asyncpg.Pool:
+    global _pool, _read_pool, _lag_task
+    _pool = await _create(settings.asyncpg_dsn)
+    if settings.database_read_url:
+        try:
+            _read_pool = await _create(settings.asyncpg_read_dsn)
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning("Read replica unavailable, reading from the primary: %s", e)
+        else:
+            _lag_task = asyncio.create_task(_watch_replica_lag())
     return _pool
 
 
 async def close_pool():
-    global _pool
+    global _pool, _read_pool, _lag_task, _replica_lag, _replica_replayed
+    if _lag_task:
+        _lag_task.cancel()
+        await asyncio.gather(_lag_task, return_exceptions=True)
+        _lag_task = None
+    _replica_lag = _replica_replayed = None
+    if _read_pool:
+        await _read_pool.close()
+        _read_pool = None
     if _pool:
         await _pool.close()
         _pool = None
@@ -30,6 +92,87 @@ def get_pool() -> asyncpg.Pool:
     return _pool
 
 
+def get_read_pool() -> asyncpg.Pool:
+    """Pool for read-only queries of the current request.
+
+    The replica when one is configured, its lag is known and within
+    ``settings.read_replica_max_lag_s``, and it has replayed the client's
+    last write (as of the latest lag check); the primary otherwise.
+    """
+    if _read_pool is None or _replica_lag is None or _replica_lag > settings.read_replica_max_lag_s:
+        return get_pool()
+    after = _read_after.get()
+    if after is not None and _replica_replayed is not None and _replica_replayed < after:
+        return get_pool()
+    return _read_pool
+
+
+def has_read_replica() -> bool:
+    return _read_pool is not None
+
+
+def read_after(lsn: int | None):
+    """Make the current request read at least up to WAL position ``lsn``."""
+    _read_after.set(lsn)
+
+
+def client_write_lsn(request: Request) -> int | None:
+    """Newest write position the client has seen, from header or cookie."""
+    seen = []
+    for value in (request.headers.get(WRITE_LSN_HEADER), request.cookies.get(WRITE_LSN_COOKIE)):
+        try:
+            seen.append(int(value))
+        except (TypeError, ValueError):
+            pass
+    return max(seen, default=None)
+
+
+def mark_written(response: Response, lsn: int):
+    """Have the client send ``lsn`` back with its next requests."""
+    response.headers[WRITE_LSN_HEADER] = str(lsn)
+    response.set_cookie(WRITE_LSN_COOKIE, str(lsn), max_age=3600, httponly=True, samesite="lax")
+
+
+async def write_lsn() -> int:
+    """The primary's current WAL position, covering every committed write."""
+    return await get_pool().fetchval("SELECT (pg_current_wal_lsn() - '0/0'::pg_lsn)::bigint")
+
+
+async def _watch_replica_lag():
+    global _replica_lag, _replica_replayed
+    while True:
+        try:
+            row = await _read_pool.fetchrow(REPLICA_LAG_SQL, timeout=settings.read_replica_lag_check_s * 5)
+            _replica_lag = float(row["lag"]) if row["lag"] is not None else None
+            _replica_replayed = row["replayed"]
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            if _replica_lag is not None:
+                logger.warning("Read replica check failed, reading from the primary: %s", e)
+            _replica_lag = None
+        await asyncio.sleep(settings.read_replica_lag_check_s)
+
+
+async def commit_version(conn, newest_xid_sql: str, *args) -> str:
+    """Data version of a set of rows that follows commit order.
+
+    ``newest_xid_sql`` selects the newest ``_xid`` (the transaction that
+    last wrote a row, see db/migrations/009) among the rows and their
+    tombstones. The version is that xid plus every transaction at or below
+    it that is still running: a later commit touching the rows either
+    carries a newer xid or leaves that running set, so it always yields a
+    new version. Unlike ``max(_modified_at)``, which is the writing
+    transaction's start time, a long transaction cannot commit unnoticed.
+    """
+    row = await conn.fetchrow(
+        f"""SELECT v.m::text AS m,
+                   array(SELECT x::text FROM pg_snapshot_xip(pg_current_snapshot()) AS x
+                         WHERE x <= v.m ORDER BY x) AS running
+            FROM ({newest_xid_sql}) AS v(m)""",
+        *args,
+    )
+    return f"{row['m'] or ''}:{','.join(row['running'])}"
+
+
 @asynccontextmanager
 async def get_connection():
     pool = get_pool()
@@ -37,6 +180,13 @@ async def get_connection():
         yield conn
 
 
+@asynccontextmanager
+async def get_read_connection():
+    pool = get_read_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+
 @asynccontextmanager
 async def get_transaction():
     pool = get_pool()
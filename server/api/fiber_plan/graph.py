@@ -0,0 +1,348 @@
+"""In-memory fiber connectivity graph for batch tracing.
+
+A project's splices and patch connections are loaded once into compact
+arrays: every fiber end ``(cable layer, cable fid, fiber number)`` becomes a
+node id, and the splices and patches touching each node are kept in CSR
+form (an offsets array into one flat index array). Tracing a port is then
+a walk over integer arrays, so thousands of ports can be traced per
+request without touching the database.
+
+The walk follows the same rules as ``tracer.TRACE_SQL``, so a batch trace
+returns the same path as ``GET /fiber-plan/trace/...`` for the same port.
+
+Graphs are cached per project and per API worker. Every change to
+fiber_splices, fiber_splice_trays, fiber_patch_connections or the cable
+tables bumps ``fiber_plan_project_version`` of the projects whose graph
+holds the changed rows (statement triggers, see db/migrations/012),
+whatever wrote it: API routes, sync merges or direct edits. A cached
+graph is used only while its version is current.
+"""
+import asyncio
+import logging
+from array import array
+from collections import OrderedDict
+
+import asyncpg
+
+from config import settings
+from fiber_plan.models import FiberPathOut
+from fiber_plan.tracer import MAX_HOPS, make_path, prefers_aerial_table
+
+logger = logging.getLogger("fiberq.fiber_plan.graph")
+
+_graphs: "OrderedDict[int, FiberGraph]" = OrderedDict()
+_build_locks: dict[int, asyncio.Lock] = {}
+_build_users: dict[int, int] = {}
+
+# Global part bumped by TRUNCATE, per-project part by row changes; both
+# only grow, so their sum moves whenever either does
+VERSION_SQL = """
+SELECT (SELECT version FROM fiber_plan_version)
+       + COALESCE((SELECT version FROM fiber_plan_project_version WHERE project_id = $1), 0)
+"""
+
+# Project membership: splices in the project's closures, plus splices and
+# patches on the project's cables or elements. Layer ids are QGIS layer ids,
+# so fids are matched across both cable tables; extra rows only add nodes
+# that are never reached from the project's ports.
+SPLICES_SQL = """
+WITH project_cables AS (
+    SELECT id FROM ftth_kablovi_podzemni WHERE project_id = $1
+    UNION
+    SELECT id FROM ftth_kablovi_nadzemni WHERE project_id = $1
+)
+SELECT s.id, s.cable_a_layer_id, s.cable_a_fid, s.fiber_a_number,
+       s.cable_b_layer_id, s.cable_b_fid, s.fiber_b_number,
+       s.loss_db, s.status
+FROM fiber_splices s
+LEFT JOIN fiber_splice_trays t ON t.id = s.tray_id
+LEFT JOIN fiber_splice_closures c ON c.id = t.closure_id
+WHERE c.project_id = $1
+   OR s.cable_a_fid IN (SELECT id FROM project_cables)
+   OR s.cable_b_fid IN (SELECT id FROM project_cables)
+ORDER BY s.id
+"""
+
+PATCHES_SQL = """
+WITH project_cables AS (
+    SELECT id FROM ftth_kablovi_podzemni WHERE project_id = $1
+    UNION
+    SELECT id FROM ftth_kablovi_nadzemni WHERE project_id = $1
+)
+SELECT p.id, p.element_layer_id, p.element_fid, p.port_number,
+       p.fiber_cable_layer_id, p.fiber_cable_fid, p.fiber_number, p.status
+FROM fiber_patch_connections p
+WHERE p.fiber_cable_fid IN (SELECT id FROM project_cables)
+   OR p.element_fid IN (SELECT id FROM ftth_elements WHERE project_id = $1)
+   OR (p.fiber_cable_layer_id, p.fiber_cable_fid) IN (
+        SELECT * FROM unnest($2::text[], $3::integer[]))
+ORDER BY p.id
+"""
+
+
+class FiberGraph:
+    """Immutable fiber connectivity of one project."""
+
+    def __init__(self, project_id: int, version: int, splices: list, patches: list,
+                 cables: list = ()):
+        self.project_id = project_id
+        self.version = version
+
+        self._node_ids: dict[tuple, int] = {}
+        self._node_keys: list[tuple] = []
+
+        self.splice_ids = array("i")
+        self.splice_loss = array("d")
+        self.splice_status: list[str | None] = []
+        self._splice_a = array("i")
+        self._splice_b = array("i")
+        for r in splices:
+            self.splice_ids.append(r["id"])
+            self.splice_loss.append(r["loss_db"] or 0.0)
+            self.splice_status.append(r["status"])
+            self._splice_a.append(self._node(r["cable_a_layer_id"], r["cable_a_fid"], r["fiber_a_number"]))
+            self._splice_b.append(self._node(r["cable_b_layer_id"], r["cable_b_fid"], r["fiber_b_number"]))
+
+        self.patch_ids = array("i")
+        self.patch_element_fid = array("i")
+        self.patch_port = array("i")
+        self.patch_layer: list[str | None] = []
+        self.patch_status: list[str | None] = []
+        self._patch_node = array("i")
+        self._ports: dict[tuple[int, int], list[int]] = {}
+        for i, r in enumerate(patches):
+            self.patch_ids.append(r["id"])
+            self.patch_element_fid.append(r["element_fid"] if r["element_fid"] is not None else -1)
+            self.patch_port.append(r["port_number"])
+            self.patch_layer.append(r["element_layer_id"])
+            self.patch_status.append(r["status"])
+            self._patch_node.append(
+                self._node(r["fiber_cable_layer_id"], r["fiber_cable_fid"], r["fiber_number"])
+            )
+            self._ports.setdefault((r["element_fid"], r["port_number"]), []).append(i)
+
+        # Nodes with a NULL part never match in SQL; keep them out of the
+        # adjacency so the walk stops there the same way.
+        live = [None not in key for key in self._node_keys]
+        splice_pairs = []
+        for j in range(len(self.splice_ids)):
+            a, b = self._splice_a[j], self._splice_b[j]
+            if live[a]:
+                splice_pairs.append((a, j))
+            if live[b] and b != a:
+                splice_pairs.append((b, j))
+        self._splice_start, self._splice_adj = _csr(len(self._node_keys), splice_pairs)
+        self._patch_start, self._patch_adj = _csr(
+            len(self._node_keys),
+            [(n, i) for i, n in enumerate(self._patch_node) if live[n]],
+        )
+
+        # Cable length and slack per node, resolved like TRACE_SQL does
+        lengths = {(r["table_name"], r["id"]): (r["length_m"] or 0.0, r["slack_m"] or 0.0)
+                   for r in cables}
+        self._node_length = array("d", bytes(8 * len(self._node_keys)))
+        self._node_slack = array("d", bytes(8 * len(self._node_keys)))
+        for n, (layer_id, cable_fid, _) in enumerate(self._node_keys):
+            aerial = ("ftth_kablovi_nadzemni", cable_fid)
+            underground = ("ftth_kablovi_podzemni", cable_fid)
+            preferred = (aerial, underground) if prefers_aerial_table(layer_id) else (underground, aerial)
+            found = lengths.get(preferred[0]) or lengths.get(preferred[1])
+            if found:
+                self._node_length[n], self._node_slack[n] = found
+
+    def _node(self, layer_id, cable_fid, fiber_number) -> int:
+        key = (layer_id, cable_fid, fiber_number)
+        node = self._node_ids.get(key)
+        if node is None:
+            node = self._node_ids[key] = len(self._node_keys)
+            self._node_keys.append(key)
+        return node
+
+    def ports(self) -> list[tuple[int, int, str | None]]:
+        """Every patch port in the graph as ``(element_fid, port, layer)``."""
+        return [
+            (self.patch_element_fid[i], self.patch_port[i], self.patch_layer[i])
+            for i in range(len(self.patch_ids))
+            if self.patch_element_fid[i] >= 0
+        ]
+
+    def trace(self, start_element_fid: int, start_port_number: int,
+              start_element_layer_id: str = "") -> FiberPathOut | None:
+        """Trace a fiber from a port; same result as ``trace_fiber_path``."""
+        start = next(
+            (i for i in self._ports.get((start_element_fid, start_port_number), ())
+             if not start_element_layer_id or self.patch_layer[i] == start_element_layer_id),
+            None,
+        )
+        if start is None:
+            return None
+
+        node = self._patch_node[start]
+        layer_id, cable_fid, fiber = self._node_keys[node]
+        segments = [{
+            "type": "patch",
+            "element_fid": start_element_fid,
+            "port_number": start_port_number,
+            "cable_fid": cable_fid,
+            "fiber_number": fiber,
+        }]
+        total_loss = 0.0
+        total_length = 0.0
+        db_per_m = settings.fiber_attenuation_db_per_km / 1000.0
+        visited = set()
+        prev = -1
+        end = -1
+
+        for hop in range(MAX_HOPS):
+            layer_id, cable_fid, fiber = self._node_keys[node]
+            if cable_fid is None or fiber is None:
+                break
+            length, slack = self._node_length[node], self._node_slack[node]
+            cable_loss = (length + slack) * db_per_m
+            total_loss += cable_loss
+            total_length += length + slack
+            segments.append({
+                "type": "cable",
+                "cable_layer_id": layer_id,
+                "cable_fid": cable_fid,
+                "fiber_number": fiber,
+                "length_m": round(length, 1),
+                "slack_m": round(slack, 1),
+                "loss_db": round(cable_loss, 3),
+            })
+
+            nxt = -1
+            if hop + 1 < MAX_HOPS:
+                for k in range(self._splice_start[node], self._splice_start[node + 1]):
+                    if self._splice_adj[k] != prev:
+                        nxt = self._splice_adj[k]
+                        break
+            if nxt < 0:
+                end = self._end_patch(node, start_element_fid, start_port_number)
+                break
+            if nxt in visited:
+                logger.debug("Loop detected at splice %s", self.splice_ids[nxt])
+                break
+            visited.add(nxt)
+
+            total_loss += self.splice_loss[nxt]
+            segments.append({
+                "type": "splice",
+                "splice_id": self.splice_ids[nxt],
+                "loss_db": self.splice_loss[nxt],
+                "status": self.splice_status[nxt],
+            })
+            node = self._splice_b[nxt] if self._splice_a[nxt] == node else self._splice_a[nxt]
+            prev = nxt
+
+        end_element_fid = end_port_number = None
+        if end >= 0:
+            end_element_fid = self.patch_element_fid[end]
+            end_port_number = self.patch_port[end]
+            segments.append({
+                "type": "patch",
+                "element_fid": end_element_fid,
+                "port_number": end_port_number,
+                "status": self.patch_status[end],
+            })
+
+        return make_path(
+            start_element_fid, start_port_number,
+            end_element_fid, end_port_number,
+            segments, total_loss, total_length,
+        )
+
+    def _end_patch(self, node: int, start_element_fid: int, start_port_number: int) -> int:
+        for k in range(self._patch_start[node], self._patch_start[node + 1]):
+            i = self._patch_adj[k]
+            # Patches without an element never match in SQL either
+            if self.patch_element_fid[i] < 0:
+                continue
+            if not (self.patch_element_fid[i] == start_element_fid
+                    and self.patch_port[i] == start_port_number):
+                return i
+        return -1
+
+
+def _csr(node_count: int, pairs: list[tuple[int, int]]) -> tuple[array, array]:
+    """Group ``(node, item)`` pairs by node, keeping item order per node."""
+    start = array("i", [0]) * (node_count + 1)
+    for node, _ in pairs:
+        start[node + 1] += 1
+    for n in range(node_count):
+        start[n + 1] += start[n]
+    fill = array("i", start[:-1])
+    adj = array("i", [0]) * len(pairs)
+    for node, item in pairs:
+        adj[fill[node]] = item
+        fill[node] += 1
+    return start, adj
+
+
+async def load_fiber_graph(pool: asyncpg.Pool, project_id: int) -> FiberGraph:
+    """Read a project's splices, patches and cable lengths and build its graph."""
+    async with pool.acquire() as conn:
+        # One snapshot, so the version matches the rows it was built from
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            version = await conn.fetchval(VERSION_SQL, project_id)
+            splices = await conn.fetch(SPLICES_SQL, project_id)
+            cable_keys = {
+                (r[layer], r[fid])
+                for r in splices
+                for layer, fid in (("cable_a_layer_id", "cable_a_fid"),
+                                   ("cable_b_layer_id", "cable_b_fid"))
+                if r[layer] is not None and r[fid] is not None
+            }
+            patches = await conn.fetch(
+                PATCHES_SQL,
+                project_id,
+                [layer for layer, _ in cable_keys],
+                [fid for _, fid in cable_keys],
+            )
+            cable_fids = {
+                fid
+                for r in splices for fid in (r["cable_a_fid"], r["cable_b_fid"])
+                if fid is not None
+            }
+            cable_fids.update(r["fiber_cable_fid"] for r in patches if r["fiber_cable_fid"] is not None)
+            cables = await conn.fetch(
+                """SELECT table_name, id, length_m, slack_m
+                   FROM cable_lengths WHERE id = ANY($1::integer[])""",
+                list(cable_fids),
+            )
+
+    graph = await asyncio.to_thread(FiberGraph, project_id, version, splices, patches, cables)
+    logger.info(
+        "Built fiber graph for project %s: %d splices, %d patches (version %s)",
+        project_id, len(splices), len(patches), version,
+    )
+    return graph
+
+
+async def get_fiber_graph(pool: asyncpg.Pool, project_id: int) -> FiberGraph:
+    """Return the project's graph, rebuilding it if the fiber plan changed."""
+    version = await pool.fetchval(VERSION_SQL, project_id)
+    graph = _graphs.get(project_id)
+    if graph is None or graph.version < version:
+        lock = _build_locks.setdefault(project_id, asyncio.Lock())
+        _build_users[project_id] = _build_users.get(project_id, 0) + 1
+        try:
+            async with lock:
+                graph = _graphs.get(project_id)
+                if graph is None or graph.version < version:
+                    graph = await load_fiber_graph(pool, project_id)
+                    _graphs[project_id] = graph
+        finally:
+            # Dropped by the last waiter only: popping it while others still
+            # hold or await it would let a newcomer build concurrently
+            _build_users[project_id] -= 1
+            if not _build_users[project_id]:
+                del _build_users[project_id]
+                del _build_locks[project_id]
+
+    _graphs.move_to_end(project_id)
+    while len(_graphs) > max(1, settings.fiber_graph_cache_projects):
+        evicted, _ = _graphs.popitem(last=False)
+        logger.debug("Evicted fiber graph for project %s", evicted)
+    return graph
+
@@ -128,3 +128,22 @@ class FiberPathOut(BaseModel):
     total_length_m: float | None
     status: str | None
     path_segments: list | None
+
+
+class TracePort(BaseModel):
+    element_fid: int
+    port_number: int
+    element_layer_id: str = ""
+
+
+class TraceBatchRequest(BaseModel):
+    project_id: int
+    # None traces every patch port of the project
+    ports: list[TracePort] | None = None
+
+
+class TraceBatchItem(BaseModel):
+    element_fid: int
+    port_number: int
+    element_layer_id: str | None
+    path: FiberPathOut | None
@@ -0,0 +1,174 @@
+"""Materialized fiber paths.
+
+``fiber_paths`` keeps one traced path (status ``traced``) per patch port of
+a project, together with the splices and fiber ends it runs through
+(``splice_ids`` and ``fiber_keys``, both GIN indexed). Loss budgets for a
+whole project are then a single indexed read of fiber_paths.
+
+``materialize_project_paths`` recomputes every path of a project from its
+cached fiber graph. Splice and patch writes made through the API run
+``refresh_affected_paths`` after their response, which re-traces only the
+stored paths that ran through the changed splice or over the changed fiber
+ends. Both trace on the project's graph, starting each port from the first
+patch connection on it, so a refreshed path equals a materialized one.
+"""
+import asyncio
+import json
+import logging
+
+import asyncpg
+
+from fiber_plan.graph import get_fiber_graph
+from fiber_plan.models import FiberPathOut
+
+logger = logging.getLogger("fiberq.fiber_plan.paths")
+
+INSERT_PATH_SQL = """
+INSERT INTO fiber_paths
+    (path_name, olt_element_fid, olt_port_number, onu_element_fid, onu_port_number,
+     total_loss_db, total_length_m, path_segments, status, project_id,
+     splice_ids, fiber_keys, _modified_by_sub, _modified_at)
+VALUES ($1, $2, $3, $4, $5, $6, $7, $8::jsonb, 'traced', $9, $10, $11, $12, NOW())
+ON CONFLICT (project_id, olt_element_fid, olt_port_number) WHERE status = 'traced'
+DO UPDATE SET
+    path_name = EXCLUDED.path_name,
+    onu_element_fid = EXCLUDED.onu_element_fid,
+    onu_port_number = EXCLUDED.onu_port_number,
+    total_loss_db = EXCLUDED.total_loss_db,
+    total_length_m = EXCLUDED.total_length_m,
+    path_segments = EXCLUDED.path_segments,
+    splice_ids = EXCLUDED.splice_ids,
+    fiber_keys = EXCLUDED.fiber_keys,
+    _modified_by_sub = EXCLUDED._modified_by_sub,
+    _modified_at = NOW()
+"""
+
+
+def fiber_key(layer_id: str | None, cable_fid: int | None, fiber_number: int | None) -> str | None:
+    """Key of one fiber end as stored in ``fiber_paths.fiber_keys``."""
+    if cable_fid is None or fiber_number is None:
+        return None
+    return f"{cable_fid}:{fiber_number}:{layer_id or ''}"
+
+
+def _port_layers(graph) -> dict[tuple[int, int], str]:
+    """Element layer of the first patch connection on each port."""
+    layers = {}
+    for fid, port, layer in graph.ports():
+        layers.setdefault((fid, port), layer or "")
+    return layers
+
+
+def _path_record(project_id: int, path: FiberPathOut, user_sub: str | None) -> tuple:
+    splice_ids = []
+    fiber_keys = []
+    for seg in path.path_segments or []:
+        if seg["type"] == "splice":
+            splice_ids.append(seg["splice_id"])
+        elif seg["type"] == "cable":
+            key = fiber_key(seg["cable_layer_id"], seg["cable_fid"], seg["fiber_number"])
+            if key:
+                fiber_keys.append(key)
+    return (
+        path.path_name, path.olt_element_fid, path.olt_port_number,
+        path.onu_element_fid, path.onu_port_number,
+        path.total_loss_db, path.total_length_m, json.dumps(path.path_segments),
+        project_id, splice_ids, fiber_keys, user_sub,
+    )
+
+
+async def materialize_project_paths(pool: asyncpg.Pool, project_id: int,
+                                    user_sub: str | None = None) -> int:
+    """Trace every patch port of a project and replace its stored paths."""
+    graph = await get_fiber_graph(pool, project_id)
+
+    def trace_all() -> list[FiberPathOut]:
+        paths = []
+        for (fid, port), layer in _port_layers(graph).items():
+            path = graph.trace(fid, port, layer)
+            if path:
+                paths.append(path)
+        return paths
+
+    paths = await asyncio.to_thread(trace_all)
+    records = [_path_record(project_id, path, user_sub) for path in paths]
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "DELETE FROM fiber_paths WHERE project_id = $1 AND status = 'traced'",
+                project_id,
+            )
+            await conn.executemany(INSERT_PATH_SQL, records)
+
+    logger.info("Materialized %d fiber paths for project %s", len(records), project_id)
+    return len(records)
+
+
+async def refresh_affected_paths(
+    pool: asyncpg.Pool,
+    user_sub: str | None,
+    splice_ids: list[int] = (),
+    fiber_keys: list[str | None] = (),
+    new_ports: list[tuple[int, int]] = (),
+):
+    """Re-trace stored paths that ran through ``splice_ids`` or over
+    ``fiber_keys``; ``new_ports`` (a new patch) are traced and stored in the
+    project of their element.
+
+    Runs after the response of the write (a background task). Errors are
+    logged, not raised: the write has already been committed, and the next
+    materialization repairs any path left stale.
+    """
+    fiber_keys = [k for k in fiber_keys if k]
+    records = []
+    gone = []
+    try:
+        rows = await pool.fetch(
+            """SELECT project_id, olt_element_fid, olt_port_number
+               FROM fiber_paths
+               WHERE status = 'traced'
+                 AND (splice_ids && $1::integer[] OR fiber_keys && $2::text[])""",
+            list(splice_ids),
+            fiber_keys,
+        )
+        targets: dict[int, set[tuple[int, int]]] = {}
+        for r in rows:
+            targets.setdefault(r["project_id"], set()).add((r["olt_element_fid"], r["olt_port_number"]))
+        if new_ports:
+            owners = await pool.fetch(
+                "SELECT id, project_id FROM ftth_elements WHERE id = ANY($1::integer[])",
+                list({fid for fid, _ in new_ports}),
+            )
+            project_of = {r["id"]: r["project_id"] for r in owners}
+            for fid, port in new_ports:
+                if project_of.get(fid) is not None:
+                    targets.setdefault(project_of[fid], set()).add((fid, port))
+
+        for project_id, ports in targets.items():
+            graph = await get_fiber_graph(pool, project_id)
+            layers = _port_layers(graph)
+            for fid, port in ports:
+                path = graph.trace(fid, port, layers.get((fid, port), ""))
+                if path:
+                    records.append(_path_record(project_id, path, user_sub))
+                else:
+                    gone.append((project_id, fid, port))
+
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if gone:
+                    await conn.executemany(
+                        """DELETE FROM fiber_paths
+                           WHERE status = 'traced' AND project_id = $1
+                             AND olt_element_fid = $2 AND olt_port_number = $3""",
+                        gone,
+                    )
+                if records:
+                    await conn.executemany(INSERT_PATH_SQL, records)
+    except Exception as e:
+        logger.warning("Failed to refresh fiber paths: %s", e)
+        return
+
+    if records or gone:
+        logger.info("Refreshed %d fiber paths (%d removed)", len(records), len(gone))
@@ -1,16 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
 
-from database import get_pool
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+
+from config import settings
+from database import get_pool, get_read_pool
+from pagination import Page, page_params
 from auth.zitadel import get_current_user
 from auth.models import UserInfo
-from auth.roles import require_any_role
+from auth.roles import require_any_role, require_engineer_or_admin
 from fiber_plan.models import (
     SpliceClosureCreate, SpliceClosureOut,
     SpliceTrayCreate, SpliceTrayOut,
     SpliceCreate, SpliceOut,
     PatchConnectionCreate, PatchConnectionOut,
     FiberPathOut,
+    TraceBatchRequest, TraceBatchItem,
 )
+from fiber_plan.graph import get_fiber_graph
+from fiber_plan.paths import fiber_key, materialize_project_paths, refresh_affected_paths
 from fiber_plan.tracer import trace_fiber_path
 
 router = APIRouter()
@@ -21,15 +29,23 @@ router = APIRouter()
 @router.get("/closures", response_model=list[SpliceClosureOut])
 async def list_closures(
     project_id: int,
+    page: Page = Depends(page_params),
     user: UserInfo = Depends(get_current_user),
 ):
-    pool = get_pool()
+    pool = get_read_pool()
+    sort = ["id"]
+    params = [project_id]
+    columns = page.columns(
+        "id, muf_fid, closure_type, closure_model, tray_count, max_splices, project_id",
+        SpliceClosureOut, sort,
+    )
     rows = await pool.fetch(
-        """SELECT id, muf_fid, closure_type, closure_model, tray_count, max_splices, project_id
-           FROM fiber_splice_closures WHERE project_id = $1 ORDER BY id""",
-        project_id,
+        f"""SELECT {columns}
+           FROM fiber_splice_closures WHERE project_id = $1 AND {page.where(sort, params)}"""
+        + page.order_limit(sort, params),
+        *params,
     )
-    return [SpliceClosureOut(**dict(r)) for r in rows]
+    return page.result(rows, SpliceClosureOut, sort)
 
 
 @router.post("/closures", response_model=SpliceClosureOut, status_code=201)
@@ -53,7 +69,7 @@ async def create_closure(
 
 @router.get("/closures/{closure_id}/trays", response_model=list[SpliceTrayOut])
 async def list_trays(closure_id: int, user: UserInfo = Depends(get_current_user)):
-    pool = get_pool()
+    pool = get_read_pool()
     rows = await pool.fetch(
         "SELECT id, closure_id, tray_number, tray_type, capacity FROM fiber_splice_trays WHERE closure_id = $1 ORDER BY tray_number",
         closure_id,
@@ -83,31 +99,42 @@ async def create_tray(
 async def list_splices(
     tray_id: int | None = None,
     closure_id: int | None = None,
+    page: Page = Depends(page_params),
     user: UserInfo = Depends(get_current_user),
 ):
-    pool = get_pool()
+    pool = get_read_pool()
     if tray_id:
-        rows = await pool.fetch(
-            """SELECT * FROM fiber_splices WHERE tray_id = $1 ORDER BY position_in_tray""",
-            tray_id,
+        sort = ["s.position_in_tray"]
+        params = [tray_id]
+        query = (
+            f"""SELECT {page.columns("s.*", SpliceOut, sort, prefix="s.")}
+               FROM fiber_splices s
+               WHERE s.tray_id = $1 AND {page.where(sort, params)}"""
+            + page.order_limit(sort, params)
         )
     elif closure_id:
-        rows = await pool.fetch(
-            """SELECT s.* FROM fiber_splices s
+        sort = ["t.tray_number", "s.position_in_tray"]
+        params = [closure_id]
+        query = (
+            f"""SELECT {page.columns("s.*", SpliceOut, sort, prefix="s.")}
+               FROM fiber_splices s
                JOIN fiber_splice_trays t ON s.tray_id = t.id
-               WHERE t.closure_id = $1
-               ORDER BY t.tray_number, s.position_in_tray""",
-            closure_id,
+               WHERE t.closure_id = $1 AND {page.where(sort, params)}"""
+            + page.order_limit(sort, params)
         )
     else:
         raise HTTPException(status_code=400, detail="Provide tray_id or closure_id")
 
-    return [SpliceOut(**dict(r)) for r in rows]
+    if page.ndjson:
+        return page.stream(query, params, SpliceOut, pool=pool)
+    rows = await pool.fetch(query, *params)
+    return page.result(rows, SpliceOut, sort)
 
 
 @router.post("/splices", response_model=SpliceOut, status_code=201)
 async def create_splice(
     body: SpliceCreate,
+    background_tasks: BackgroundTasks,
     user: UserInfo = Depends(require_any_role),
 ):
     pool = get_pool()
@@ -126,6 +153,9 @@ async def create_splice(
         body.tube_b_number, body.tube_b_color,
         body.splice_type, body.loss_db, body.status, body.notes, user.sub,
     )
+    background_tasks.add_task(
+        refresh_affected_paths, pool, user.sub, fiber_keys=_splice_fiber_keys(body),
+    )
     return SpliceOut(**dict(row))
 
 
@@ -133,6 +163,7 @@ async def create_splice(
 async def update_splice(
     splice_id: int,
     body: SpliceCreate,
+    background_tasks: BackgroundTasks,
     user: UserInfo = Depends(require_any_role),
 ):
     pool = get_pool()
@@ -156,9 +187,21 @@ async def update_splice(
     )
     if not row:
         raise HTTPException(status_code=404, detail="Splice not found")
+    # Paths through the splice's old fibers and paths reaching its new ones
+    background_tasks.add_task(
+        refresh_affected_paths,
+        pool, user.sub, splice_ids=[splice_id], fiber_keys=_splice_fiber_keys(body),
+    )
     return SpliceOut(**dict(row))
 
 
+def _splice_fiber_keys(body: SpliceCreate) -> list[str | None]:
+    return [
+        fiber_key(body.cable_a_layer_id, body.cable_a_fid, body.fiber_a_number),
+        fiber_key(body.cable_b_layer_id, body.cable_b_fid, body.fiber_b_number),
+    ]
+
+
 # --- Patch Connections -------------------------------------------------------
 
 @router.get("/patches", response_model=list[PatchConnectionOut])
@@ -167,7 +210,7 @@ async def list_patches(
     element_layer_id: str,
     user: UserInfo = Depends(get_current_user),
 ):
-    pool = get_pool()
+    pool = get_read_pool()
     rows = await pool.fetch(
         """SELECT id, element_layer_id, element_fid, port_number,
                   fiber_cable_layer_id, fiber_cable_fid, fiber_number,
@@ -183,6 +226,7 @@ async def list_patches(
 @router.post("/patches", response_model=PatchConnectionOut, status_code=201)
 async def create_patch(
     body: PatchConnectionCreate,
+    background_tasks: BackgroundTasks,
     user: UserInfo = Depends(require_any_role),
 ):
     pool = get_pool()
@@ -199,6 +243,12 @@ async def create_patch(
         body.fiber_cable_layer_id, body.fiber_cable_fid, body.fiber_number,
         body.fiber_color, body.connector_type, body.status, user.sub,
     )
+    background_tasks.add_task(
+        refresh_affected_paths,
+        pool, user.sub,
+        fiber_keys=[fiber_key(body.fiber_cable_layer_id, body.fiber_cable_fid, body.fiber_number)],
+        new_ports=[(body.element_fid, body.port_number)],
+    )
     return PatchConnectionOut(**dict(row))
 
 
@@ -212,24 +262,87 @@ async def trace_fiber(
     user: UserInfo = Depends(get_current_user),
 ):
     """Trace a fiber end-to-end from an element port through splices to the other end."""
-    pool = get_pool()
+    pool = get_read_pool()
     path = await trace_fiber_path(pool, element_fid, port_number, element_layer_id)
     if not path:
         raise HTTPException(status_code=404, detail="No fiber path found from this port")
     return path
 
 
+@router.post("/trace/batch", response_model=list[TraceBatchItem])
+async def trace_batch(
+    body: TraceBatchRequest,
+    user: UserInfo = Depends(get_current_user),
+):
+    """Trace many ports of one project (all patch ports when ``ports`` is
+    omitted) against the project's cached fiber graph."""
+    if body.ports is not None and len(body.ports) > settings.fiber_trace_batch_max:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many ports (max {settings.fiber_trace_batch_max})",
+        )
+
+    pool = get_read_pool()
+    graph = await get_fiber_graph(pool, body.project_id)
+    if body.ports is None:
+        ports = graph.ports()
+        if len(ports) > settings.fiber_trace_batch_max:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Project has {len(ports)} ports (max {settings.fiber_trace_batch_max}); "
+                       "pass them in batches",
+            )
+    else:
+        ports = [(p.element_fid, p.port_number, p.element_layer_id) for p in body.ports]
+
+    paths = await asyncio.to_thread(
+        lambda: [graph.trace(fid, port, layer or "") for fid, port, layer in ports]
+    )
+    return [
+        TraceBatchItem(element_fid=fid, port_number=port, element_layer_id=layer, path=path)
+        for (fid, port, layer), path in zip(ports, paths)
+    ]
+
+
 @router.get("/paths", response_model=list[FiberPathOut])
 async def list_paths(
     project_id: int,
+    page: Page = Depends(page_params),
     user: UserInfo = Depends(get_current_user),
 ):
-    pool = get_pool()
-    rows = await pool.fetch(
-        """SELECT id, path_name, olt_element_fid, olt_port_number,
+    pool = get_read_pool()
+    sort = ["id"]
+    params = [project_id]
+    columns = page.columns(
+        """id, path_name, olt_element_fid, olt_port_number,
                   onu_element_fid, onu_port_number,
-                  total_loss_db, total_length_m, status, path_segments
-           FROM fiber_paths WHERE project_id = $1 ORDER BY id""",
-        project_id,
+                  total_loss_db, total_length_m, status, path_segments""",
+        FiberPathOut, sort,
+    )
+    query = (
+        f"""SELECT {columns}
+           FROM fiber_paths WHERE project_id = $1 AND {page.where(sort, params)}"""
+        + page.order_limit(sort, params)
     )
-    return [FiberPathOut(**dict(r)) for r in rows]
+    if page.ndjson:
+        return page.stream(query, params, FiberPathOut, decode=_path_fields, pool=pool)
+    rows = await pool.fetch(query, *params)
+    return page.result(rows, FiberPathOut, sort, decode=_path_fields)
+
+
+def _path_fields(row) -> dict:
+    data = dict(row)
+    if data.get("path_segments"):
+        data["path_segments"] = json.loads(data["path_segments"])
+    return data
+
+
+@router.post("/paths/materialize")
+async def materialize_paths(
+    project_id: int,
+    user: UserInfo = Depends(require_engineer_or_admin),
+):
+    """Trace every patch port of the project and store the paths."""
+    pool = get_pool()
+    count = await materialize_project_paths(pool, project_id, user.sub)
+    return {"project_id": project_id, "paths": count}
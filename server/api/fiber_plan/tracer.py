@@ -1,19 +1,123 @@
 """End-to-end fiber path tracing algorithm.
 
 Traces a fiber from a starting element port through patch connections,
-cables, and splice closures to find the complete path.
+cables, and splice closures to find the complete path. The whole walk runs
+in the database as one recursive query, so a trace costs one round-trip
+regardless of path length.
+
+Cable lengths come from the ``cable_lengths`` view: ``length_m`` plus
+``slack_m`` is the cable's ``total_len_m``, i.e. the length entered for it
+or else the geodesic ``ST_Length`` plus slack (kept up to date by a
+trigger). Each cable segment also reports its attenuation at
+``settings.fiber_attenuation_db_per_km``.
 """
-import json
 import logging
+import re
 
 import asyncpg
 
+from config import settings
 from fiber_plan.models import FiberPathOut
 
 logger = logging.getLogger("fiberq.fiber_plan.tracer")
 
 MAX_HOPS = 100  # safety limit
 
+# Splices and patches reference cables by QGIS layer id, which starts with
+# the layer name. Cable fids are looked up in ``cable_lengths`` (both cable
+# tables); when a fid exists in both, the layer name decides.
+AERIAL_LAYER_PATTERN = "nadzem|vazdus"
+
+
+def prefers_aerial_table(layer_id: str | None) -> bool:
+    """Whether a cable layer id points at ftth_kablovi_nadzemni."""
+    return bool(re.search(AERIAL_LAYER_PATTERN, layer_id or "", re.IGNORECASE))
+
+
+# One round-trip per trace: the walk over splices is a recursive CTE and
+# the end patch is looked up for the last hop in the same statement.
+#   $1 start element fid, $2 start port, $3 start element layer ('' = any),
+#   $4 max hops, $5 attenuation dB/km, $6 AERIAL_LAYER_PATTERN
+TRACE_SQL = """
+WITH RECURSIVE start AS (
+    SELECT fiber_cable_layer_id, fiber_cable_fid, fiber_number
+    FROM fiber_patch_connections
+    WHERE element_fid = $1 AND port_number = $2
+      AND ($3 = '' OR element_layer_id = $3)
+    LIMIT 1
+),
+walk AS (
+    SELECT 0 AS hop,
+           NULL::integer AS splice_id,
+           NULL::real AS splice_loss,
+           NULL::text AS splice_status,
+           fiber_cable_layer_id AS cable_layer,
+           fiber_cable_fid AS cable_fid,
+           fiber_number AS fiber,
+           ARRAY[]::integer[] AS visited,
+           false AS is_loop
+    FROM start
+  UNION ALL
+    SELECT w.hop + 1,
+           s.id,
+           s.loss_db,
+           s.status,
+           CASE WHEN s.from_a THEN s.cable_b_layer_id ELSE s.cable_a_layer_id END,
+           CASE WHEN s.from_a THEN s.cable_b_fid ELSE s.cable_a_fid END,
+           CASE WHEN s.from_a THEN s.fiber_b_number ELSE s.fiber_a_number END,
+           w.visited || s.id,
+           s.id = ANY(w.visited)
+    FROM walk w
+    CROSS JOIN LATERAL (
+        -- Next splice on this fiber, other than the one we arrived through
+        SELECT sp.*,
+               (sp.cable_a_layer_id = w.cable_layer AND sp.cable_a_fid = w.cable_fid
+                AND sp.fiber_a_number = w.fiber) AS from_a
+        FROM fiber_splices sp
+        WHERE ((sp.cable_a_layer_id = w.cable_layer AND sp.cable_a_fid = w.cable_fid
+                AND sp.fiber_a_number = w.fiber)
+            OR (sp.cable_b_layer_id = w.cable_layer AND sp.cable_b_fid = w.cable_fid
+                AND sp.fiber_b_number = w.fiber))
+          AND sp.id IS DISTINCT FROM w.splice_id
+        ORDER BY sp.id
+        LIMIT 1
+    ) s
+    WHERE NOT w.is_loop
+      AND w.cable_fid IS NOT NULL AND w.fiber IS NOT NULL
+      AND w.hop + 1 < $4
+)
+SELECT w.hop, w.splice_id, w.splice_loss, w.splice_status,
+       w.cable_layer, w.cable_fid, w.fiber, w.is_loop,
+       COALESCE(cl.length_m, 0) AS cable_length_m,
+       COALESCE(cl.slack_m, 0) AS cable_slack_m,
+       (COALESCE(cl.length_m, 0) + COALESCE(cl.slack_m, 0)) / 1000.0 * $5::float8
+           AS cable_loss_db,
+       e.element_fid AS end_element_fid,
+       e.port_number AS end_port_number,
+       e.status AS end_status
+FROM walk w
+LEFT JOIN LATERAL (
+    SELECT c.length_m, c.slack_m
+    FROM cable_lengths c
+    WHERE c.id = w.cable_fid
+    ORDER BY (c.table_name = 'ftth_kablovi_nadzemni')
+             = (COALESCE(w.cable_layer, '') ~* $6) DESC
+    LIMIT 1
+) cl ON true
+LEFT JOIN LATERAL (
+    SELECT p.element_fid, p.port_number, p.status
+    FROM fiber_patch_connections p
+    WHERE w.hop = (SELECT max(hop) FROM walk)
+      AND NOT w.is_loop
+      AND p.fiber_cable_layer_id = w.cable_layer
+      AND p.fiber_cable_fid = w.cable_fid
+      AND p.fiber_number = w.fiber
+      AND NOT (p.element_fid = $1 AND p.port_number = $2)
+    LIMIT 1
+) e ON true
+ORDER BY w.hop
+"""
+
 
 async def trace_fiber_path(
     pool: asyncpg.Pool,
@@ -23,136 +127,105 @@ async def trace_fiber_path(
 ) -> FiberPathOut | None:
     """Trace a fiber from a starting port through the network.
 
-    Algorithm:
+    Algorithm (evaluated server-side by ``TRACE_SQL``):
     1. Start at a patch connection (element port)
     2. Follow the cable + fiber number to the next splice or patch
     3. At a splice, follow the other side (A→B or B→A)
-    4. Continue until reaching another patch connection (endpoint) or dead end
+    4. Continue until reaching another patch connection (endpoint), a dead
+       end, a splice already visited (loop) or ``MAX_HOPS`` cables
     """
     async with pool.acquire() as conn:
-        # Find starting patch connection
-        if start_element_layer_id:
-            start_patch = await conn.fetchrow(
-                """SELECT * FROM fiber_patch_connections
-                   WHERE element_fid = $1 AND port_number = $2 AND element_layer_id = $3""",
-                start_element_fid, start_port_number, start_element_layer_id,
-            )
-        else:
-            start_patch = await conn.fetchrow(
-                """SELECT * FROM fiber_patch_connections
-                   WHERE element_fid = $1 AND port_number = $2""",
-                start_element_fid, start_port_number,
-            )
-
-        if not start_patch:
-            return None
-
-        segments = []
-        total_loss = 0.0
-        total_length = 0.0
-        visited_splices = set()
-
-        current_cable_layer = start_patch["fiber_cable_layer_id"]
-        current_cable_fid = start_patch["fiber_cable_fid"]
-        current_fiber_num = start_patch["fiber_number"]
-
-        # Add initial patch segment
+        rows = await conn.fetch(
+            TRACE_SQL,
+            start_element_fid, start_port_number, start_element_layer_id or "", MAX_HOPS,
+            settings.fiber_attenuation_db_per_km, AERIAL_LAYER_PATTERN,
+        )
+
+    if not rows:
+        return None
+
+    segments = [{
+        "type": "patch",
+        "element_fid": start_element_fid,
+        "port_number": start_port_number,
+        "cable_fid": rows[0]["cable_fid"],
+        "fiber_number": rows[0]["fiber"],
+    }]
+    total_loss = 0.0
+    total_length = 0.0
+
+    for row in rows:
+        if row["is_loop"]:
+            logger.debug("Loop detected at splice %s", row["splice_id"])
+            break
+
+        if row["hop"] > 0:
+            splice_loss = row["splice_loss"] or 0.0
+            total_loss += splice_loss
+            segments.append({
+                "type": "splice",
+                "splice_id": row["splice_id"],
+                "loss_db": splice_loss,
+                "status": row["splice_status"],
+            })
+
+        if row["cable_fid"] is None or row["fiber"] is None:
+            break
+
+        cable_loss = row["cable_loss_db"]
+        total_loss += cable_loss
+        total_length += row["cable_length_m"] + row["cable_slack_m"]
         segments.append({
-            "type": "patch",
-            "element_fid": start_element_fid,
-            "port_number": start_port_number,
-            "cable_fid": current_cable_fid,
-            "fiber_number": current_fiber_num,
+            "type": "cable",
+            "cable_layer_id": row["cable_layer"],
+            "cable_fid": row["cable_fid"],
+            "fiber_number": row["fiber"],
+            "length_m": round(row["cable_length_m"], 1),
+            "slack_m": round(row["cable_slack_m"], 1),
+            "loss_db": round(cable_loss, 3),
         })
 
-        end_element_fid = None
-        end_port_number = None
+    last = rows[-1]
+    end_element_fid = last["end_element_fid"]
+    end_port_number = last["end_port_number"]
+    if end_element_fid is not None:
+        segments.append({
+            "type": "patch",
+            "element_fid": end_element_fid,
+            "port_number": end_port_number,
+            "status": last["end_status"],
+        })
 
-        for hop in range(MAX_HOPS):
-            if current_cable_fid is None or current_fiber_num is None:
-                break
+    return make_path(
+        start_element_fid, start_port_number,
+        end_element_fid, end_port_number,
+        segments, total_loss, total_length,
+    )
 
-            # Add cable segment
-            segments.append({
-                "type": "cable",
-                "cable_layer_id": current_cable_layer,
-                "cable_fid": current_cable_fid,
-                "fiber_number": current_fiber_num,
-            })
 
-            # Find splice where this fiber connects
-            splice = await conn.fetchrow(
-                """SELECT * FROM fiber_splices
-                   WHERE (cable_a_layer_id = $1 AND cable_a_fid = $2 AND fiber_a_number = $3)
-                      OR (cable_b_layer_id = $1 AND cable_b_fid = $2 AND fiber_b_number = $3)""",
-                current_cable_layer, current_cable_fid, current_fiber_num,
-            )
-
-            if splice:
-                splice_id = splice["id"]
-                if splice_id in visited_splices:
-                    break  # loop detected
-                visited_splices.add(splice_id)
-
-                splice_loss = splice["loss_db"] or 0.0
-                total_loss += splice_loss
-
-                # Determine which side we came from and follow the other side
-                if (splice["cable_a_layer_id"] == current_cable_layer
-                        and splice["cable_a_fid"] == current_cable_fid
-                        and splice["fiber_a_number"] == current_fiber_num):
-                    # Came from side A → follow to side B
-                    current_cable_layer = splice["cable_b_layer_id"]
-                    current_cable_fid = splice["cable_b_fid"]
-                    current_fiber_num = splice["fiber_b_number"]
-                else:
-                    # Came from side B → follow to side A
-                    current_cable_layer = splice["cable_a_layer_id"]
-                    current_cable_fid = splice["cable_a_fid"]
-                    current_fiber_num = splice["fiber_a_number"]
-
-                segments.append({
-                    "type": "splice",
-                    "splice_id": splice_id,
-                    "loss_db": splice_loss,
-                    "status": splice["status"],
-                })
-                continue
-
-            # No splice found - check for endpoint patch connection
-            end_patch = await conn.fetchrow(
-                """SELECT * FROM fiber_patch_connections
-                   WHERE fiber_cable_layer_id = $1 AND fiber_cable_fid = $2 AND fiber_number = $3
-                   AND NOT (element_fid = $4 AND port_number = $5)""",
-                current_cable_layer, current_cable_fid, current_fiber_num,
-                start_element_fid, start_port_number,
-            )
-
-            if end_patch:
-                end_element_fid = end_patch["element_fid"]
-                end_port_number = end_patch["port_number"]
-                segments.append({
-                    "type": "patch",
-                    "element_fid": end_element_fid,
-                    "port_number": end_port_number,
-                    "status": end_patch["status"],
-                })
-
-            break  # end of path
-
-        path_name = f"Port {start_element_fid}/{start_port_number}"
-        if end_element_fid:
-            path_name += f" → Port {end_element_fid}/{end_port_number}"
-
-        return FiberPathOut(
-            id=0,
-            path_name=path_name,
-            olt_element_fid=start_element_fid,
-            olt_port_number=start_port_number,
-            onu_element_fid=end_element_fid,
-            onu_port_number=end_port_number,
-            total_loss_db=round(total_loss, 3),
-            total_length_m=round(total_length, 1),
-            status="traced",
-            path_segments=segments,
-        )
+def make_path(
+    start_element_fid: int,
+    start_port_number: int,
+    end_element_fid: int | None,
+    end_port_number: int | None,
+    segments: list,
+    total_loss: float,
+    total_length: float,
+) -> FiberPathOut:
+    """Build the (unsaved) path for a finished trace."""
+    path_name = f"Port {start_element_fid}/{start_port_number}"
+    if end_element_fid:
+        path_name += f" → Port {end_element_fid}/{end_port_number}"
+
+    return FiberPathOut(
+        id=0,
+        path_name=path_name,
+        olt_element_fid=start_element_fid,
+        olt_port_number=start_port_number,
+        onu_element_fid=end_element_fid,
+        onu_port_number=end_port_number,
+        total_loss_db=round(total_loss, 3),
+        total_length_m=round(total_length, 1),
+        status="traced",
+        path_segments=segments,
+    )
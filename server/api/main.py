@@ -2,11 +2,19 @@ import logging
 import os
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from config import settings
-from database import create_pool, close_pool
+from database import (
+    WRITE_LSN_HEADER, client_write_lsn, create_pool, close_pool, has_read_replica,
+    mark_written, read_after, write_lsn,
+)
+from auth.zitadel import close_http_client
+from sync.jobs import start_job_queue, stop_job_queue
+from changes.feed import start_change_feed, stop_change_feed
+from sync.uploads import start_upload_sweeper, stop_upload_sweeper
 
 logger = logging.getLogger("fiberq")
 
@@ -21,12 +29,25 @@ async def lifespan(app: FastAPI):
 
     os.makedirs(settings.storage_photos_dir, exist_ok=True)
     os.makedirs(settings.storage_gpkg_dir, exist_ok=True)
+    os.makedirs(settings.storage_tiles_dir, exist_ok=True)
 
     await create_pool()
     logger.info("Database pool created")
 
+    await start_job_queue()
+    logger.info("Sync job queue started")
+
+    start_change_feed()
+    logger.info("Change feed started")
+
+    start_upload_sweeper()
+
     yield
 
+    await stop_upload_sweeper()
+    await stop_change_feed()
+    await stop_job_queue()
+    await close_http_client()
     await close_pool()
     logger.info("Database pool closed")
 
@@ -36,6 +57,7 @@ app = FastAPI(
     description="REST API for FiberQ fiber optic network management",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -44,9 +66,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursor of the next page of list routes (see pagination.py)
+    expose_headers=["X-Next-Cursor", WRITE_LSN_HEADER],
 )
 
 
+@app.middleware("http")
+async def track_writes(request: Request, call_next):
+    """Read-your-writes across API workers (see ``database.get_read_pool``)."""
+    read_after(client_write_lsn(request))
+    response = await call_next(request)
+    if (
+        has_read_replica()
+        and request.method not in ("GET", "HEAD", "OPTIONS")
+        and response.status_code < 400
+        and getattr(request.state, "user", None) is not None
+    ):
+        mark_written(response, await write_lsn())
+    return response
+
+
 @app.get("/health")
 async def health_check():
     from database import get_pool
@@ -61,11 +100,17 @@ async def health_check():
 from auth.routes import router as auth_router
 from projects.routes import router as projects_router
 from sync.routes import router as sync_router
+from sync.uploads import router as sync_uploads_router
 from fiber_plan.routes import router as fiber_plan_router
 from work_orders.routes import router as work_orders_router
+from tiles.routes import router as tiles_router
+from changes.routes import router as changes_router
 
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(projects_router, prefix="/projects", tags=["projects"])
 app.include_router(sync_router, prefix="/sync", tags=["sync"])
+app.include_router(sync_uploads_router, prefix="/sync/uploads", tags=["sync"])
 app.include_router(fiber_plan_router, prefix="/fiber-plan", tags=["fiber-plan"])
 app.include_router(work_orders_router, prefix="/work-orders", tags=["work-orders"])
+app.include_router(tiles_router, prefix="/tiles", tags=["tiles"])
+app.include_router(changes_router, prefix="/ws", tags=["changes"])
@@ -0,0 +1,167 @@
+"""Keyset pagination and field projection for list endpoints.
+
+List routes accept:
+- ``limit``: page size. Without it the whole list is returned as before.
+- ``after``: opaque cursor from the previous page's ``X-Next-Cursor``
+  response header. The header is only set when more rows follow.
+- ``fields``: comma-separated subset of the response model's fields.
+
+With ``Accept: application/x-ndjson`` the rows are streamed instead (see
+``streaming``).
+
+Pages are sorted by a fixed key per route (e.g. ``id``) and continued with
+a row comparison on that key, ``(a, b) > ($n, $m)``, so every page is an
+index range scan instead of an ever-growing OFFSET.
+"""
+import base64
+import json
+from datetime import datetime
+from functools import lru_cache
+
+from fastapi import HTTPException, Query, Request, Response
+from pydantic import BaseModel, TypeAdapter, create_model
+
+from config import settings
+from streaming import ndjson_response, wants_ndjson
+
+
+class Page:
+    """Pagination and projection parameters of one list request."""
+
+    def __init__(self, limit: int | None, after: str | None, fields: str | None,
+                 ndjson: bool = False):
+        self.limit = limit
+        self.ndjson = ndjson
+        self.after = _decode_cursor(after) if after else None
+        self.fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
+    def columns(self, default: str, model: type[BaseModel],
+                sort_keys: list[str], prefix: str = "") -> str:
+        """SELECT list: the requested fields (or ``default``) plus the sort key."""
+        if self.fields:
+            unknown = [f for f in self.fields if f not in model.model_fields]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+            selected = [f"{prefix}{f}" for f in self.fields]
+        else:
+            selected = [default]
+        present = {c.strip() for c in ", ".join(selected).split(",")}
+        for key in sort_keys:
+            table, _, column = key.rpartition(".")
+            star = f"{table}.*" if table else "*"
+            if not present & {key, column, star}:
+                selected.append(key)
+        return ", ".join(selected)
+
+    def where(self, sort_keys: list[str], params: list, descending: bool = False) -> str:
+        """Keyset condition continuing after the cursor (``TRUE`` on page 1).
+
+        Cursor values are appended to ``params``.
+        """
+        if self.after is None:
+            return "TRUE"
+        if len(self.after) != len(sort_keys):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        placeholders = []
+        for value in self.after:
+            params.append(value)
+            placeholders.append(f"${len(params)}")
+        op = "<" if descending else ">"
+        return f"({', '.join(sort_keys)}) {op} ({', '.join(placeholders)})"
+
+    def order_limit(self, sort_keys: list[str], params: list,
+                    descending: bool = False) -> str:
+        """ORDER BY on the sort key, fetching one extra row to detect more.
+
+        The limit is a bind parameter appended to ``params``, so the query
+        text (and its prepared statement) is the same for every page size.
+        """
+        direction = " DESC" if descending else ""
+        sql = " ORDER BY " + ", ".join(f"{key}{direction}" for key in sort_keys)
+        if self.limit:
+            params.append(self.limit + 1)
+            sql += f" LIMIT ${len(params)}"
+        return sql
+
+    def result(self, rows, model: type[BaseModel], sort_keys: list[str], decode=dict):
+        """Trim the page, set ``X-Next-Cursor`` and project each row.
+
+        The rows are validated and serialized by ``model`` (restricted to
+        the requested fields) in one pydantic-core pass over the list, the
+        same checks and filtering the route's ``response_model`` applies to
+        returned data, which FastAPI skips for a ``Response``. ``decode``
+        turns a record into a field dict.
+        """
+        headers = {}
+        if self.limit and len(rows) > self.limit:
+            rows = rows[:self.limit]
+            last = rows[-1]
+            headers["X-Next-Cursor"] = _encode_cursor(
+                [last[key.rsplit(".", 1)[-1]] for key in sort_keys]
+            )
+
+        fields = tuple(self.fields or model.model_fields)
+        items = []
+        for r in rows:
+            data = decode(r)
+            items.append({f: data[f] for f in fields})
+        adapter = _list_adapter(model, fields)
+        return Response(
+            content=adapter.dump_json(adapter.validate_python(items)),
+            media_type="application/json",
+            headers=headers,
+        )
+
+    def stream(self, query: str, params: list, model: type[BaseModel], decode=dict,
+               pool=None):
+        """NDJSON response for the page (no cursor header: the client
+        continues from the last streamed row)."""
+        return ndjson_response(
+            query, params, decode,
+            fields=self.fields or list(model.model_fields),
+            limit=self.limit,
+            pool=pool,
+        )
+
+
+def page_params(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=settings.list_max_limit),
+    after: str | None = Query(None, description="Cursor from X-Next-Cursor"),
+    fields: str | None = Query(None, description="Comma-separated fields to return"),
+) -> Page:
+    """FastAPI dependency for list routes."""
+    return Page(limit, after, fields, ndjson=wants_ndjson(request))
+
+
+@lru_cache(maxsize=256)
+def _list_adapter(model: type[BaseModel], fields: tuple[str, ...]) -> TypeAdapter:
+    """Validator of a list of ``model`` rows holding only ``fields``."""
+    if fields != tuple(model.model_fields):
+        model = create_model(
+            f"{model.__name__}Fields",
+            __config__=model.model_config,
+            **{f: (model.model_fields[f].annotation, model.model_fields[f]) for f in fields},
+        )
+    return TypeAdapter(list[model])
+
+
+def _encode_cursor(values: list) -> str:
+    payload = {
+        "v": [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        "d": [i for i, v in enumerate(values) if isinstance(v, datetime)],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = list(payload["v"])
+        for i in payload.get("d", []):
+            values[i] = datetime.fromisoformat(values[i])
+        return values
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
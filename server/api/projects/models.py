@@ -19,3 +19,8 @@ class ProjectOut(BaseModel):
     description: str | None
     created_at: datetime
     created_by_sub: str | None
+
+
+class ProjectDetailOut(ProjectOut):
+    # [min_lon, min_lat, max_lon, max_lat] of the project's features
+    bbox: list[float] | None = None
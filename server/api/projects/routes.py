@@ -1,21 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException
 
-from database import get_pool
+from database import get_pool, get_read_pool
+from pagination import Page, page_params
 from auth.zitadel import get_current_user
 from auth.models import UserInfo
 from auth.roles import require_engineer_or_admin
-from projects.models import ProjectCreate, ProjectUpdate, ProjectOut
+from projects.models import ProjectCreate, ProjectUpdate, ProjectOut, ProjectDetailOut
 
 router = APIRouter()
 
 
 @router.get("/", response_model=list[ProjectOut])
-async def list_projects(user: UserInfo = Depends(get_current_user)):
-    pool = get_pool()
+async def list_projects(
+    page: Page = Depends(page_params),
+    user: UserInfo = Depends(get_current_user),
+):
+    pool = get_read_pool()
+    sort = ["id"]
+    params = []
+    columns = page.columns("id, name, description, created_at, created_by_sub", ProjectOut, sort)
     rows = await pool.fetch(
-        "SELECT id, name, description, created_at, created_by_sub FROM projects ORDER BY id"
+        f"SELECT {columns} FROM projects WHERE {page.where(sort, params)}"
+        + page.order_limit(sort, params),
+        *params,
     )
-    return [ProjectOut(**dict(r)) for r in rows]
+    return page.result(rows, ProjectOut, sort)
 
 
 @router.post("/", response_model=ProjectOut, status_code=201)
@@ -35,19 +44,24 @@ async def create_project(
     return ProjectOut(**dict(row))
 
 
-@router.get("/{project_id}", response_model=ProjectOut)
+@router.get("/{project_id}", response_model=ProjectDetailOut)
 async def get_project(
     project_id: int,
     user: UserInfo = Depends(get_current_user),
 ):
     pool = get_pool()
     row = await pool.fetchrow(
-        "SELECT id, name, description, created_at, created_by_sub FROM projects WHERE id = $1",
+        """SELECT id, name, description, created_at, created_by_sub,
+                  ST_XMin(bounds_geom) AS xmin, ST_YMin(bounds_geom) AS ymin,
+                  ST_XMax(bounds_geom) AS xmax, ST_YMax(bounds_geom) AS ymax
+           FROM projects WHERE id = $1""",
         project_id,
     )
     if not row:
         raise HTTPException(status_code=404, detail="Project not found")
-    return ProjectOut(**dict(row))
+    data = dict(row)
+    bbox = [data.pop(k) for k in ("xmin", "ymin", "xmax", "ymax")]
+    return ProjectDetailOut(**data, bbox=bbox if bbox[0] is not None else None)
 
 
 @router.put("/{project_id}", response_model=ProjectOut)
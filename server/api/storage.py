@@ -0,0 +1,36 @@
+"""Helpers for writing uploaded files to local storage."""
+import hashlib
+import os
+
+import aiofiles
+from fastapi import UploadFile
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+async def save_upload(file: UploadFile, dest_path: str,
+                      chunk_size: int = UPLOAD_CHUNK_SIZE) -> tuple[int, str]:
+    """Stream an upload to ``dest_path`` in fixed-size chunks.
+
+    Memory use is bounded by ``chunk_size`` regardless of the file size and
+    disk writes do not block the event loop. Returns ``(size, sha256_hex)``.
+    A partially written file is removed if the copy fails or is cancelled
+    (e.g. the client disconnected).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    completed = False
+    try:
+        async with aiofiles.open(dest_path, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                await out.write(chunk)
+        completed = True
+    finally:
+        if not completed and os.path.exists(dest_path):
+            os.remove(dest_path)
+    return size, digest.hexdigest()
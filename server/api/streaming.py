@@ -0,0 +1,50 @@
+"""Streamed NDJSON responses for large listings.
+
+A list route returns JSON by default. With ``Accept: application/x-ndjson``
+it streams one JSON object per line instead, read from a server-side
+asyncpg cursor in batches of ``settings.ndjson_prefetch`` rows. Neither
+the rows nor the response are ever held in memory as a whole, so memory
+and time to first byte stay flat however large the table grows.
+"""
+import asyncpg
+import orjson
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from config import settings
+from database import get_pool
+
+NDJSON = "application/x-ndjson"
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+
+def ndjson_response(query: str, params: list, decode=dict,
+                    fields: list[str] | None = None,
+                    limit: int | None = None,
+                    pool: asyncpg.Pool | None = None) -> StreamingResponse:
+    """Stream ``query`` results as NDJSON.
+
+    ``decode`` turns a record into the output dict; ``fields`` projects
+    it and ``limit`` caps the number of rows written. ``pool`` defaults to
+    the primary.
+    """
+
+    async def lines():
+        db = pool or get_pool()
+        async with db.acquire() as conn:
+            # Cursors only exist inside a transaction
+            async with conn.transaction(readonly=True):
+                count = 0
+                async for record in conn.cursor(query, *params, prefetch=settings.ndjson_prefetch):
+                    if limit is not None and count >= limit:
+                        break
+                    data = decode(record)
+                    if fields:
+                        data = {f: data[f] for f in fields}
+                    yield orjson.dumps(data, default=str) + b"\n"
+                    count += 1
+
+    return StreamingResponse(lines(), media_type=NDJSON)
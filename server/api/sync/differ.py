@@ -6,17 +6,23 @@ identifies changes (inserts, updates, deletes), and applies
 them with timestamp-based conflict resolution.
 
 Used by the sync endpoint to merge QField edits back into PostGIS.
+
+Layers are diffed as whole frames: the GPKG layer and the project's
+matching table rows are aligned on ``id`` and compared column by column
+with pandas/NumPy and Shapely array operations.
 """
 
+import asyncio
 import logging
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Optional
 
 import fiona
-import geopandas as gpd
-from shapely.geometry import shape, mapping
-
-from ..database import get_connection
+import numpy as np
+import pandas as pd
+import pyogrio
+import shapely
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +43,16 @@ SYNC_TABLES = {
     "Field Photos":       "field_photos",
 }
 
+# Not compared when looking for changed attributes
+SKIP_COLUMNS = {"id", "fid", "geometry", "geom", "_modified_at", "_modified_by_sub", "_row_hash", "_xid"}
+
+# Compared as numbers; every other column is compared as text, the way
+# the exporter writes it to the GPKG
+NUMERIC_TYPES = {"integer", "smallint", "bigint", "real", "double precision", "numeric"}
+
+# Geometries closer than this (degrees, ~0.1 mm) count as unchanged
+GEOMETRY_TOLERANCE = 1e-9
+
 
 class SyncDiffer:
     """Compares GPKG features with PostGIS and produces a change set."""
@@ -50,10 +66,15 @@ class SyncDiffer:
         return fiona.listlayers(self.gpkg_path)
 
     async def compute_diff(self, conn, layer_name: str,
-                           table_name: str, user_sub: str) -> dict:
+                           table_name: str, user_sub: str,
+                           project_id: Optional[int] = None) -> dict:
         """
         Compute differences between GPKG layer and PostGIS table.
 
+        The GPKG layer and the table rows with the same ids (within
+        ``project_id`` when given) are aligned on ``id`` and compared
+        column by column; geometries are compared as Shapely arrays.
+
         Returns:
             {
                 "inserts": [feature_dicts...],
@@ -64,70 +85,30 @@ class SyncDiffer:
                 "table": table_name,
             }
         """
+        result = {"inserts": [], "updates": [], "conflicts": [],
+                  "unchanged": 0, "layer": layer_name, "table": table_name}
+
         # Read GPKG layer
         try:
-            gdf = gpd.read_file(self.gpkg_path, layer=layer_name)
+            gdf = await asyncio.to_thread(
+                pyogrio.read_dataframe, self.gpkg_path, layer=layer_name
+            )
         except Exception as e:
             logger.warning(f"Cannot read GPKG layer '{layer_name}': {e}")
-            return {"inserts": [], "updates": [], "conflicts": [],
-                    "unchanged": 0, "layer": layer_name, "table": table_name}
+            return result
 
         if gdf.empty:
-            return {"inserts": [], "updates": [], "conflicts": [],
-                    "unchanged": 0, "layer": layer_name, "table": table_name}
-
-        # Get existing features from PostGIS
-        db_features = await self._fetch_db_features(conn, table_name)
-
-        inserts = []
-        updates = []
-        conflicts = []
-        unchanged = 0
-
-        for _, row in gdf.iterrows():
-            gpkg_id = row.get("id") or row.get("fid")
-            gpkg_modified = _parse_timestamp(row.get("_modified_at"))
-            feature_data = _row_to_dict(row)
-
-            if gpkg_id is None or gpkg_id not in db_features:
-                # New feature – insert
-                feature_data["_modified_by_sub"] = user_sub
-                feature_data["_modified_at"] = _now_iso()
-                inserts.append(feature_data)
-            else:
-                db_feat = db_features[gpkg_id]
-                db_modified = _parse_timestamp(db_feat.get("_modified_at"))
-
-                if gpkg_modified and db_modified and gpkg_modified > db_modified:
-                    # GPKG is newer → update
-                    feature_data["_modified_by_sub"] = user_sub
-                    feature_data["_modified_at"] = _now_iso()
-                    updates.append(feature_data)
-                elif gpkg_modified and db_modified and gpkg_modified < db_modified:
-                    # DB is newer → conflict (DB wins by default)
-                    conflicts.append({
-                        "gpkg": feature_data,
-                        "db": db_feat,
-                        "resolution": "db_wins",
-                    })
-                else:
-                    # Same timestamp or no timestamp → check if data changed
-                    if _features_differ(feature_data, db_feat):
-                        # Data changed but timestamps equal → last-write-wins (GPKG wins)
-                        feature_data["_modified_by_sub"] = user_sub
-                        feature_data["_modified_at"] = _now_iso()
-                        updates.append(feature_data)
-                    else:
-                        unchanged += 1
+            return result
 
-        return {
-            "inserts": inserts,
-            "updates": updates,
-            "conflicts": conflicts,
-            "unchanged": unchanged,
-            "layer": layer_name,
-            "table": table_name,
-        }
+        # Get the matching features from PostGIS
+        ids = _feature_ids(gdf)
+        columns = await self._fetch_table_columns(conn, table_name)
+        db = await self._fetch_db_frame(
+            conn, table_name, columns, ids.dropna().astype("int64").tolist(), project_id
+        )
+
+        result.update(await asyncio.to_thread(_diff_frames, gdf, ids, db, columns, user_sub))
+        return result
 
     async def apply_diff(self, conn, diff: dict, project_id: Optional[int] = None):
         """Apply computed diff to PostGIS within a transaction."""
@@ -167,7 +148,7 @@ class SyncDiffer:
             if layer_name not in gpkg_layers:
                 continue
 
-            diff = await self.compute_diff(conn, layer_name, table_name, user_sub)
+            diff = await self.compute_diff(conn, layer_name, table_name, user_sub, project_id)
             result = await self.apply_diff(conn, diff, project_id)
 
             summary["layers"][layer_name] = {
@@ -186,16 +167,46 @@ class SyncDiffer:
     # Internal helpers
     # ------------------------------------------------------------------
 
-    async def _fetch_db_features(self, conn, table_name: str) -> dict:
-        """Fetch all features from a PostGIS table, indexed by id."""
-        try:
-            rows = await conn.fetch(
-                f"SELECT * FROM {self.schema}.{table_name}"
-            )
-            return {row["id"]: dict(row) for row in rows}
-        except Exception as e:
-            logger.warning(f"Cannot fetch from {table_name}: {e}")
-            return {}
+    async def _fetch_table_columns(self, conn, table_name: str) -> dict:
+        """Return ``{column_name: data_type}`` of a PostGIS table."""
+        rows = await conn.fetch(
+            """SELECT column_name, data_type
+               FROM information_schema.columns
+               WHERE table_schema = $1 AND table_name = $2
+               ORDER BY ordinal_position""",
+            self.schema,
+            table_name,
+        )
+        return {r["column_name"]: r["data_type"] for r in rows}
+
+    async def _fetch_db_frame(self, conn, table_name: str, columns: dict,
+                              ids: list[int], project_id: Optional[int] = None):
+        """Fetch the table rows with the given ids as a DataFrame indexed
+        by id, with ``geom`` decoded to Shapely geometries."""
+        attrs = [c for c in columns if c != "geom"]
+        names = attrs + (["geom"] if "geom" in columns else [])
+        rows = []
+        if "id" in columns:
+            select = ", ".join(attrs)
+            if "geom" in columns:
+                select += ", ST_AsBinary(geom) AS geom"
+            where = "id = ANY($1::integer[])"
+            params = [ids]
+            if project_id is not None and "project_id" in columns:
+                where += " AND project_id = $2"
+                params.append(project_id)
+            try:
+                rows = await conn.fetch(
+                    f"SELECT {select} FROM {self.schema}.{table_name} WHERE {where}",
+                    *params,
+                )
+            except Exception as e:
+                logger.warning(f"Cannot fetch from {table_name}: {e}")
+
+        frame = pd.DataFrame([tuple(r) for r in rows], columns=names or ["id"])
+        if "geom" in frame.columns:
+            frame["geom"] = shapely.from_wkb(frame["geom"].to_numpy(dtype=object))
+        return frame.set_index("id", drop=False)
 
     async def _insert_feature(self, conn, table_name: str, feat: dict,
                                project_id: Optional[int] = None):
@@ -206,24 +217,12 @@ class SyncDiffer:
         if project_id and "_project_id" not in feat_copy:
             feat_copy["_project_id"] = project_id
 
-        geom = feat.get("geometry")
-        cols = list(feat_copy.keys())
         vals = list(feat_copy.values())
+        has_geom = "geometry" in feat
+        if has_geom:
+            vals.append(feat["geometry"])
 
-        if geom:
-            cols.append("geom")
-            vals.append(geom)
-
-        placeholders = [f"${i+1}" for i in range(len(vals))]
-
-        # WKT geometry needs ST_GeomFromText
-        if geom:
-            placeholders[-1] = f"ST_GeomFromText(${len(vals)}, 4326)"
-
-        sql = (
-            f"INSERT INTO {self.schema}.{table_name} "
-            f"({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
-        )
+        sql = _insert_sql(self.schema, table_name, tuple(feat_copy), has_geom)
         await conn.execute(sql, *vals)
 
     async def _update_feature(self, conn, table_name: str, feat: dict):
@@ -234,89 +233,167 @@ class SyncDiffer:
 
         feat_copy = {k: v for k, v in feat.items()
                      if k not in ("id", "fid", "geometry")}
-        geom = feat.get("geometry")
-
-        set_clauses = []
-        vals = []
-        idx = 1
-
-        for k, v in feat_copy.items():
-            set_clauses.append(f"{k} = ${idx}")
-            vals.append(v)
-            idx += 1
-
-        if geom:
-            set_clauses.append(f"geom = ST_GeomFromText(${idx}, 4326)")
-            vals.append(geom)
-            idx += 1
-
+        vals = list(feat_copy.values())
+        has_geom = "geometry" in feat
+        if has_geom:
+            vals.append(feat["geometry"])
         vals.append(feat_id)
-        sql = (
-            f"UPDATE {self.schema}.{table_name} "
-            f"SET {', '.join(set_clauses)} "
-            f"WHERE id = ${idx}"
-        )
+
+        sql = _update_sql(self.schema, table_name, tuple(feat_copy), has_geom)
         await conn.execute(sql, *vals)
 
 
 # ------------------------------------------------------------------
-# Utility functions
+# Statements
 # ------------------------------------------------------------------
+# Every feature of a layer has the same keys and the geometry is always a
+# parameter (NULL when missing), so one INSERT and one UPDATE text per
+# table and column set is reused as a prepared statement.
+
+@lru_cache(maxsize=256)
+def _insert_sql(schema: str, table_name: str, cols: tuple, has_geom: bool) -> str:
+    names = list(cols)
+    placeholders = [f"${i + 1}" for i in range(len(cols))]
+    if has_geom:
+        # WKT geometry needs ST_GeomFromText
+        names.append("geom")
+        placeholders.append(f"ST_GeomFromText(${len(cols) + 1}, 4326)")
+    return (
+        f"INSERT INTO {schema}.{table_name} "
+        f"({', '.join(names)}) VALUES ({', '.join(placeholders)})"
+    )
+
+
+@lru_cache(maxsize=256)
+def _update_sql(schema: str, table_name: str, cols: tuple, has_geom: bool) -> str:
+    set_clauses = [f"{k} = ${i + 1}" for i, k in enumerate(cols)]
+    idx = len(cols) + 1
+    if has_geom:
+        # Features without geometry keep the stored one
+        set_clauses.append(f"geom = COALESCE(ST_GeomFromText(${idx}, 4326), geom)")
+        idx += 1
+    return (
+        f"UPDATE {schema}.{table_name} "
+        f"SET {', '.join(set_clauses)} "
+        f"WHERE id = ${idx}"
+    )
 
-def _parse_timestamp(val) -> Optional[datetime]:
-    """Parse a timestamp from various formats."""
-    if val is None:
-        return None
-    if isinstance(val, datetime):
-        return val
-    try:
-        # ISO format
-        return datetime.fromisoformat(str(val).replace("Z", "+00:00"))
-    except (ValueError, TypeError):
-        return None
 
+# ------------------------------------------------------------------
+# Utility functions
+# ------------------------------------------------------------------
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def _row_to_dict(row) -> dict:
-    """Convert a GeoDataFrame row to a plain dict with WKT geometry."""
-    d = {}
-    for k, v in row.items():
-        if k == "geometry":
-            if v is not None and not v.is_empty:
-                d["geometry"] = v.wkt
-            continue
-        # Convert numpy types to Python native
-        try:
-            import numpy as np
-            if isinstance(v, (np.integer,)):
-                v = int(v)
-            elif isinstance(v, (np.floating,)):
-                v = float(v)
-            elif isinstance(v, np.bool_):
-                v = bool(v)
-        except ImportError:
-            pass
-        d[k] = v
-    return d
-
-
-def _features_differ(feat_a: dict, feat_b: dict) -> bool:
-    """Check if two feature dicts have different attribute values."""
-    # Compare all non-system fields
-    skip = {"id", "fid", "geometry", "geom", "_modified_at", "_modified_by_sub"}
-    for key in set(feat_a.keys()) | set(feat_b.keys()):
-        if key in skip:
-            continue
-        va = feat_a.get(key)
-        vb = feat_b.get(key)
-        # Normalize None vs empty string
-        if va == "" and vb is None:
-            continue
-        if va is None and vb == "":
+def _feature_ids(gdf) -> pd.Series:
+    """GPKG feature ids (``id``, else ``fid``) as nullable integers."""
+    ids = pd.Series(pd.NA, index=gdf.index, dtype="Int64")
+    for name in ("fid", "id"):
+        if name in gdf.columns:
+            values = pd.to_numeric(gdf[name], errors="coerce").astype("Int64")
+            ids = values.where(values.notna(), ids)
+    return ids
+
+
+def _diff_frames(gdf, ids: pd.Series, db, columns: dict, user_sub: str) -> dict:
+    """Classify GPKG features against the aligned DB rows.
+
+    Mirrors the per-feature rules: unknown ids are inserts; a newer GPKG
+    ``_modified_at`` is an update, an older one a conflict (DB wins); with
+    equal or missing timestamps the feature is updated only if its data
+    changed.
+    """
+    pos = db.index.get_indexer(ids.fillna(-1).astype("int64").to_numpy())
+    matched = pos >= 0
+    if not len(db):
+        return {
+            "inserts": _records(gdf, ~matched, "geometry", user_sub),
+            "updates": [], "conflicts": [], "unchanged": 0,
+        }
+
+    # DB rows aligned to the GPKG rows (unmatched rows hold row 0, masked out)
+    aligned = db.iloc[np.where(matched, pos, 0)].set_axis(gdf.index)
+
+    gpkg_ts = _timestamps(gdf["_modified_at"] if "_modified_at" in gdf.columns else None, gdf.index)
+    db_ts = _timestamps(aligned.get("_modified_at"), gdf.index)
+    both = (gpkg_ts.notna() & db_ts.notna()).to_numpy()
+    newer = matched & both & (gpkg_ts > db_ts).to_numpy()
+    older = matched & both & (gpkg_ts < db_ts).to_numpy()
+    same = matched & ~newer & ~older
+    changed = same & _frames_differ(gdf, aligned, columns)
+
+    gpkg_conflicts = _records(gdf, older, "geometry")
+    db_conflicts = _records(aligned, older, "geom")
+    return {
+        "inserts": _records(gdf, ~matched, "geometry", user_sub),
+        "updates": _records(gdf, newer | changed, "geometry", user_sub),
+        "conflicts": [
+            {"gpkg": g, "db": d, "resolution": "db_wins"}
+            for g, d in zip(gpkg_conflicts, db_conflicts)
+        ],
+        "unchanged": int((same & ~changed).sum()),
+    }
+
+
+def _timestamps(values, index) -> pd.Series:
+    """Parse timestamps to UTC; naive values are taken as UTC."""
+    if values is None:
+        return pd.Series(pd.NaT, index=index, dtype="datetime64[ns, UTC]")
+    return pd.to_datetime(values, utc=True, errors="coerce", format="ISO8601")
+
+
+def _frames_differ(gdf, db, columns: dict) -> np.ndarray:
+    """Per-row flag: any shared attribute column or the geometry differs."""
+    differ = np.zeros(len(gdf), dtype=bool)
+    for name in gdf.columns:
+        if name in SKIP_COLUMNS or name not in columns:
             continue
-        if va != vb:
-            return True
-    return False
+        if columns[name] in NUMERIC_TYPES:
+            a = pd.to_numeric(gdf[name], errors="coerce").astype("float64")
+            b = pd.to_numeric(db[name], errors="coerce").astype("float64")
+        else:
+            a = _as_text(gdf[name])
+            b = _as_text(db[name])
+        differ |= ~((a == b) | (a.isna() & b.isna())).to_numpy()
+
+    if "geometry" in gdf.columns and "geom" in db.columns:
+        ga = gdf["geometry"].to_numpy(dtype=object)
+        gb = db["geom"].to_numpy(dtype=object)
+        equal = shapely.equals_exact(ga, gb, tolerance=GEOMETRY_TOLERANCE)
+        differ |= ~(equal | (_no_geometry(ga) & _no_geometry(gb)))
+    return differ
+
+
+def _as_text(values: pd.Series) -> pd.Series:
+    """Values as strings, with None for nulls and empty strings."""
+    text = values.astype(object).where(values.notna(), None)
+    present = text.notna()
+    text[present] = text[present].astype(str)
+    return text.where(text != "", None)
+
+
+def _no_geometry(geoms: np.ndarray) -> np.ndarray:
+    return shapely.is_missing(geoms) | shapely.is_empty(geoms)
+
+
+def _records(frame, mask: np.ndarray, geometry_column: str,
+             user_sub: Optional[str] = None) -> list[dict]:
+    """Selected rows as plain feature dicts with WKT geometry.
+
+    With ``user_sub`` the rows are stamped as modified by that user now.
+    """
+    if not mask.any():
+        return []
+    part = frame[mask]
+    attrs = part.drop(columns=[geometry_column], errors="ignore")
+    attrs = attrs.astype(object).where(attrs.notna(), None)
+    if geometry_column in part.columns:
+        geoms = part[geometry_column].to_numpy(dtype=object)
+        wkt = shapely.to_wkt(geoms)
+        attrs[geometry_column] = np.where(_no_geometry(geoms), None, wkt)
+    if user_sub is not None:
+        attrs["_modified_by_sub"] = user_sub
+        attrs["_modified_at"] = _now_iso()
+    return attrs.to_dict("records")
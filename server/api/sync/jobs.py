@@ -0,0 +1,217 @@
+"""Background execution of GPKG upload merges.
+
+``/sync/upload`` only stores the file and queues a job; a bounded pool of
+worker tasks in this process runs the merge. Progress is written to
+``sync_log.details`` after every layer so any API worker can report it
+through ``GET /sync/jobs/{id}``.
+
+Each queue holds one connection outside the pool while it runs, and its
+jobs record that connection's backend pid (``sync_log.worker_pid``). A
+starting queue fails the unfinished jobs of owners that are no longer
+connected, i.e. of workers that crashed or were restarted mid-merge.
+"""
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+
+import asyncpg
+
+from config import settings
+from database import get_pool
+from sync.merger import merge_gpkg_to_postgis
+
+logger = logging.getLogger("fiberq.sync.jobs")
+
+
+@dataclass
+class UploadJob:
+    sync_id: int
+    gpkg_path: str
+    project_id: int
+    user_sub: str
+
+
+class SyncJobQueue:
+    """Bounded in-process queue of upload merge jobs."""
+
+    def __init__(self, workers: int, maxsize: int):
+        self._queue: asyncio.Queue[UploadJob] = asyncio.Queue(maxsize=maxsize)
+        self._worker_count = max(1, workers)
+        self._workers: list[asyncio.Task] = []
+        self._owner: asyncpg.Connection | None = None
+        self.owner_pid: int | None = None
+
+    async def start(self):
+        self._owner = await asyncpg.connect(dsn=settings.asyncpg_dsn)
+        self.owner_pid = self._owner.get_server_pid()
+        orphans = await _fail_orphaned_jobs()
+        if orphans:
+            logger.warning("Failed %d upload merges left by a stopped worker", orphans)
+        for n in range(self._worker_count):
+            self._workers.append(asyncio.create_task(self._worker(n)))
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+        # Jobs that never started are lost with this process
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            await _finish(job.sync_id, "failed", {"error": "Server shut down before merge started"})
+            _remove_file(job.gpkg_path)
+
+        if self._owner is not None:
+            await self._owner.close()
+            self._owner = None
+
+    def submit(self, job: UploadJob):
+        """Queue a job. Raises ``asyncio.QueueFull`` when the queue is full."""
+        self._queue.put_nowait(job)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await _run_job(job)
+            except Exception:
+                logger.exception("Sync job %s crashed", job.sync_id)
+            finally:
+                self._queue.task_done()
+
+
+async def _run_job(job: UploadJob):
+    pool = get_pool()
+    details = {"layers": {}, "layers_done": 0, "layers_total": None}
+
+    await pool.execute(
+        "UPDATE sync_log SET status = 'in_progress', details = $1::jsonb WHERE id = $2",
+        json.dumps(details),
+        job.sync_id,
+    )
+
+    async def on_layer(layer_name: str, result: dict, done: int, total: int):
+        details["layers"][layer_name] = result
+        details["layers_done"] = done
+        details["layers_total"] = total
+        await pool.execute(
+            "UPDATE sync_log SET details = $1::jsonb WHERE id = $2",
+            json.dumps(details),
+            job.sync_id,
+        )
+
+    try:
+        result = await merge_gpkg_to_postgis(
+            job.gpkg_path, job.project_id, job.user_sub, pool,
+            progress=on_layer,
+            per_layer_transactions=settings.sync_merge_per_layer_transactions,
+        )
+        details["errors"] = result["errors"]
+        await pool.execute(
+            """UPDATE sync_log
+               SET completed_at = NOW(), status = 'completed',
+                   features_uploaded = $1, conflicts_resolved = $2,
+                   details = $3::jsonb
+               WHERE id = $4""",
+            result["features_merged"],
+            result["conflicts"],
+            json.dumps(details),
+            job.sync_id,
+        )
+        logger.info(
+            "Sync job %s completed: %d merged, %d conflicts",
+            job.sync_id, result["features_merged"], result["conflicts"],
+        )
+    except Exception as e:
+        logger.exception("Sync job %s failed", job.sync_id)
+        details["error"] = str(e)
+        await _finish(job.sync_id, "failed", details)
+    except asyncio.CancelledError:
+        logger.warning("Sync job %s cancelled by shutdown", job.sync_id)
+        details["error"] = "Server shut down during merge"
+        await _finish(job.sync_id, "failed", details)
+        raise
+    finally:
+        _remove_file(job.gpkg_path)
+
+
+async def create_upload_job(project_id: int, user_sub: str) -> int:
+    """Insert the sync_log row for a new upload and return its id.
+
+    The job belongs to this worker's queue, which it must be submitted to.
+    """
+    return await get_pool().fetchval(
+        """INSERT INTO sync_log (user_sub, project_id, sync_type, status, worker_pid)
+           VALUES ($1, $2, 'upload', 'queued', $3)
+           RETURNING id""",
+        user_sub,
+        project_id,
+        get_job_queue().owner_pid,
+    )
+
+
+async def _fail_orphaned_jobs() -> int:
+    """Fail unfinished upload merges whose queue is gone."""
+    rows = await get_pool().fetch(
+        """UPDATE sync_log
+           SET completed_at = NOW(), status = 'failed',
+               details = COALESCE(details, '{}'::jsonb)
+                         || '{"error": "Server stopped before the merge finished"}'::jsonb
+           WHERE sync_type = 'upload' AND status IN ('queued', 'in_progress')
+             AND (worker_pid IS NULL OR worker_pid NOT IN (SELECT pid FROM pg_stat_activity))
+           RETURNING id"""
+    )
+    return len(rows)
+
+
+async def fail_upload_job(sync_id: int, gpkg_path: str):
+    """Mark an upload that never reached the queue as failed."""
+    await get_pool().execute(
+        "UPDATE sync_log SET completed_at = NOW(), status = 'failed' WHERE id = $1",
+        sync_id,
+    )
+    _remove_file(gpkg_path)
+
+
+async def _finish(sync_id: int, status: str, details: dict):
+    await get_pool().execute(
+        """UPDATE sync_log SET completed_at = NOW(), status = $1, details = $2::jsonb
+           WHERE id = $3""",
+        status,
+        json.dumps(details),
+        sync_id,
+    )
+
+
+def _remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+_queue: SyncJobQueue | None = None
+
+
+async def start_job_queue() -> SyncJobQueue:
+    global _queue
+    _queue = SyncJobQueue(settings.sync_job_workers, settings.sync_job_queue_size)
+    await _queue.start()
+    return _queue
+
+
+async def stop_job_queue():
+    global _queue
+    if _queue:
+        await _queue.stop()
+        _queue = None
+
+
+def get_job_queue() -> SyncJobQueue:
+    if _queue is None:
+        raise RuntimeError("Sync job queue not initialized")
+    return _queue
@@ -5,11 +5,36 @@ Strategy: timestamp-based feature-level merge.
 - If GPKG is newer, update PostGIS.
 - If PostGIS is newer, skip (conflict logged).
 - New features (no matching id) are inserted.
+
+Two engines implement this strategy:
+- bulk (default): each layer is loaded into a temporary staging table
+  with COPY and resolved with a handful of set-based statements.
+- per-feature: one lookup plus one INSERT/UPDATE per feature. Kept for
+  debugging and for comparison with the bulk engine.
+
+In bulk mode the GPKG layers are read and WKB-encoded in worker threads
+and streamed into COPY through a bounded queue of record batches, so a
+layer is never held in memory as a whole. Each writer starts reading only
+the layer after the one it is writing. Writes go through one of two
+transaction modes:
+- single (default): all layers on one connection in one transaction, with
+  a savepoint per layer. The upload is applied all-or-nothing per layer
+  and readers never see a half-merged upload.
+- per-layer: layers targeting different tables are written concurrently
+  on separate pool connections, each layer in its own transaction. Faster
+  on large uploads, but a failure leaves earlier layers committed.
 """
+import asyncio
+import concurrent.futures
 import logging
+import threading
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable
 
 import asyncpg
 import fiona
+
+from config import settings
 from shapely.geometry import shape, mapping
 from shapely import wkb
 
@@ -37,8 +62,20 @@ async def merge_gpkg_to_postgis(
     project_id: int,
     user_sub: str,
     pool: asyncpg.Pool,
+    bulk: bool = True,
+    progress: Callable[[str, dict, int, int], Awaitable[None]] | None = None,
+    per_layer_transactions: bool = False,
 ) -> dict:
-    """Merge GPKG data into PostGIS. Returns merge statistics."""
+    """Merge GPKG data into PostGIS. Returns merge statistics.
+
+    With ``bulk=True`` every layer is merged in set-based statements via a
+    COPY-loaded staging table; ``bulk=False`` uses the per-feature path.
+    ``per_layer_transactions`` selects the per-layer transaction mode of the
+    bulk engine (see module docstring).
+
+    ``progress`` is awaited after each layer with
+    ``(layer_name, layer_result, layers_done, layers_total)``.
+    """
     stats = {"features_merged": 0, "conflicts": 0, "errors": 0}
 
     try:
@@ -47,23 +84,102 @@ async def merge_gpkg_to_postgis(
         logger.error("Cannot read GPKG layers: %s", e)
         return stats
 
+    mapped = []
+    for layer_name in layers:
+        if layer_name in LAYER_TABLE_MAP:
+            mapped.append(layer_name)
+        else:
+            logger.debug("Skipping unmapped layer: %s", layer_name)
+
+    done = 0
+
+    async def layer_finished(layer_name: str, result: dict):
+        nonlocal done
+        done += 1
+        if result.get("error"):
+            stats["errors"] += 1
+        else:
+            stats["features_merged"] += result["merged"]
+            stats["conflicts"] += result["conflicts"]
+        if progress:
+            await progress(layer_name, result, done, len(mapped))
+
+    if not bulk:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                for layer_name in mapped:
+                    try:
+                        result = await _merge_layer(
+                            conn, gpkg_path, layer_name, LAYER_TABLE_MAP[layer_name],
+                            project_id, user_sub,
+                        )
+                    except Exception as e:
+                        logger.error("Error merging layer %s: %s", layer_name, e)
+                        result = {"merged": 0, "conflicts": 0, "error": str(e)}
+                    await layer_finished(layer_name, result)
+        return stats
+
     async with pool.acquire() as conn:
-        async with conn.transaction():
-            for layer_name in layers:
-                table = LAYER_TABLE_MAP.get(layer_name)
-                if not table:
-                    logger.debug("Skipping unmapped layer: %s", layer_name)
-                    continue
-
-                try:
-                    result = await _merge_layer(
-                        conn, gpkg_path, layer_name, table, project_id, user_sub
-                    )
-                    stats["features_merged"] += result["merged"]
-                    stats["conflicts"] += result["conflicts"]
-                except Exception as e:
-                    logger.error("Error merging layer %s: %s", layer_name, e)
-                    stats["errors"] += 1
+        table_columns = await _table_column_types(
+            conn, sorted({LAYER_TABLE_MAP[name] for name in mapped})
+        )
+
+    # Layers are read + encoded in threads while the writer copies them
+    streams: set[_LayerStream] = set()
+
+    def start_prepare(layer_name: str) -> "_LayerStream":
+        stream = _LayerStream(
+            gpkg_path, layer_name, table_columns.get(LAYER_TABLE_MAP[layer_name], {})
+        )
+        streams.add(stream)
+        stream.start()
+        return stream
+
+    async def apply_layers(conn: asyncpg.Connection, names: list[str]):
+        """Write ``names`` in order, reading only the next one meanwhile."""
+        upcoming = start_prepare(names[0]) if names else None
+        for i, name in enumerate(names):
+            current = upcoming
+            upcoming = start_prepare(names[i + 1]) if i + 1 < len(names) else None
+            await layer_finished(name, await apply(conn, name, current))
+
+    async def apply(conn: asyncpg.Connection, layer_name: str, stream: "_LayerStream") -> dict:
+        table = LAYER_TABLE_MAP[layer_name]
+        try:
+            columns = await stream.columns()
+            async with conn.transaction():
+                return await _merge_layer_bulk(
+                    conn, table, table_columns.get(table, {}), columns, stream.records(),
+                    project_id, user_sub,
+                )
+        except Exception as e:
+            logger.error("Error merging layer %s: %s", layer_name, e)
+            return {"merged": 0, "conflicts": 0, "error": str(e)}
+        finally:
+            stream.close()
+            streams.discard(stream)
+
+    try:
+        if per_layer_transactions:
+            # Layers of the same table stay sequential to avoid lock contention
+            by_table: dict[str, list[str]] = {}
+            for name in mapped:
+                by_table.setdefault(LAYER_TABLE_MAP[name], []).append(name)
+            write_slots = asyncio.Semaphore(max(1, settings.sync_parallel_layers))
+
+            async def apply_table(names: list[str]):
+                async with write_slots, pool.acquire() as conn:
+                    await apply_layers(conn, names)
+
+            await asyncio.gather(*(apply_table(names) for names in by_table.values()))
+        else:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    # apply() opens a savepoint per layer
+                    await apply_layers(conn, mapped)
+    finally:
+        for stream in list(streams):
+            stream.close()
 
     return stats
 
@@ -80,12 +196,15 @@ async def _merge_layer(
     result = {"merged": 0, "conflicts": 0}
 
     with fiona.open(gpkg_path, layer=layer_name) as src:
+        has_geom = src.schema.get("geometry") not in (None, "None")
         for feature in src:
             props = dict(feature.get("properties", {}))
             geom = feature.get("geometry")
 
             fid = props.pop("id", None)
-            props.pop("_modified_by_sub", None)
+            # System columns are set by the server
+            columns = tuple(k for k in props if not k.startswith("_"))
+            values = [props[k] for k in columns]
 
             if geom:
                 geom_wkt = shape(geom).wkt
@@ -108,41 +227,26 @@ async def _merge_layer(
                         continue
 
                     # Update existing feature
-                    set_clauses = []
-                    params = []
-                    idx = 1
-                    for key, val in props.items():
-                        if key.startswith("_") and key != "_modified_at":
-                            continue
-                        set_clauses.append(f"{key} = ${idx}")
-                        params.append(val)
-                        idx += 1
-
-                    set_clauses.append(f"_modified_by_sub = ${idx}")
-                    params.append(user_sub)
-                    idx += 1
-                    set_clauses.append("_modified_at = NOW()")
-
-                    if geom_wkt:
-                        set_clauses.append(f"geom = ST_GeomFromText(${idx}, 4326)")
+                    params = [*values, user_sub]
+                    if has_geom:
                         params.append(geom_wkt)
-                        idx += 1
-
                     params.append(fid)
-                    query = f"UPDATE {table} SET {', '.join(set_clauses)} WHERE id = ${idx}"
-
                     try:
-                        await conn.execute(query, *params)
+                        await conn.execute(_update_sql(table, columns, has_geom), *params)
                         result["merged"] += 1
                     except Exception as e:
                         logger.warning("Failed to update %s id=%s: %s", table, fid, e)
                 else:
                     # Insert with specific ID
-                    await _insert_feature(conn, table, props, geom_wkt, project_id, user_sub, fid)
+                    await _insert_feature(
+                        conn, table, columns, values, has_geom, geom_wkt, project_id, user_sub, fid
+                    )
                     result["merged"] += 1
             else:
                 # New feature without ID
-                await _insert_feature(conn, table, props, geom_wkt, project_id, user_sub)
+                await _insert_feature(
+                    conn, table, columns, values, has_geom, geom_wkt, project_id, user_sub
+                )
                 result["merged"] += 1
 
     return result
@@ -151,54 +255,318 @@ async def _merge_layer(
 async def _insert_feature(
     conn: asyncpg.Connection,
     table: str,
-    props: dict,
+    columns: tuple[str, ...],
+    values: list,
+    has_geom: bool,
     geom_wkt: str | None,
     project_id: int,
     user_sub: str,
     fid: int | None = None,
 ):
     """Insert a new feature into PostGIS."""
-    columns = []
-    placeholders = []
-    values = []
-    idx = 1
-
-    if fid:
-        columns.append("id")
-        placeholders.append(f"${idx}")
-        values.append(fid)
-        idx += 1
-
-    for key, val in props.items():
-        if key.startswith("_"):
-            continue
-        columns.append(key)
-        placeholders.append(f"${idx}")
-        values.append(val)
-        idx += 1
-
-    columns.append("project_id")
-    placeholders.append(f"${idx}")
-    values.append(project_id)
-    idx += 1
+    params = [fid or None, *values, project_id, user_sub]
+    if has_geom:
+        params.append(geom_wkt)
 
-    columns.append("_modified_by_sub")
-    placeholders.append(f"${idx}")
-    values.append(user_sub)
-    idx += 1
+    try:
+        await conn.execute(_insert_sql(table, columns, has_geom), *params)
+    except Exception as e:
+        logger.warning("Failed to insert into %s: %s", table, e)
 
-    columns.append("_modified_at")
-    placeholders.append("NOW()")
 
-    if geom_wkt:
-        columns.append("geom")
-        placeholders.append(f"ST_GeomFromText(${idx}, 4326)")
-        values.append(geom_wkt)
+# The per-feature statements depend only on the table and the layer's
+# columns; id and geometry are always parameters (NULL when missing), so
+# every feature of a layer reuses one prepared statement per connection.
+
+@lru_cache(maxsize=256)
+def _insert_sql(table: str, columns: tuple[str, ...], has_geom: bool) -> str:
+    names = ["id", *columns, "project_id", "_modified_by_sub", "_modified_at"]
+    values = [f"COALESCE($1::integer, nextval(pg_get_serial_sequence('{table}', 'id')))"]
+    values += [f"${i}" for i in range(2, len(columns) + 4)]
+    values.append("NOW()")
+    if has_geom:
+        names.append("geom")
+        values.append(f"ST_GeomFromText(${len(columns) + 4}, 4326)")
+    return f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join(values)})"
+
+
+@lru_cache(maxsize=256)
+def _update_sql(table: str, columns: tuple[str, ...], has_geom: bool) -> str:
+    set_clauses = [f"{c} = ${i}" for i, c in enumerate(columns, 1)]
+    idx = len(columns) + 1
+    set_clauses.append(f"_modified_by_sub = ${idx}")
+    set_clauses.append("_modified_at = NOW()")
+    if has_geom:
         idx += 1
+        # Features without geometry keep the stored one
+        set_clauses.append(f"geom = COALESCE(ST_GeomFromText(${idx}, 4326), geom)")
+    return f"UPDATE {table} SET {', '.join(set_clauses)} WHERE id = ${idx + 1}"
+
+
+# ---------------------------------------------------------------------------
+# Bulk (set-based) merge
+# ---------------------------------------------------------------------------
+
+STAGING_TABLE = "_merge_stage"
+
+
+# A layer's reader thread hands records to COPY in batches of
+# STAGE_BATCH_RECORDS and waits while STAGE_QUEUE_BATCHES are pending, so
+# the records of a layer held in memory are bounded whatever its size.
+STAGE_BATCH_RECORDS = 1000
+STAGE_QUEUE_BATCHES = 4
+_STAGE_DONE = object()
+
+
+class _StreamClosed(Exception):
+    """The consumer of a layer stream is gone."""
+
+
+class _LayerStream:
+    """Staging records of one GPKG layer, read by a worker thread.
+
+    The first item handed over is the list of merged attribute columns,
+    then record batches, then ``_STAGE_DONE`` (or the reader's exception).
+    """
+
+    def __init__(self, gpkg_path: str, layer_name: str, table_columns: dict):
+        self.gpkg_path = gpkg_path
+        self.layer_name = layer_name
+        self.table_columns = table_columns
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_BATCHES)
+        self._closed = threading.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(asyncio.to_thread(self._read))
+
+    def close(self):
+        """Stop the reader; it gives up on its next hand-over."""
+        self._closed.set()
+
+    async def columns(self) -> list[str]:
+        return await self._get()
+
+    async def records(self) -> AsyncIterator[tuple]:
+        while True:
+            batch = await self._get()
+            if batch is _STAGE_DONE:
+                return
+            for record in batch:
+                yield record
+
+    async def _get(self):
+        item = await self._queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def _put(self, item):
+        """Hand ``item`` to the event loop, waiting while the queue is full."""
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except concurrent.futures.TimeoutError:
+                if self._closed.is_set():
+                    future.cancel()
+                    raise _StreamClosed
+
+    def _read(self):
+        try:
+            if not self.table_columns:
+                raise ValueError(f"Target table for layer {self.layer_name} not found")
+            with fiona.open(self.gpkg_path, layer=self.layer_name) as src:
+                # Only attributes that exist in the target table are merged;
+                # system columns are always set by the server.
+                columns = [
+                    name for name in src.schema["properties"]
+                    if name in self.table_columns
+                    and not name.startswith("_")
+                    and name not in ("id", "project_id", "geom")
+                ]
+                self._put(columns)
+                batch = []
+                for record in _stage_records(src, columns):
+                    batch.append(record)
+                    if len(batch) == STAGE_BATCH_RECORDS:
+                        self._put(batch)
+                        batch = []
+                if batch:
+                    self._put(batch)
+            self._put(_STAGE_DONE)
+        except _StreamClosed:
+            pass
+        except Exception as e:
+            try:
+                self._put(e)
+            except _StreamClosed:
+                pass
+
+
+async def _merge_layer_bulk(
+    conn: asyncpg.Connection,
+    table: str,
+    table_columns: dict,
+    columns: list[str],
+    records: AsyncIterator[tuple],
+    project_id: int,
+    user_sub: str,
+) -> dict:
+    """Merge one prepared GPKG layer into a PostGIS table with set-based SQL.
+
+    Same rules as :func:`_merge_layer`:
+    - id matches and GPKG ``_modified_at`` <= PostGIS → conflict, skipped
+    - id matches otherwise → update (``_modified_at`` reset to NOW())
+    - id missing or unknown → insert
+
+    On tables with ``_row_hash``, a matched feature whose merged row would
+    hash the same as the stored row is unchanged and not written; when the
+    whole layer is unchanged or in conflict, no write is issued at all.
+    """
+    result = {"merged": 0, "conflicts": 0, "unchanged": 0}
+
+    stage_cols = ", ".join(f'"{c}" TEXT' for c in columns)
+    await conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+    await conn.execute(
+        f"""CREATE TEMP TABLE {STAGING_TABLE} (
+                id INTEGER,
+                {stage_cols + "," if stage_cols else ""}
+                gpkg_modified_at TEXT,
+                geom_wkb BYTEA
+            ) ON COMMIT DROP"""
+    )
+    staged = _affected_rows(await conn.copy_records_to_table(
+        STAGING_TABLE,
+        records=records,
+        columns=["id", *columns, "gpkg_modified_at", "geom_wkb"],
+    ))
+
+    has_geom = "geom" in table_columns
+    casts = {c: f's."{c}"::{table_columns[c]}' for c in columns}
+    conflict_cond = (
+        "s.gpkg_modified_at IS NOT NULL AND t._modified_at IS NOT NULL "
+        "AND s.gpkg_modified_at::timestamptz <= t._modified_at"
+    )
+
+    if "_row_hash" in table_columns:
+        unchanged_cond = f"{_merged_row_hash(columns, casts, has_geom)} IS NOT DISTINCT FROM t._row_hash"
+    else:
+        unchanged_cond = "FALSE"
+
+    counts = await conn.fetchrow(
+        f"""SELECT count(*) FILTER (WHERE {conflict_cond}) AS conflicts,
+                   count(*) FILTER (WHERE NOT ({conflict_cond}) AND {unchanged_cond}) AS unchanged
+            FROM {STAGING_TABLE} s
+            JOIN {table} t ON t.id = s.id"""
+    )
+    result["conflicts"] = counts["conflicts"]
+    result["unchanged"] = counts["unchanged"]
+    if result["conflicts"] + result["unchanged"] == staged:
+        # Every feature exists and is either unchanged or in conflict
+        await conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        return result
+
+    # Timestamp-guarded update of existing features
+    set_clauses = [f'"{c}" = {casts[c]}' for c in columns]
+    set_clauses.append("_modified_by_sub = $1")
+    set_clauses.append("_modified_at = NOW()")
+    if has_geom:
+        set_clauses.append("geom = COALESCE(ST_GeomFromWKB(s.geom_wkb, 4326), t.geom)")
+    status = await conn.execute(
+        f"""UPDATE {table} t SET {', '.join(set_clauses)}
+            FROM {STAGING_TABLE} s
+            WHERE t.id = s.id AND NOT ({conflict_cond}) AND NOT ({unchanged_cond})""",
+        user_sub,
+    )
+    result["merged"] += _affected_rows(status)
+
+    # Insert new features; unknown ids keep the id sent by the client
+    insert_cols = ["id", *(f'"{c}"' for c in columns), "project_id",
+                   "_modified_by_sub", "_modified_at"]
+    select_exprs = [
+        f"COALESCE(s.id, nextval(pg_get_serial_sequence('{table}', 'id')))",
+        *(casts[c] for c in columns),
+        "$1", "$2", "NOW()",
+    ]
+    if has_geom:
+        insert_cols.append("geom")
+        select_exprs.append("ST_GeomFromWKB(s.geom_wkb, 4326)")
+    status = await conn.execute(
+        f"""INSERT INTO {table} ({', '.join(insert_cols)})
+            SELECT {', '.join(select_exprs)}
+            FROM {STAGING_TABLE} s
+            WHERE s.id IS NULL
+               OR NOT EXISTS (SELECT 1 FROM {table} t WHERE t.id = s.id)
+            ON CONFLICT (id) DO NOTHING""",
+        project_id,
+        user_sub,
+    )
+    result["merged"] += _affected_rows(status)
+
+    await conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+    return result
 
-    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
 
+def _merged_row_hash(columns: list[str], casts: dict, has_geom: bool) -> str:
+    """SQL for the ``_row_hash`` target row ``t`` would get from staged row ``s``.
+
+    Same inputs as the table's row hash trigger: the stored row with the
+    staged attributes applied, and the staged (or kept) geometry.
+    """
+    pairs = [f"'{c}', {casts[c]}" for c in columns]
+    # jsonb_build_object takes at most 100 arguments
+    attrs = ["to_jsonb(t)"] + [
+        f"jsonb_build_object({', '.join(pairs[i:i + 50])})"
+        for i in range(0, len(pairs), 50)
+    ]
+    geom = "COALESCE(ST_GeomFromWKB(s.geom_wkb, 4326), t.geom)" if has_geom else "NULL"
+    return f"row_hash({' || '.join(attrs)}, {geom})"
+
+
+async def _table_column_types(conn: asyncpg.Connection, tables: list[str]) -> dict:
+    """Return ``{table: {column_name: sql_type}}`` for tables on the search path."""
+    rows = await conn.fetch(
+        """SELECT t.name AS table_name, a.attname,
+                  format_type(a.atttypid, a.atttypmod) AS col_type
+           FROM unnest($1::text[]) AS t(name)
+           JOIN pg_attribute a ON a.attrelid = to_regclass(t.name)
+           WHERE a.attnum > 0 AND NOT a.attisdropped""",
+        tables,
+    )
+    columns: dict[str, dict] = {}
+    for r in rows:
+        columns.setdefault(r["table_name"], {})[r["attname"]] = r["col_type"]
+    return columns
+
+
+def _stage_records(src, columns: list[str]):
+    """Yield COPY records for the staging table from a fiona collection.
+
+    Attribute values are sent as text and cast to the target column type
+    in SQL, so the staging table does not need per-type codecs.
+    """
+    for feature in src:
+        props = feature.get("properties", {})
+        geom = feature.get("geometry")
+
+        fid = props.get("id") or None
+        modified = props.get("_modified_at")
+        values = [None if props.get(c) is None else str(props.get(c)) for c in columns]
+        geom_wkb = shape(geom).wkb if geom else None
+
+        yield (
+            int(fid) if fid is not None else None,
+            *values,
+            str(modified) if modified else None,
+            geom_wkb,
+        )
+
+
+def _affected_rows(status: str) -> int:
+    """Parse the row count from an asyncpg status string like 'UPDATE 12'."""
     try:
-        await conn.execute(query, *values)
-    except Exception as e:
-        logger.warning("Failed to insert into %s: %s", table, e)
+        return int(status.rsplit(" ", 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
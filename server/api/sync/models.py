@@ -0,0 +1,26 @@
+from pydantic import BaseModel
+
+
+class UploadSessionCreate(BaseModel):
+    kind: str  # gpkg, photo
+    filename: str
+    size: int
+    sha256: str
+    # kind = gpkg
+    project_id: int | None = None
+    # kind = photo
+    related_type: str | None = None
+    related_id: int | None = None
+    caption: str = ""
+    latitude: float | None = None
+    longitude: float | None = None
+
+
+class UploadSessionOut(BaseModel):
+    upload_id: str
+    kind: str
+    filename: str
+    size: int
+    offset: int
+    chunk_size: int
+    status: str
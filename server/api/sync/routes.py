@@ -1,44 +1,48 @@
+import asyncio
+import json
 import logging
 import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
-from fastapi.responses import FileResponse
+import shapely
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, UploadFile, File, Query
+from fastapi.responses import FileResponse, Response
+from starlette.background import BackgroundTask
 
 from config import settings
-from database import get_pool
+from database import get_pool, get_read_pool, has_read_replica, mark_written, write_lsn
+from storage import save_upload
+from streaming import ndjson_response, wants_ndjson
 from auth.zitadel import get_current_user
 from auth.models import UserInfo
-from sync.merger import merge_gpkg_to_postgis
+from sync.jobs import UploadJob, create_upload_job, fail_upload_job, get_job_queue
 from sync.exporter import export_postgis_to_gpkg
+from sync.snapshots import etag_matches, get_snapshot, project_etag
 
 logger = logging.getLogger("fiberq.sync")
 
 router = APIRouter()
 
 
-@router.post("/upload")
+@router.post("/upload", status_code=202)
 async def upload_gpkg(
     project_id: int = Query(..., description="Project ID"),
     file: UploadFile = File(...),
     user: UserInfo = Depends(get_current_user),
 ):
-    """Upload a GeoPackage from QField and merge changes into PostGIS."""
+    """Upload a GeoPackage from QField and queue it for merging into PostGIS.
+
+    Returns immediately with the ``sync_id``; poll ``GET /sync/jobs/{sync_id}``
+    for progress and the final merge statistics.
+    """
     if not file.filename or not file.filename.endswith(".gpkg"):
         raise HTTPException(status_code=400, detail="File must be a .gpkg GeoPackage")
 
-    pool = get_pool()
+    queue = get_job_queue()
 
     # Log sync start
-    sync_row = await pool.fetchrow(
-        """INSERT INTO sync_log (user_sub, project_id, sync_type)
-           VALUES ($1, $2, 'upload')
-           RETURNING id""",
-        user.sub,
-        project_id,
-    )
-    sync_id = sync_row["id"]
+    sync_id = await create_upload_job(project_id, user.sub)
 
     # Save uploaded GPKG
     upload_dir = os.path.join(settings.storage_gpkg_dir, "uploads")
@@ -47,97 +51,294 @@ async def upload_gpkg(
     filepath = os.path.join(upload_dir, filename)
 
     try:
-        contents = await file.read()
-        with open(filepath, "wb") as f:
-            f.write(contents)
-
-        result = await merge_gpkg_to_postgis(filepath, project_id, user.sub, pool)
+        size, sha256 = await save_upload(file, filepath)
+        logger.info("Stored upload %s: %d bytes, sha256 %s", sync_id, size, sha256)
 
-        await pool.execute(
-            """UPDATE sync_log
-               SET completed_at = NOW(), status = 'completed',
-                   features_uploaded = $1, conflicts_resolved = $2,
-                   details = $3::jsonb
-               WHERE id = $4""",
-            result["features_merged"],
-            result["conflicts"],
-            '{}',
-            sync_id,
-        )
+        queue.submit(UploadJob(sync_id, filepath, project_id, user.sub))
 
-        return {
-            "status": "ok",
-            "sync_id": sync_id,
-            "features_merged": result["features_merged"],
-            "conflicts": result["conflicts"],
-        }
+    except asyncio.QueueFull:
+        logger.warning("Sync job queue full, rejecting upload %s", sync_id)
+        await fail_upload_job(sync_id, filepath)
+        raise HTTPException(status_code=503, detail="Sync queue is full, retry later")
 
     except Exception as e:
         logger.exception("Sync upload failed")
-        await pool.execute(
-            "UPDATE sync_log SET completed_at = NOW(), status = 'failed' WHERE id = $1",
-            sync_id,
-        )
+        await fail_upload_job(sync_id, filepath)
         raise HTTPException(status_code=500, detail=f"Sync failed: {e}")
 
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
+    return {
+        "status": "queued",
+        "sync_id": sync_id,
+        "size": size,
+        "sha256": sha256,
+    }
+
+
+@router.get("/jobs/{sync_id}")
+async def sync_job_status(
+    sync_id: int,
+    response: Response,
+    user: UserInfo = Depends(get_current_user),
+):
+    """Report status and per-layer progress of a queued upload merge.
+
+    Once the merge has finished, the response carries the write position
+    that covers it, so the client's next reads see the merged features.
+    """
+    pool = get_pool()
+    row = await pool.fetchrow(
+        """SELECT id, project_id, user_sub, sync_type, status, started_at, completed_at,
+                  features_uploaded, conflicts_resolved, details
+           FROM sync_log WHERE id = $1""",
+        sync_id,
+    )
+    # Other users' jobs only for engineers; field workers see their own
+    if not row or (row["user_sub"] != user.sub and not user.is_engineer):
+        raise HTTPException(status_code=404, detail="Sync job not found")
+
+    job = dict(row)
+    job["details"] = json.loads(job["details"]) if job["details"] else {}
+    if job["completed_at"] is not None and has_read_replica():
+        mark_written(response, await write_lsn())
+    return job
+
+
+@router.get("/download/work-order/{work_order_id}")
+async def download_work_order_gpkg(
+    work_order_id: int,
+    since: str | None = Query(
+        None,
+        description="Only changes after this ISO timestamp or previous download sync_id",
+    ),
+    user: UserInfo = Depends(get_current_user),
+):
+    """Export the features around a work order as GeoPackage for QField.
+
+    Geometry layers hold only the features intersecting the work order
+    area grown by ``settings.work_order_export_buffer_m``. ``since`` and
+    ``X-Sync-Id`` work as for project downloads.
+    """
+    pool = get_pool()
+    read_pool = get_read_pool()
+    row = await read_pool.fetchrow(
+        """SELECT project_id,
+                  ST_AsBinary(ST_Buffer(area_geom::geography, $2)::geometry) AS area
+           FROM work_orders WHERE id = $1""",
+        work_order_id,
+        settings.work_order_export_buffer_m,
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Work order not found")
+    if row["project_id"] is None or row["area"] is None:
+        raise HTTPException(status_code=400, detail="Work order has no project or area")
+
+    project_id = row["project_id"]
+    since_ts, since_snapshot = await _resolve_since(pool, project_id, since) if since else (None, None)
+    watermark = await _read_watermark(read_pool)
+    return await _send_export(
+        pool, read_pool, user, project_id, since_ts, since_snapshot, watermark, row["area"],
+        details={"work_order_id": work_order_id},
+        filename=f"fiberq_work_order_{work_order_id}",
+    )
 
 
 @router.get("/download/{project_id}")
 async def download_gpkg(
     project_id: int,
+    since: str | None = Query(
+        None,
+        description="Only changes after this ISO timestamp or previous download sync_id",
+    ),
+    bbox: str | None = Query(
+        None,
+        description="Only features within min_lon,min_lat,max_lon,max_lat (a crew's work area)",
+    ),
+    if_none_match: str | None = Header(None),
     user: UserInfo = Depends(get_current_user),
 ):
-    """Export current PostGIS data as GeoPackage for QField."""
+    """Export current PostGIS data as GeoPackage for QField.
+
+    With ``since`` the GeoPackage holds only features changed after that
+    point plus a ``Deleted_features`` tombstone layer. The response header
+    ``X-Sync-Id`` identifies this download for the next ``since``. With
+    ``bbox`` geometry layers hold only the features within that area.
+
+    Full downloads are served from a per-version snapshot cache and carry an
+    ``ETag``; a matching ``If-None-Match`` gets ``304 Not Modified``.
+    """
     pool = get_pool()
+    read_pool = get_read_pool()
 
-    project = await pool.fetchrow("SELECT id FROM projects WHERE id = $1", project_id)
+    project = await read_pool.fetchrow("SELECT id FROM projects WHERE id = $1", project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    download_dir = os.path.join(settings.storage_gpkg_dir, "downloads")
-    os.makedirs(download_dir, exist_ok=True)
-    filename = f"fiberq_{project_id}_{uuid.uuid4().hex[:8]}.gpkg"
-    filepath = os.path.join(download_dir, filename)
+    since_ts, since_snapshot = await _resolve_since(pool, project_id, since) if since else (None, None)
+    area = _parse_bbox(bbox) if bbox else None
+    # Before the ETag, so the cached snapshot holds at least what it saw
+    watermark = await _read_watermark(read_pool)
 
+    # Full downloads are served from the snapshot cache
+    etag = None
+    if since_ts is None and area is None:
+        etag = await project_etag(read_pool, project_id)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+
+    return await _send_export(
+        pool, read_pool, user, project_id, since_ts, since_snapshot, watermark,
+        shapely.box(*area).wkb if area else None,
+        details={"bbox": list(area) if area else None},
+        filename=f"fiberq_project_{project_id}",
+        etag=etag,
+    )
+
+
+async def _send_export(
+    pool,
+    read_pool,
+    user: UserInfo,
+    project_id: int,
+    since_ts: datetime | None,
+    since_snapshot: str | None,
+    watermark: str,
+    area: bytes | None,
+    details: dict,
+    filename: str,
+    etag: str | None = None,
+):
+    """Log a download in sync_log and send the export (or cached snapshot).
+
+    The log is written to the primary (``pool``); the data is read from
+    ``read_pool``, which may be the read replica. ``watermark`` is the
+    snapshot ``read_pool`` was at before exporting (see _read_watermark()).
+    """
+    sync_id = await pool.fetchval(
+        """INSERT INTO sync_log (user_sub, project_id, sync_type, details, xact_snapshot)
+           VALUES ($1, $2, 'download', $3::jsonb, $4::text::pg_snapshot)
+           RETURNING id""",
+        user.sub,
+        project_id,
+        json.dumps({
+            "since": since_ts.isoformat() if since_ts else None,
+            "etag": etag,
+            **details,
+        }),
+        watermark,
+    )
+
+    filepath = None
     try:
-        await export_postgis_to_gpkg(filepath, project_id, pool)
+        headers = {"X-Sync-Id": str(sync_id)}
+        if etag:
+            filepath = await get_snapshot(read_pool, project_id, etag)
+            headers["ETag"] = f'"{etag}"'
+            count = None
+            background = None
+        else:
+            download_dir = os.path.join(settings.storage_gpkg_dir, "downloads")
+            os.makedirs(download_dir, exist_ok=True)
+            filepath = os.path.join(download_dir, f"fiberq_{project_id}_{uuid.uuid4().hex[:8]}.gpkg")
+            count = await export_postgis_to_gpkg(
+                filepath, project_id, read_pool,
+                since=since_ts, area=area, since_snapshot=since_snapshot,
+            )
+            # Deltas and area exports are per client, remove them once sent
+            background = BackgroundTask(os.remove, filepath)
 
-        # Log sync
         await pool.execute(
-            """INSERT INTO sync_log (user_sub, project_id, sync_type, completed_at, status)
-               VALUES ($1, $2, 'download', NOW(), 'completed')""",
-            user.sub,
-            project_id,
+            """UPDATE sync_log
+               SET completed_at = NOW(), status = 'completed', features_downloaded = $1
+               WHERE id = $2""",
+            count,
+            sync_id,
         )
 
+        suffix = "_delta" if since_ts or since_snapshot else ""
         return FileResponse(
             filepath,
             media_type="application/geopackage+sqlite3",
-            filename=f"fiberq_project_{project_id}.gpkg",
+            filename=f"{filename}{suffix}.gpkg",
+            headers=headers,
+            background=background,
         )
 
     except Exception as e:
         logger.exception("GPKG export failed")
+        # A partial per-client export is never sent
+        if not etag and filepath and os.path.exists(filepath):
+            os.remove(filepath)
+        await pool.execute(
+            "UPDATE sync_log SET completed_at = NOW(), status = 'failed' WHERE id = $1",
+            sync_id,
+        )
         raise HTTPException(status_code=500, detail=f"Export failed: {e}")
 
 
+def _parse_bbox(bbox: str) -> tuple[float, float, float, float]:
+    """Parse ``min_lon,min_lat,max_lon,max_lat``."""
+    try:
+        values = tuple(float(v) for v in bbox.split(","))
+    except ValueError:
+        values = ()
+    if len(values) != 4 or values[0] > values[2] or values[1] > values[3]:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    return values
+
+
+async def _read_watermark(read_pool) -> str:
+    """Current snapshot of ``read_pool``'s server as ``pg_snapshot`` text.
+
+    Taken before a download's data is read, it is the watermark for the
+    next delta: every transaction it shows as committed is in the
+    download, everything else is sent next time. Unlike a timestamp this
+    follows commit order, so a long transaction that commits after the
+    download is not skipped. On a replica it reflects what was replayed.
+    """
+    return await read_pool.fetchval("SELECT pg_current_snapshot()::text")
+
+
+async def _resolve_since(pool, project_id: int, since: str) -> tuple[datetime, str | None]:
+    """Turn a ``since`` value (sync_id or ISO timestamp) into a timestamp
+    and, for a sync_id, the snapshot that download was read under."""
+    if since.isdigit():
+        row = await pool.fetchrow(
+            """SELECT started_at, xact_snapshot::text AS xact_snapshot FROM sync_log
+               WHERE id = $1 AND project_id = $2 AND sync_type = 'download'
+                 AND status = 'completed'""",
+            int(since),
+            project_id,
+        )
+        if row is None:
+            raise HTTPException(status_code=400, detail=f"Unknown download sync_id: {since}")
+        # Downloads logged before db/migrations/009 have no snapshot
+        return row["started_at"], row["xact_snapshot"]
+
+    try:
+        ts = datetime.fromisoformat(since.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be an ISO timestamp or sync_id")
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts, None
+
+
 @router.get("/status")
 async def sync_status(
+    request: Request,
     project_id: int = Query(...),
+    limit: int = Query(20, ge=1, le=settings.list_max_limit),
     user: UserInfo = Depends(get_current_user),
 ):
     """Get recent sync history for a project."""
-    pool = get_pool()
-    rows = await pool.fetch(
-        """SELECT id, user_sub, sync_type, started_at, completed_at,
-                  features_uploaded, features_downloaded, conflicts_resolved, status
-           FROM sync_log
-           WHERE project_id = $1
-           ORDER BY started_at DESC
-           LIMIT 20""",
-        project_id,
-    )
+    query = """SELECT id, user_sub, sync_type, started_at, completed_at,
+                      features_uploaded, features_downloaded, conflicts_resolved, status
+               FROM sync_log
+               WHERE project_id = $1
+               ORDER BY started_at DESC
+               LIMIT $2"""
+    pool = get_read_pool()
+    if wants_ndjson(request):
+        return ndjson_response(query, [project_id, limit], pool=pool)
+    rows = await pool.fetch(query, project_id, limit)
     return [dict(r) for r in rows]
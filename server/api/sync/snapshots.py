@@ -0,0 +1,168 @@
+"""Cached project GeoPackage snapshots.
+
+A full project export is stored once per project data version and served
+to every client that asks for the same version. The data version is the
+commit-ordered version (``database.commit_version``) of the project's rows
+in every exported table and of its deletions, so every committed insert,
+update or delete produces a new snapshot. The version hash doubles as the
+HTTP ``ETag``.
+
+Snapshots of older versions are removed when a new one is written, and
+the whole cache is kept under ``settings.snapshot_cache_max_mb`` by
+evicting the least recently served files.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+import asyncpg
+
+from config import settings
+from database import commit_version
+from sync.exporter import EXPORT_TABLES, export_postgis_to_gpkg
+
+logger = logging.getLogger("fiberq.sync.snapshots")
+
+# Bump when the export layout changes so old snapshots are not reused
+EXPORT_FORMAT_VERSION = 1
+
+# Superseded snapshots may still be streaming to a client for a while
+SUPERSEDED_GRACE_S = 300
+
+_versioned_tables: list[str] | None = None
+_build_locks: dict[str, asyncio.Lock] = {}
+_build_users: dict[str, int] = {}
+
+
+def _snapshot_dir() -> str:
+    path = os.path.join(settings.storage_gpkg_dir, "snapshots")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def snapshot_path(project_id: int, etag: str) -> str:
+    return os.path.join(_snapshot_dir(), f"fiberq_{project_id}_{etag}.gpkg")
+
+
+async def _get_versioned_tables(conn: asyncpg.Connection) -> list[str]:
+    """Exported tables that can be filtered by project_id."""
+    global _versioned_tables
+    if _versioned_tables is None:
+        rows = await conn.fetch(
+            """SELECT table_name FROM information_schema.columns
+               WHERE table_schema = $1 AND column_name = 'project_id'
+                 AND table_name = ANY($2::text[])""",
+            settings.db_schema,
+            [table for table, _, _ in EXPORT_TABLES],
+        )
+        _versioned_tables = sorted(r["table_name"] for r in rows)
+    return _versioned_tables
+
+
+async def project_etag(pool: asyncpg.Pool, project_id: int) -> str:
+    """Hash of the project's current data version."""
+    async with pool.acquire() as conn:
+        tables = await _get_versioned_tables(conn)
+        # Separate max() per project_id value so each is one index probe
+        newest = [
+            f"(SELECT max(_xid) FROM {table} WHERE project_id = $1)"
+            f", (SELECT max(_xid) FROM {table} WHERE project_id IS NULL)"
+            for table in [*tables, "deleted_features"]
+        ]
+        version = await commit_version(conn, f"SELECT GREATEST({', '.join(newest)})", project_id)
+
+    key = f"{EXPORT_FORMAT_VERSION}|{project_id}|{version}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+async def get_snapshot(pool: asyncpg.Pool, project_id: int, etag: str) -> str:
+    """Return the snapshot file for ``etag``, exporting it on a cache miss.
+
+    Concurrent misses for the same snapshot in this process share one
+    export; the file is moved into place atomically, so other API workers
+    never see a partial snapshot.
+    """
+    path = snapshot_path(project_id, etag)
+    lock = _build_locks.setdefault(path, asyncio.Lock())
+    _build_users[path] = _build_users.get(path, 0) + 1
+    try:
+        async with lock:
+            if os.path.exists(path):
+                os.utime(path)  # mark as recently served for eviction
+                logger.debug("Snapshot hit for project %s (%s)", project_id, etag)
+                return path
+
+            tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            try:
+                await export_postgis_to_gpkg(tmp_path, project_id, pool)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.info("Snapshot built for project %s (%s)", project_id, etag)
+    finally:
+        # Dropped by the last caller only (also when the export failed), so
+        # no one gets a second lock while this one is held or awaited
+        _build_users[path] -= 1
+        if not _build_users[path]:
+            del _build_users[path]
+            del _build_locks[path]
+
+    _evict(project_id, keep=path)
+    return path
+
+
+def _evict(project_id: int, keep: str):
+    """Drop superseded snapshots of the project, then enforce the disk budget."""
+    directory = _snapshot_dir()
+    prefix = f"fiberq_{project_id}_"
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".gpkg"):
+            continue
+        full = os.path.join(directory, name)
+        if full == keep:
+            continue
+        try:
+            st = os.stat(full)
+            if name.startswith(prefix) and time.time() - st.st_mtime > SUPERSEDED_GRACE_S:
+                os.remove(full)
+                continue
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, full))
+
+    budget = settings.snapshot_cache_max_mb * 1024 * 1024
+    used = sum(size for _, size, _ in entries)
+    try:
+        used += os.path.getsize(keep)
+    except FileNotFoundError:
+        pass
+
+    for mtime, size, full in sorted(entries):
+        if used <= budget:
+            break
+        try:
+            os.remove(full)
+            used -= size
+            logger.info("Evicted snapshot %s (idle %.0fs)", os.path.basename(full), time.time() - mtime)
+        except FileNotFoundError:
+            pass
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check an ``If-None-Match`` header against a snapshot ETag."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
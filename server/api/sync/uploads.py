@@ -0,0 +1,379 @@
+"""Resumable chunked uploads for field GeoPackages and photos.
+
+Protocol:
+1. ``POST /sync/uploads/`` declares the file (kind, size, sha256) and
+   returns an ``upload_id``.
+2. ``PUT /sync/uploads/{id}?offset=N`` sends the next chunk as the raw
+   request body. ``offset`` must equal the server's acknowledged offset;
+   ``GET /sync/uploads/{id}`` reports it so a client can resume after a
+   dropped connection.
+3. ``POST /sync/uploads/{id}/finalize`` verifies the whole-file checksum
+   and hands the file over: GPKGs are queued for merging, photos are
+   recorded in field_photos. Finalize is idempotent.
+
+Session state lives in the ``upload_sessions`` table so chunks may hit
+any API worker. Each worker sweeps sessions idle for longer than
+``settings.upload_session_ttl_hours``, whatever their state, together
+with their partial files.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+import aiofiles
+import asyncpg
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+
+from config import settings
+from database import get_pool
+from auth.zitadel import get_current_user
+from auth.models import UserInfo
+from sync.jobs import UploadJob, create_upload_job, fail_upload_job, get_job_queue
+from sync.models import UploadSessionCreate, UploadSessionOut
+from storage import UPLOAD_CHUNK_SIZE
+from work_orders.routes import insert_field_photo
+
+logger = logging.getLogger("fiberq.sync.uploads")
+
+router = APIRouter()
+
+UPLOAD_KINDS = {"gpkg", "photo"}
+SWEEP_INTERVAL_S = 3600
+
+
+def _partial_dir(kind: str) -> str:
+    """Partial files live on the volume of their final directory, so the
+    hand-over at finalize is a rename and never a cross-device copy."""
+    if kind == "photo":
+        path = os.path.join(settings.storage_photos_dir, ".partial")
+    else:
+        path = os.path.join(settings.storage_gpkg_dir, "partial")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _partial_path(upload_id: str, kind: str) -> str:
+    return os.path.join(_partial_dir(kind), f"{upload_id}.part")
+
+
+def _session_out(row) -> UploadSessionOut:
+    return UploadSessionOut(
+        upload_id=row["id"],
+        kind=row["kind"],
+        filename=row["filename"],
+        size=row["total_size"],
+        offset=row["received_size"],
+        chunk_size=settings.upload_chunk_size,
+        status=row["status"],
+    )
+
+
+async def _get_session(conn, upload_id: str, user_sub: str, lock: bool = False):
+    row = await conn.fetchrow(
+        f"""SELECT * FROM upload_sessions WHERE id = $1 AND user_sub = $2
+            {"FOR UPDATE" if lock else ""}""",
+        upload_id,
+        user_sub,
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return row
+
+
+async def _expire_sessions(pool) -> int:
+    """Drop sessions (and their partial files) idle past the TTL.
+
+    Abandoned open sessions as well as failed and finalized ones; the
+    latter are kept that long so a retried finalize gets its result.
+    """
+    rows = await pool.fetch(
+        """DELETE FROM upload_sessions
+           WHERE updated_at < NOW() - make_interval(hours => $1)
+           RETURNING id, kind""",
+        settings.upload_session_ttl_hours,
+    )
+    for r in rows:
+        path = _partial_path(r["id"], r["kind"])
+        if os.path.exists(path):
+            os.remove(path)
+    return len(rows)
+
+
+async def _sweep():
+    while True:
+        try:
+            expired = await _expire_sessions(get_pool())
+            if expired:
+                logger.info("Expired %d upload sessions", expired)
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning("Failed to expire upload sessions: %s", e)
+        await asyncio.sleep(SWEEP_INTERVAL_S)
+
+
+@router.post("/", response_model=UploadSessionOut, status_code=201)
+async def create_upload(
+    body: UploadSessionCreate,
+    user: UserInfo = Depends(get_current_user),
+):
+    """Start a resumable upload session."""
+    if body.kind not in UPLOAD_KINDS:
+        raise HTTPException(status_code=400, detail=f"Invalid upload kind: {body.kind}")
+    if body.kind == "gpkg":
+        if not body.filename.endswith(".gpkg"):
+            raise HTTPException(status_code=400, detail="File must be a .gpkg GeoPackage")
+        if body.project_id is None:
+            raise HTTPException(status_code=400, detail="project_id is required for GPKG uploads")
+    if body.kind == "photo" and (not body.related_type or body.related_id is None):
+        raise HTTPException(status_code=400, detail="related_type and related_id are required for photos")
+    if body.size < 0 or len(body.sha256) != 64:
+        raise HTTPException(status_code=400, detail="Invalid size or sha256")
+    if body.size > settings.upload_max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large: at most {settings.upload_max_size} bytes",
+        )
+
+    pool = get_pool()
+
+    upload_id = uuid.uuid4().hex
+    params = body.model_dump(exclude={"kind", "filename", "size", "sha256"})
+
+    # Empty partial file; chunks are written into it at their offsets
+    async with aiofiles.open(_partial_path(upload_id, body.kind), "wb"):
+        pass
+
+    row = await pool.fetchrow(
+        """INSERT INTO upload_sessions (id, user_sub, kind, filename, total_size, sha256, params)
+           VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb)
+           RETURNING *""",
+        upload_id, user.sub, body.kind, body.filename, body.size,
+        body.sha256.lower(), json.dumps(params),
+    )
+    return _session_out(row)
+
+
+@router.get("/{upload_id}", response_model=UploadSessionOut)
+async def get_upload(
+    upload_id: str,
+    user: UserInfo = Depends(get_current_user),
+):
+    """Report the acknowledged offset so a client can resume."""
+    pool = get_pool()
+    row = await _get_session(pool, upload_id, user.sub)
+    return _session_out(row)
+
+
+@router.put("/{upload_id}", response_model=UploadSessionOut)
+async def put_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    user: UserInfo = Depends(get_current_user),
+):
+    """Write one chunk (raw request body) at ``offset``."""
+    pool = get_pool()
+    row = await _get_session(pool, upload_id, user.sub)
+    if row["status"] != "open":
+        raise HTTPException(status_code=409, detail=f"Upload is {row['status']}")
+    if offset != row["received_size"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Offset mismatch: expected {row['received_size']}",
+        )
+
+    # Receive the chunk without holding a DB connection; it is spliced into
+    # the partial file only once it arrived completely.
+    part_path = _partial_path(upload_id, row["kind"])
+    chunk_path = f"{part_path}.{uuid.uuid4().hex[:8]}"
+    received = 0
+    try:
+        async with aiofiles.open(chunk_path, "wb") as out:
+            async for data in request.stream():
+                received += len(data)
+                if received > settings.upload_max_chunk_size:
+                    raise HTTPException(status_code=413, detail="Chunk too large")
+                if offset + received > row["total_size"]:
+                    raise HTTPException(status_code=400, detail="Chunk exceeds declared size")
+                await out.write(data)
+
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                row = await _get_session(conn, upload_id, user.sub, lock=True)
+                if row["status"] != "open" or offset != row["received_size"]:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"Offset mismatch: expected {row['received_size']}",
+                    )
+                await _write_at(part_path, chunk_path, offset, received)
+                row = await conn.fetchrow(
+                    """UPDATE upload_sessions
+                       SET received_size = $1, updated_at = NOW()
+                       WHERE id = $2 RETURNING *""",
+                    offset + received,
+                    upload_id,
+                )
+    finally:
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+    return _session_out(row)
+
+
+@router.post("/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    user: UserInfo = Depends(get_current_user),
+):
+    """Verify the whole-file checksum and hand the file over."""
+    pool = get_pool()
+    row = await _get_session(pool, upload_id, user.sub)
+    _check_finalizable(row)
+    if row["status"] == "finalized":
+        return json.loads(row["result"])
+
+    # Hashed before locking the session: a complete upload takes no more
+    # chunks, so the file cannot change, and no connection or row lock is
+    # held while it is read.
+    part_path = _partial_path(upload_id, row["kind"])
+    try:
+        sha256 = await _file_sha256(part_path)
+    except FileNotFoundError:
+        # Handed over by a concurrent finalize
+        sha256 = None
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            row = await _get_session(conn, upload_id, user.sub, lock=True)
+            _check_finalizable(row)
+            if row["status"] == "finalized":
+                return json.loads(row["result"])
+            if sha256 is None:
+                raise HTTPException(status_code=409, detail="Upload is being finalized")
+            if sha256 != row["sha256"]:
+                # The client has to start over with a new session
+                await conn.execute(
+                    "UPDATE upload_sessions SET status = 'failed', updated_at = NOW() WHERE id = $1",
+                    upload_id,
+                )
+                os.remove(part_path)
+                result = None
+            else:
+                params = json.loads(row["params"]) if row["params"] else {}
+                if row["kind"] == "gpkg":
+                    result = await _finalize_gpkg(part_path, params, user)
+                else:
+                    result = await _finalize_photo(part_path, row["filename"], params, user)
+                result["sha256"] = sha256
+
+                await conn.execute(
+                    """UPDATE upload_sessions
+                       SET status = 'finalized', result = $1::jsonb, updated_at = NOW()
+                       WHERE id = $2""",
+                    json.dumps(result),
+                    upload_id,
+                )
+
+    if result is None:
+        logger.warning("Upload %s checksum mismatch", upload_id)
+        raise HTTPException(status_code=422, detail="Checksum mismatch, upload discarded")
+    return result
+
+
+def _check_finalizable(row):
+    if row["status"] == "finalized":
+        return
+    if row["status"] != "open":
+        raise HTTPException(status_code=409, detail=f"Upload is {row['status']}")
+    if row["received_size"] != row["total_size"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload incomplete: {row['received_size']} of {row['total_size']} bytes",
+        )
+
+
+async def _finalize_gpkg(part_path: str, params: dict, user: UserInfo) -> dict:
+    project_id = params["project_id"]
+    sync_id = await create_upload_job(project_id, user.sub)
+
+    upload_dir = os.path.join(settings.storage_gpkg_dir, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    filepath = os.path.join(
+        upload_dir, f"{user.sub}_{project_id}_{uuid.uuid4().hex[:8]}.gpkg"
+    )
+
+    try:
+        get_job_queue().submit(UploadJob(sync_id, filepath, project_id, user.sub))
+    except asyncio.QueueFull:
+        # The partial file stays in place so finalize can be retried
+        logger.warning("Sync job queue full, rejecting upload %s", sync_id)
+        await fail_upload_job(sync_id, filepath)
+        raise HTTPException(status_code=503, detail="Sync queue is full, retry later")
+
+    # No await since submit(), so the worker cannot have started yet
+    os.replace(part_path, filepath)
+
+    return {"status": "queued", "sync_id": sync_id}
+
+
+async def _finalize_photo(part_path: str, original_name: str,
+                          params: dict, user: UserInfo) -> dict:
+    related_type = params["related_type"]
+    related_id = params["related_id"]
+    ext = os.path.splitext(original_name or "photo.jpg")[1]
+    filename = f"{related_type}_{related_id}_{uuid.uuid4().hex[:8]}{ext}"
+    os.replace(part_path, os.path.join(settings.storage_photos_dir, filename))
+
+    await insert_field_photo(
+        get_pool(), related_type, related_id, filename,
+        params.get("caption", ""), user.sub,
+        params.get("latitude"), params.get("longitude"),
+    )
+    return {"status": "ok", "filename": filename}
+
+
+async def _write_at(dest_path: str, chunk_path: str, offset: int, length: int):
+    """Copy a received chunk into the partial file at ``offset``.
+
+    The file is truncated after the chunk so leftovers from an earlier,
+    interrupted attempt at the same offset are discarded.
+    """
+    async with aiofiles.open(chunk_path, "rb") as src, aiofiles.open(dest_path, "r+b") as dst:
+        await dst.seek(offset)
+        while True:
+            data = await src.read(UPLOAD_CHUNK_SIZE)
+            if not data:
+                break
+            await dst.write(data)
+        await dst.truncate(offset + length)
+
+
+async def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    async with aiofiles.open(path, "rb") as f:
+        while True:
+            data = await f.read(UPLOAD_CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+# --- Session sweeper (one per API worker) -----------------------------------
+
+_sweeper: asyncio.Task | None = None
+
+
+def start_upload_sweeper():
+    global _sweeper
+    _sweeper = asyncio.create_task(_sweep())
+
+
+async def stop_upload_sweeper():
+    global _sweeper
+    if _sweeper:
+        _sweeper.cancel()
+        await asyncio.gather(_sweeper, return_exceptions=True)
+        _sweeper = None
@@ -0,0 +1,126 @@
+"""Vector tile cache.
+
+Tiles are keyed by layer, project, the layer's data version and z/x/y.
+The data version hashes the commit-ordered version
+(``database.commit_version``) of the layer's rows and deletions in the
+project, so every committed insert, update or delete moves the layer to
+new keys and a stale tile is never served. Versions are
+re-read at most every ``settings.tile_version_ttl_s`` seconds per layer,
+project and pool: a tile is rendered from the pool its version was read
+from, and a version read on the primary must not key a tile rendered
+from a replica that has not replayed it yet.
+
+Recently served tiles stay in memory (``settings.tile_cache_memory_tiles``
+per API worker). Every tile is also written below
+``settings.storage_tiles_dir``, which all workers share; when a layer's
+version changes, the tile directories of its older versions are removed.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+
+import asyncpg
+
+from config import settings
+from database import commit_version
+
+logger = logging.getLogger("fiberq.tiles.cache")
+
+_versions: dict[tuple[asyncpg.Pool, str, int], tuple[str, float]] = {}
+_memory: OrderedDict[tuple, bytes] = OrderedDict()
+
+
+def _layer_dir(table: str, project_id: int) -> str:
+    return os.path.join(settings.storage_tiles_dir, table, str(project_id))
+
+
+def _tile_path(table: str, project_id: int, version: str, z: int, x: int, y: int) -> str:
+    return os.path.join(_layer_dir(table, project_id), version, str(z), str(x), f"{y}.mvt")
+
+
+async def layer_version(pool: asyncpg.Pool, table: str, project_id: int) -> str:
+    """Hash of the layer's current data version within a project, as seen
+    through ``pool`` (render the tile from the same pool)."""
+    now = time.monotonic()
+    cached = _versions.get((pool, table, project_id))
+    if cached and now - cached[1] < settings.tile_version_ttl_s:
+        return cached[0]
+
+    async with pool.acquire() as conn:
+        data_version = await commit_version(
+            conn,
+            f"""SELECT GREATEST(
+                    (SELECT max(_xid) FROM {table} WHERE project_id = $1),
+                    (SELECT max(_xid) FROM deleted_features
+                     WHERE project_id = $1 AND table_name = $2))""",
+            project_id,
+            table,
+        )
+    key = f"{table}|{project_id}|{data_version}"
+    version = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    previous = cached[0] if cached else None
+    _versions[(pool, table, project_id)] = (version, now)
+    if previous and previous != version:
+        await asyncio.to_thread(_drop_old_versions, table, project_id, version)
+    return version
+
+
+def _drop_old_versions(table: str, project_id: int, keep: str):
+    directory = _layer_dir(table, project_id)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name != keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    logger.debug("Dropped stale tiles of %s for project %s", table, project_id)
+
+
+def get_tile(table: str, project_id: int, version: str, z: int, x: int, y: int) -> bytes | None:
+    """Cached tile from memory or disk, or None on a miss."""
+    key = (table, project_id, version, z, x, y)
+    tile = _memory.get(key)
+    if tile is not None:
+        _memory.move_to_end(key)
+        return tile
+
+    try:
+        with open(_tile_path(table, project_id, version, z, x, y), "rb") as f:
+            tile = f.read()
+    except FileNotFoundError:
+        return None
+    _remember(key, tile)
+    return tile
+
+
+def put_tile(table: str, project_id: int, version: str, z: int, x: int, y: int, tile: bytes):
+    """Store a tile in memory and on disk (written atomically)."""
+    _remember((table, project_id, version, z, x, y), tile)
+
+    path = _tile_path(table, project_id, version, z, x, y)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(tile)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Failed to write tile %s: %s", path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _remember(key: tuple, tile: bytes):
+    if settings.tile_cache_memory_tiles <= 0:
+        return
+    _memory[key] = tile
+    _memory.move_to_end(key)
+    while len(_memory) > settings.tile_cache_memory_tiles:
+        _memory.popitem(last=False)
@@ -0,0 +1,110 @@
+"""Mapbox Vector Tiles of the network layers.
+
+``GET /tiles/{layer}/{z}/{x}/{y}.mvt?project_id=`` renders one ``ftth_*``
+layer of a project with ``ST_AsMVT``. Geometries are simplified to the
+tile's pixel size before encoding, so low zoom levels stay small however
+many features the project has, and tiles outside the project's bounds
+(``projects.bounds_geom``) are empty without reading the layer. Tiles are
+served from ``tiles.cache`` and carry the layer's data version as ``ETag``.
+"""
+import asyncio
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import Response
+
+from config import settings
+from database import get_read_pool
+from auth.zitadel import get_current_user
+from auth.models import UserInfo
+from sync.exporter import EXPORT_TABLES, FLOAT_TYPES, INT_TYPES, _fetch_table_columns
+from sync.snapshots import etag_matches
+from tiles.cache import get_tile, layer_version, put_tile
+
+router = APIRouter()
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+# Width of the Web Mercator world (EPSG:3857) in metres
+WORLD_SIZE_M = 40075016.685578488
+
+TILE_LAYERS = [table for table, _, _ in EXPORT_TABLES if table.startswith("ftth_")]
+
+_tile_queries: dict[str, str] = {}
+
+
+async def _tile_query(pool, table: str) -> str:
+    """ST_AsMVT query for a layer; attributes are its non-internal columns."""
+    query = _tile_queries.get(table)
+    if query is None:
+        async with pool.acquire() as conn:
+            columns = (await _fetch_table_columns(conn, [table])).get(table, [])
+        attrs = []
+        for name, dtype in columns:
+            if name == "geom" or name.startswith("_"):
+                continue
+            if dtype in INT_TYPES or dtype in FLOAT_TYPES or dtype == "boolean":
+                attrs.append(f't."{name}"')
+            else:
+                attrs.append(f't."{name}"::text AS "{name}"')
+        select = "".join(f",\n               {a}" for a in attrs)
+        query = f"""
+WITH tile AS (
+    SELECT ST_TileEnvelope($1, $2, $3) AS env
+), bounds AS (
+    -- No rows (an empty tile) when the tile misses the project's bounds
+    SELECT tile.env, ST_Transform(ST_Expand(tile.env, $6), 4326) AS box
+    FROM tile, projects p
+    WHERE p.id = $4 AND ST_Transform(ST_Expand(tile.env, $6), 4326) && p.bounds_geom
+)
+SELECT ST_AsMVT(mvt, '{table}', {MVT_EXTENT}, 'geom') FROM (
+    SELECT ST_AsMVTGeom(
+               ST_SimplifyPreserveTopology(ST_Transform(t.geom, 3857), $5),
+               bounds.env, {MVT_EXTENT}, {MVT_BUFFER}, true) AS geom{select}
+    FROM {table} t, bounds
+    WHERE t.project_id = $4 AND t.geom && bounds.box
+) mvt
+WHERE mvt.geom IS NOT NULL
+"""
+        _tile_queries[table] = query
+    return query
+
+
+@router.get("/{layer}/{z}/{x}/{y}.mvt")
+async def get_vector_tile(
+    layer: str,
+    z: int,
+    x: int,
+    y: int,
+    project_id: int = Query(..., description="Project ID"),
+    if_none_match: str | None = Header(None),
+    user: UserInfo = Depends(get_current_user),
+):
+    """Vector tile of one network layer of a project.
+
+    A matching ``If-None-Match`` gets ``304 Not Modified``.
+    """
+    if layer not in TILE_LAYERS:
+        raise HTTPException(status_code=404, detail=f"Unknown layer: {layer}")
+    if not 0 <= z <= settings.tile_max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Tile out of range")
+
+    pool = get_read_pool()
+    version = await layer_version(pool, layer, project_id)
+    headers = {"ETag": f'"{version}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, version):
+        return Response(status_code=304, headers=headers)
+
+    tile = get_tile(layer, project_id, version, z, x, y)
+    if tile is None:
+        tile_size_m = WORLD_SIZE_M / 2 ** z
+        pixel_m = tile_size_m / MVT_EXTENT
+        tile = await pool.fetchval(
+            await _tile_query(pool, layer),
+            z, x, y, project_id,
+            pixel_m * settings.tile_simplify_pixels,
+            pixel_m * MVT_BUFFER,
+        ) or b""
+        await asyncio.to_thread(put_tile, layer, project_id, version, z, x, y, tile)
+
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE, headers=headers)
@@ -2,7 +2,9 @@ import json
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
 
-from database import get_pool
+from database import get_pool, get_read_pool
+from pagination import Page, page_params
+from storage import save_upload
 from auth.zitadel import get_current_user
 from auth.models import UserInfo
 from auth.roles import require_engineer_or_admin, require_any_role
@@ -32,12 +34,18 @@ VALID_TRANSITIONS = {
 async def list_work_orders(
     project_id: int | None = None,
     status: str | None = None,
+    page: Page = Depends(page_params),
     user: UserInfo = Depends(get_current_user),
 ):
-    pool = get_pool()
-    query = """SELECT id, title, description, order_type, priority, status,
+    pool = get_read_pool()
+    sort = ["created_at", "id"]
+    columns = page.columns(
+        """id, title, description, order_type, priority, status,
                       project_id, assigned_to_sub, assigned_by_sub,
-                      due_date, created_at, started_at, completed_at
+                      due_date, created_at, started_at, completed_at""",
+        WorkOrderOut, sort,
+    )
+    query = f"""SELECT {columns}
                FROM work_orders WHERE 1=1"""
     params = []
     idx = 1
@@ -51,9 +59,12 @@ async def list_work_orders(
         params.append(status)
         idx += 1
 
-    query += " ORDER BY created_at DESC"
+    query += f" AND {page.where(sort, params, descending=True)}"
+    query += page.order_limit(sort, params, descending=True)
+    if page.ndjson:
+        return page.stream(query, params, WorkOrderOut, pool=pool)
     rows = await pool.fetch(query, *params)
-    return [WorkOrderOut(**dict(r)) for r in rows]
+    return page.result(rows, WorkOrderOut, sort)
 
 
 @router.get("/my", response_model=list[WorkOrderOut])
@@ -61,7 +72,7 @@ async def my_work_orders(
     user: UserInfo = Depends(get_current_user),
 ):
     """Get work orders assigned to the current user."""
-    pool = get_pool()
+    pool = get_read_pool()
     rows = await pool.fetch(
         """SELECT id, title, description, order_type, priority, status,
                   project_id, assigned_to_sub, assigned_by_sub,
@@ -173,7 +184,7 @@ async def list_items(
     work_order_id: int,
     user: UserInfo = Depends(get_current_user),
 ):
-    pool = get_pool()
+    pool = get_read_pool()
     rows = await pool.fetch(
         """SELECT id, work_order_id, item_type, description, target_layer,
                   target_fid, quantity, unit, status, completed_at, notes
@@ -268,6 +279,30 @@ async def list_smr_reports(
 
 # --- Photos ------------------------------------------------------------------
 
+async def insert_field_photo(
+    pool,
+    related_type: str,
+    related_id: int,
+    filename: str,
+    caption: str,
+    user_sub: str,
+    latitude: float | None = None,
+    longitude: float | None = None,
+):
+    """Record a stored photo file in field_photos."""
+    geom_sql = "NULL"
+    params = [related_type, related_id, filename, caption, user_sub]
+    if latitude is not None and longitude is not None:
+        geom_sql = f"ST_SetSRID(ST_MakePoint(${len(params) + 1}, ${len(params) + 2}), 4326)"
+        params.extend([longitude, latitude])
+
+    await pool.execute(
+        f"""INSERT INTO field_photos (related_type, related_id, photo_path, caption, taken_by_sub, geom)
+            VALUES ($1, $2, $3, $4, $5, {geom_sql})""",
+        *params,
+    )
+
+
 @router.post("/photos/upload")
 async def upload_photo(
     related_type: str = Query(...),
@@ -286,24 +321,14 @@ async def upload_photo(
     filename = f"{related_type}_{related_id}_{uuid.uuid4().hex[:8]}{ext}"
     filepath = os.path.join(settings.storage_photos_dir, filename)
 
-    contents = await file.read()
-    with open(filepath, "wb") as f:
-        f.write(contents)
-
-    pool = get_pool()
-    geom_sql = "NULL"
-    params = [related_type, related_id, filename, caption, user.sub]
-    if latitude is not None and longitude is not None:
-        geom_sql = f"ST_SetSRID(ST_MakePoint(${len(params) + 1}, ${len(params) + 2}), 4326)"
-        params.extend([longitude, latitude])
+    size, sha256 = await save_upload(file, filepath)
 
-    await pool.execute(
-        f"""INSERT INTO field_photos (related_type, related_id, photo_path, caption, taken_by_sub, geom)
-            VALUES ($1, $2, $3, $4, $5, {geom_sql})""",
-        *params,
+    await insert_field_photo(
+        get_pool(), related_type, related_id, filename, caption, user.sub,
+        latitude, longitude,
     )
 
-    return {"status": "ok", "filename": filename}
+    return {"status": "ok", "filename": filename, "size": size, "sha256": sha256}
 
 
 @router.get("/photos/{photo_id}")
@@ -0,0 +1,101 @@
+"""Benchmark the GPKG writing stage of the sync exporter.
+
+Compares the former per-feature path (ST_AsText -> shapely.wkt.loads ->
+__geo_interface__ -> one fiona write per feature) with the columnar path
+used by ``sync.exporter`` (WKB -> vectorized shapely.from_wkb -> one
+pyogrio write per layer) on synthetic rows shaped like ftth_kablovi_*.
+
+No database is needed; rows are generated in memory the way asyncpg
+would return them. Only the writing stage is timed: the table queries,
+WKB transfer and delta filters of a real export are not, so the ratio
+printed is not an end-to-end export speedup.
+
+Usage (from server/api):
+    python ../benchmarks/export_writer.py [--features 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import fiona
+import shapely
+from shapely import wkt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from sync.exporter import build_layer_frame, write_layer  # noqa: E402
+
+COLUMNS = [
+    ("id", "integer"),
+    ("naziv", "text"),
+    ("tip", "text"),
+    ("broj_vlakana", "integer"),
+    ("duzina_m", "real"),
+    ("stanje", "text"),
+    ("project_id", "integer"),
+]
+
+
+def synthetic_rows(n: int):
+    """Rows as (attrs..., wkt, wkb) for both export paths."""
+    rng = random.Random(42)
+    rows = []
+    for i in range(n):
+        x, y = 20.0 + rng.random(), 44.0 + rng.random()
+        line = shapely.LineString([(x, y), (x + 0.001, y + 0.001), (x + 0.002, y)])
+        rows.append((
+            i + 1, f"K-{i}", "Backbone", rng.choice([12, 24, 48, 96]),
+            rng.random() * 500, "Planned", 1,
+            line.wkt, shapely.to_wkb(line),
+        ))
+    return rows
+
+
+def write_per_feature(path: str, rows):
+    schema = {
+        "geometry": "LineString",
+        "properties": {
+            name: "int" if dtype == "integer" else "float" if dtype == "real" else "str"
+            for name, dtype in COLUMNS
+        },
+    }
+    with fiona.open(path, "w", driver="GPKG", layer="Kablovi_podzemni",
+                    schema=schema, crs="EPSG:4326") as dst:
+        for row in rows:
+            props = {name: row[i] for i, (name, _) in enumerate(COLUMNS)}
+            geom = wkt.loads(row[len(COLUMNS)]).__geo_interface__
+            dst.write({"properties": props, "geometry": geom})
+
+
+def write_columnar(path: str, rows):
+    wkb_rows = [row[:len(COLUMNS)] + (row[len(COLUMNS) + 1],) for row in rows]
+    frame = build_layer_frame(wkb_rows, COLUMNS, has_geom=True)
+    write_layer(path, "Kablovi_podzemni", frame, "LineString")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--features", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.features)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, writer in (("per-feature (fiona)", write_per_feature),
+                             ("columnar (pyogrio)", write_columnar)):
+            path = os.path.join(tmp, f"{name.split()[0]}.gpkg")
+            start = time.perf_counter()
+            writer(path, rows)
+            results[name] = time.perf_counter() - start
+            print(f"{name:22s} {results[name]:8.2f} s  "
+                  f"({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    base, new = results.values()
+    print(f"write stage: {base / new:.1f}x for {args.features} synthetic features")
+
+
+if __name__ == "__main__":
+    main()
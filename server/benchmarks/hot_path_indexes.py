@@ -0,0 +1,239 @@
+"""Benchmark hot lookups before and after the 001_hot_path_indexes migration.
+
+Builds a synthetic fiber network in a scratch schema (``fiberq_bench``)
+cloned from the live schema: by default 1M splices arranged as 20-hop,
+12-fiber routes, patch connections at both route ends, cables, closures,
+paths and work orders spread over 100 projects. It then times
+
+- a full fiber trace (``fiber_plan.tracer.TRACE_SQL``),
+- an export table fetch (``sync.exporter._fetch_table``),
+- the closure, path, patch and work order item list queries,
+
+once with only the primary key, unique and GiST indexes and once more after
+applying ``db/migrations/001_hot_path_indexes.sql``. Any other plain b-tree
+indexes are left out of the clone so "before" matches the schema the
+migration was written against.
+
+Needs a database with the FiberQ schema (init.sql) and the API settings
+(DATABASE_URL). The scratch schema is dropped at the end unless --keep.
+
+Usage (from server/api):
+    python ../benchmarks/hot_path_indexes.py [--splices 1000000] [--repeat 20]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from config import settings  # noqa: E402
+from fiber_plan.tracer import AERIAL_LAYER_PATTERN, MAX_HOPS, TRACE_SQL  # noqa: E402
+from sync.exporter import _fetch_table, _fetch_table_columns  # noqa: E402
+
+BENCH_SCHEMA = "fiberq_bench"
+MIGRATION = os.path.join(
+    os.path.dirname(__file__), "..", "db", "migrations", "001_hot_path_indexes.sql"
+)
+
+TABLES = [
+    "ftth_okna", "ftth_stubovi", "ftth_kablovi_podzemni", "ftth_kablovi_nadzemni",
+    "ftth_trase", "ftth_cevi", "ftth_mufovi", "ftth_spojevi", "ftth_elements",
+    "fiber_splice_closures", "fiber_splices", "fiber_patch_connections", "fiber_paths",
+    "work_orders", "work_order_items", "smr_reports",
+]
+
+HOPS = 20
+FIBERS = 12
+PROJECTS = 100
+CABLE_LAYER = "ftth_kablovi_podzemni"
+ELEMENT_LAYER = "ftth_elements"
+
+
+async def create_schema(conn: asyncpg.Connection):
+    await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    for table in TABLES:
+        await conn.execute(
+            f"""CREATE TABLE {BENCH_SCHEMA}.{table}
+                (LIKE {settings.db_schema}.{table} INCLUDING DEFAULTS INCLUDING INDEXES)"""
+        )
+
+    # Keep primary keys, unique constraints and GiST indexes only
+    rows = await conn.fetch(
+        """SELECT ic.relname
+           FROM pg_index i
+           JOIN pg_class ic ON ic.oid = i.indexrelid
+           JOIN pg_namespace n ON n.oid = ic.relnamespace
+           JOIN pg_am am ON am.oid = ic.relam
+           WHERE n.nspname = $1 AND NOT i.indisunique AND am.amname = 'btree'""",
+        BENCH_SCHEMA,
+    )
+    for r in rows:
+        await conn.execute(f'DROP INDEX {BENCH_SCHEMA}."{r["relname"]}"')
+
+    await conn.execute(
+        f"""CREATE VIEW {BENCH_SCHEMA}.cable_lengths AS
+            SELECT 'ftth_kablovi_podzemni' AS table_name, id,
+                   COALESCE(total_len_m - COALESCE(slack_m, 0), geo_length_m) AS length_m, slack_m
+            FROM {BENCH_SCHEMA}.ftth_kablovi_podzemni
+            UNION ALL
+            SELECT 'ftth_kablovi_nadzemni', id,
+                   COALESCE(total_len_m - COALESCE(slack_m, 0), geo_length_m), slack_m
+            FROM {BENCH_SCHEMA}.ftth_kablovi_nadzemni"""
+    )
+
+
+async def load_data(conn: asyncpg.Connection, splices: int) -> int:
+    """Generate the synthetic network; returns the number of routes."""
+    routes = max(1, splices // (HOPS * FIBERS))
+    cables = routes * (HOPS + 1)
+    await conn.execute(
+        """INSERT INTO fiber_splices
+           (id, position_in_tray, cable_a_layer_id, cable_a_fid, fiber_a_number,
+            cable_b_layer_id, cable_b_fid, fiber_b_number, loss_db, status)
+           SELECT n + 1, n, $1,
+                  (n / ($3 * $4)) * ($3 + 1) + (n % ($3 * $4)) / $4 + 1,
+                  n % $4 + 1,
+                  $1,
+                  (n / ($3 * $4)) * ($3 + 1) + (n % ($3 * $4)) / $4 + 2,
+                  n % $4 + 1,
+                  0.05, 'spliced'
+           FROM generate_series(0, $2 - 1) AS n""",
+        CABLE_LAYER, routes * HOPS * FIBERS, HOPS, FIBERS,
+    )
+    await conn.execute(
+        """INSERT INTO fiber_patch_connections
+           (id, element_layer_id, element_fid, port_number,
+            fiber_cable_layer_id, fiber_cable_fid, fiber_number, status)
+           SELECT row_number() OVER (), $1, r * 2 + e + 1, f,
+                  $2, r * ($4 + 1) + e * $4 + 1, f, 'connected'
+           FROM generate_series(0, $3 - 1) AS r,
+                generate_series(0, 1) AS e,
+                generate_series(1, $5) AS f""",
+        ELEMENT_LAYER, CABLE_LAYER, routes, HOPS, FIBERS,
+    )
+    await conn.execute(
+        """INSERT INTO ftth_kablovi_podzemni (id, naziv, broj_vlakana, project_id, geom)
+           SELECT c, 'K-' || c, $2, c % $3 + 1,
+                  ST_SetSRID(ST_MakeLine(
+                      ST_MakePoint(20 + (c % 1000) * 0.001, 44 + (c / 1000) * 0.001),
+                      ST_MakePoint(20.0005 + (c % 1000) * 0.001, 44 + (c / 1000) * 0.001)), 4326)
+           FROM generate_series(1, $1) AS c""",
+        cables, FIBERS, PROJECTS,
+    )
+    await conn.execute(
+        """INSERT INTO fiber_splice_closures (id, closure_type, project_id, geom)
+           SELECT n, 'inline', n % $2 + 1, ST_SetSRID(ST_MakePoint(20 + n * 1e-5, 44), 4326)
+           FROM generate_series(1, $1) AS n""",
+        routes * HOPS, PROJECTS,
+    )
+    await conn.execute(
+        """INSERT INTO fiber_paths (id, path_name, olt_element_fid, olt_port_number, project_id)
+           SELECT n, 'Path ' || n, n, 1, n % $2 + 1
+           FROM generate_series(1, $1) AS n""",
+        routes * FIBERS, PROJECTS,
+    )
+    await conn.execute(
+        """INSERT INTO work_orders (id, title, order_type, project_id)
+           SELECT n, 'WO ' || n, 'installation', n % $2 + 1
+           FROM generate_series(1, $1) AS n""",
+        routes * 5, PROJECTS,
+    )
+    await conn.execute(
+        """INSERT INTO work_order_items (id, work_order_id, item_type)
+           SELECT n, n / 10 + 1, 'splice'
+           FROM generate_series(0, $1 * 10 - 1) AS n""",
+        routes * 5,
+    )
+    await conn.execute("ANALYZE")
+    return routes
+
+
+def benchmarks(routes: int, export_columns: list):
+    """(name, coroutine factory) pairs; each factory takes conn and rng."""
+    return [
+        ("trace (20 hops)", lambda conn, rng: conn.fetch(
+            TRACE_SQL, rng.randrange(routes) * 2 + 1, rng.randint(1, FIBERS), "", MAX_HOPS,
+            settings.fiber_attenuation_db_per_km, AERIAL_LAYER_PATTERN)),
+        ("export table fetch", lambda conn, rng: _fetch_table(
+            conn, CABLE_LAYER, rng.randint(1, PROJECTS), export_columns)),
+        ("list closures", lambda conn, rng: conn.fetch(
+            """SELECT id, muf_fid, closure_type, closure_model, tray_count, max_splices, project_id
+               FROM fiber_splice_closures WHERE project_id = $1 ORDER BY id""",
+            rng.randint(1, PROJECTS))),
+        ("list paths", lambda conn, rng: conn.fetch(
+            """SELECT id, path_name, total_loss_db, status
+               FROM fiber_paths WHERE project_id = $1 ORDER BY id""",
+            rng.randint(1, PROJECTS))),
+        ("list patches", lambda conn, rng: conn.fetch(
+            """SELECT id, port_number, fiber_cable_fid, fiber_number
+               FROM fiber_patch_connections
+               WHERE element_fid = $1 AND element_layer_id = $2
+               ORDER BY port_number""",
+            rng.randrange(routes * 2) + 1, ELEMENT_LAYER)),
+        ("list work order items", lambda conn, rng: conn.fetch(
+            """SELECT id, item_type, status
+               FROM work_order_items WHERE work_order_id = $1 ORDER BY id""",
+            rng.randint(1, routes * 5))),
+    ]
+
+
+async def run_all(conn, cases, repeat: int) -> dict:
+    results = {}
+    for name, make in cases:
+        rng = random.Random(42)
+        await make(conn, rng)  # warm up caches and the statement cache
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await make(conn, rng)
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = statistics.median(timings)
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--splices", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schema")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        dsn=settings.asyncpg_dsn,
+        server_settings={"search_path": f"{BENCH_SCHEMA},public"},
+    )
+    try:
+        await create_schema(conn)
+        start = time.perf_counter()
+        routes = await load_data(conn, args.splices)
+        print(f"loaded {routes * HOPS * FIBERS} splices ({routes} routes) "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        columns = (await _fetch_table_columns(conn, [CABLE_LAYER]))[CABLE_LAYER]
+        cases = benchmarks(routes, columns)
+        before = await run_all(conn, cases, args.repeat)
+
+        with open(MIGRATION) as f:
+            await conn.execute(f.read())
+        await conn.execute("ANALYZE")
+        after = await run_all(conn, cases, args.repeat)
+
+        print(f"{'median ms':24s} {'before':>10s} {'after':>10s} {'speedup':>9s}")
+        for name, _ in cases:
+            print(f"{name:24s} {before[name]:10.2f} {after[name]:10.2f} "
+                  f"{before[name] / after[name]:8.1f}x")
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -45,9 +45,12 @@ CREATE TABLE ftth_okna (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(Point, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_okna_geom ON ftth_okna USING GIST (geom);
+CREATE INDEX idx_ftth_okna_project ON ftth_okna (project_id);
 
 -- Poles (Stubovi)
 CREATE TABLE ftth_stubovi (
@@ -62,9 +65,12 @@ CREATE TABLE ftth_stubovi (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(Point, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_stubovi_geom ON ftth_stubovi USING GIST (geom);
+CREATE INDEX idx_ftth_stubovi_project ON ftth_stubovi (project_id);
 
 -- Underground cables (Kablovi podzemni)
 CREATE TABLE ftth_kablovi_podzemni (
@@ -84,15 +90,20 @@ CREATE TABLE ftth_kablovi_podzemni (
     duzina_m REAL,
     slack_m REAL DEFAULT 0,
     total_len_m REAL,
+    total_len_override_m REAL,
+    geo_length_m REAL,
     stanje TEXT DEFAULT 'Planned',
     godina_ugradnje INTEGER DEFAULT EXTRACT(YEAR FROM NOW()),
     napomena TEXT,
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(LineString, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_kablovi_podzemni_geom ON ftth_kablovi_podzemni USING GIST (geom);
+CREATE INDEX idx_ftth_kablovi_podzemni_project ON ftth_kablovi_podzemni (project_id);
 
 -- Aerial cables (Kablovi nadzemni / vazdusni)
 CREATE TABLE ftth_kablovi_nadzemni (
@@ -112,15 +123,20 @@ CREATE TABLE ftth_kablovi_nadzemni (
     duzina_m REAL,
     slack_m REAL DEFAULT 0,
     total_len_m REAL,
+    total_len_override_m REAL,
+    geo_length_m REAL,
     stanje TEXT DEFAULT 'Planned',
     godina_ugradnje INTEGER DEFAULT EXTRACT(YEAR FROM NOW()),
     napomena TEXT,
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(LineString, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_kablovi_nadzemni_geom ON ftth_kablovi_nadzemni USING GIST (geom);
+CREATE INDEX idx_ftth_kablovi_nadzemni_project ON ftth_kablovi_nadzemni (project_id);
 
 -- Routes (Trase)
 CREATE TABLE ftth_trase (
@@ -133,9 +149,12 @@ CREATE TABLE ftth_trase (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(LineString, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_trase_geom ON ftth_trase USING GIST (geom);
+CREATE INDEX idx_ftth_trase_project ON ftth_trase (project_id);
 
 -- PE pipes / ducts (Cevi)
 CREATE TABLE ftth_cevi (
@@ -151,9 +170,12 @@ CREATE TABLE ftth_cevi (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(LineString, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_cevi_geom ON ftth_cevi USING GIST (geom);
+CREATE INDEX idx_ftth_cevi_project ON ftth_cevi (project_id);
 
 -- Joint closures / connections (Mufovi / Nastavci)
 CREATE TABLE ftth_mufovi (
@@ -167,9 +189,12 @@ CREATE TABLE ftth_mufovi (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(Point, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_mufovi_geom ON ftth_mufovi USING GIST (geom);
+CREATE INDEX idx_ftth_mufovi_project ON ftth_mufovi (project_id);
 
 -- Fiber breaks / optical reserves (Spojevi)
 CREATE TABLE ftth_spojevi (
@@ -188,9 +213,12 @@ CREATE TABLE ftth_spojevi (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(Point, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_spojevi_geom ON ftth_spojevi USING GIST (geom);
+CREATE INDEX idx_ftth_spojevi_project ON ftth_spojevi (project_id);
 
 -- =============================================================================
 -- NETWORK ELEMENTS (ODF, OTB, TB, TO, Patch Panel)
@@ -218,9 +246,12 @@ CREATE TABLE ftth_elements (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(Point, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_ftth_elements_geom ON ftth_elements USING GIST (geom);
+CREATE INDEX idx_ftth_elements_project ON ftth_elements (project_id);
 
 -- =============================================================================
 -- FIBER SPLICE PLAN TABLES
@@ -237,9 +268,12 @@ CREATE TABLE fiber_splice_closures (
     project_id INTEGER REFERENCES projects(id),
     geom GEOMETRY(Point, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    _row_hash TEXT
 );
 CREATE INDEX idx_fiber_splice_closures_geom ON fiber_splice_closures USING GIST (geom);
+CREATE INDEX idx_fiber_splice_closures_project ON fiber_splice_closures (project_id, id);
 
 -- Splice trays (тавички в муфа)
 CREATE TABLE fiber_splice_trays (
@@ -248,6 +282,7 @@ CREATE TABLE fiber_splice_trays (
     tray_number INTEGER NOT NULL,
     tray_type TEXT,
     capacity INTEGER DEFAULT 12,
+    _row_hash TEXT,
     UNIQUE (closure_id, tray_number)
 );
 
@@ -280,8 +315,11 @@ CREATE TABLE fiber_splices (
     photo_path TEXT,
     _modified_by_sub TEXT,
     _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _row_hash TEXT,
     UNIQUE (tray_id, position_in_tray)
 );
+CREATE INDEX idx_fiber_splices_side_a ON fiber_splices (cable_a_layer_id, cable_a_fid, fiber_a_number);
+CREATE INDEX idx_fiber_splices_side_b ON fiber_splices (cable_b_layer_id, cable_b_fid, fiber_b_number);
 
 -- Patch connections (ODF/OTB port-to-fiber mappings)
 CREATE TABLE fiber_patch_connections (
@@ -297,8 +335,11 @@ CREATE TABLE fiber_patch_connections (
     status TEXT DEFAULT 'free',
     connected_to_patch_id INTEGER REFERENCES fiber_patch_connections(id),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _row_hash TEXT
 );
+CREATE INDEX idx_fiber_patch_connections_port ON fiber_patch_connections (element_fid, port_number);
+CREATE INDEX idx_fiber_patch_connections_fiber ON fiber_patch_connections (fiber_cable_layer_id, fiber_cable_fid, fiber_number);
 
 -- Fiber paths (cached end-to-end OLT→ONU traces)
 CREATE TABLE fiber_paths (
@@ -313,9 +354,163 @@ CREATE TABLE fiber_paths (
     path_segments JSONB,
     status TEXT DEFAULT 'planned',
     project_id INTEGER REFERENCES projects(id),
+    -- Members of materialized ('traced') paths, for incremental re-tracing:
+    -- splice ids and fiber ends as 'cable_fid:fiber_number:cable_layer_id'
+    splice_ids INTEGER[] DEFAULT '{}',
+    fiber_keys TEXT[] DEFAULT '{}',
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _row_hash TEXT
 );
+CREATE INDEX idx_fiber_paths_project ON fiber_paths (project_id, id);
+CREATE INDEX idx_fiber_paths_splices ON fiber_paths USING GIN (splice_ids);
+CREATE INDEX idx_fiber_paths_fiber_keys ON fiber_paths USING GIN (fiber_keys);
+CREATE UNIQUE INDEX idx_fiber_paths_traced_port ON fiber_paths (project_id, olt_element_fid, olt_port_number)
+    WHERE status = 'traced';
+
+-- Global fiber plan version, bumped only by TRUNCATE (which has no rows to
+-- attribute to projects); see fiber_plan_project_version.
+CREATE TABLE fiber_plan_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+INSERT INTO fiber_plan_version DEFAULT VALUES;
+
+-- Fiber plan version per project, bumped by every change to the splices,
+-- trays, patches or cables of the project's fiber graph. In-memory fiber
+-- graphs (fiber_plan.graph) are rebuilt when the sum of their project's
+-- version and the global fiber_plan_version (bumped only by TRUNCATE)
+-- moves. Writers of different projects never wait on each other's bump.
+CREATE TABLE fiber_plan_project_version (
+    project_id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Projects whose fiber graph contains any of ``changed`` (rows of ``tbl``
+-- as JSONB), by the membership rules of fiber_plan.graph: splices in a
+-- project's closures or on its cables, patches on its elements or cables
+-- or on a cable its splices reach, and the lengths of all those cables.
+-- A cable no splice or patch refers to is in no graph.
+CREATE OR REPLACE FUNCTION fiber_plan_projects(tbl TEXT, changed JSONB[]) RETURNS INTEGER[] AS $$
+    WITH r AS (
+        SELECT j FROM unnest(changed) AS j
+    ),
+    changed_cables AS (
+        SELECT (j->>'id')::int AS fid, (j->>'project_id')::int AS project_id FROM r
+        WHERE tbl IN ('ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni')
+    ),
+    -- Cables that graphs reach through their splices
+    reached AS (
+        SELECT fid FROM changed_cables
+        UNION SELECT (j->>'fiber_cable_fid')::int FROM r WHERE tbl = 'fiber_patch_connections'
+    ),
+    splices AS (
+        SELECT (j->>'tray_id')::int AS tray_id, (j->>'cable_a_fid')::int AS cable_a_fid,
+               (j->>'cable_b_fid')::int AS cable_b_fid
+        FROM r WHERE tbl = 'fiber_splices'
+        UNION
+        SELECT tray_id, cable_a_fid, cable_b_fid FROM fiber_splices
+        WHERE cable_a_fid IN (SELECT fid FROM reached) OR cable_b_fid IN (SELECT fid FROM reached)
+    ),
+    patches AS (
+        SELECT (j->>'element_fid')::int AS element_fid, (j->>'fiber_cable_fid')::int AS cable_fid
+        FROM r WHERE tbl = 'fiber_patch_connections'
+        UNION
+        SELECT element_fid, fiber_cable_fid FROM fiber_patch_connections
+        WHERE fiber_cable_fid IN (SELECT fid FROM changed_cables)
+    ),
+    closures AS (
+        SELECT (j->>'closure_id')::int AS id FROM r WHERE tbl = 'fiber_splice_trays'
+        UNION SELECT t.closure_id FROM splices s JOIN fiber_splice_trays t ON t.id = s.tray_id
+    ),
+    cables AS (
+        SELECT cable_a_fid AS fid FROM splices
+        UNION SELECT cable_b_fid FROM splices
+        UNION SELECT cable_fid FROM patches
+    )
+    SELECT array_agg(DISTINCT p ORDER BY p) FROM (
+        SELECT project_id FROM fiber_splice_closures WHERE id IN (SELECT id FROM closures)
+        UNION SELECT project_id FROM ftth_elements WHERE id IN (SELECT element_fid FROM patches)
+        UNION SELECT project_id FROM ftth_kablovi_podzemni WHERE id IN (SELECT fid FROM cables)
+        UNION SELECT project_id FROM ftth_kablovi_nadzemni WHERE id IN (SELECT fid FROM cables)
+        -- Deleted cables are gone from their table
+        UNION SELECT project_id FROM changed_cables WHERE fid IN (SELECT fid FROM cables)
+    ) AS x(p)
+    WHERE p IS NOT NULL;
+$$ LANGUAGE sql STABLE;
+
+-- Statement trigger; needs the transition tables new_rows / old_rows.
+-- Project rows are locked in id order, so concurrent bumps cannot deadlock.
+CREATE OR REPLACE FUNCTION bump_fiber_plan_version() RETURNS trigger AS $$
+DECLARE
+    changed JSONB[];
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE fiber_plan_version SET version = version + 1, updated_at = NOW();
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        changed := ARRAY(SELECT to_jsonb(n) FROM new_rows n);
+    ELSIF TG_OP = 'DELETE' THEN
+        changed := ARRAY(SELECT to_jsonb(o) FROM old_rows o);
+    ELSIF TG_TABLE_NAME IN ('ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni') THEN
+        -- Graphs carry only the cables' lengths
+        changed := ARRAY(
+            SELECT to_jsonb(n) FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.total_len_m IS DISTINCT FROM o.total_len_m
+               OR n.slack_m IS DISTINCT FROM o.slack_m
+        );
+    ELSE
+        changed := ARRAY(
+            SELECT to_jsonb(n) FROM new_rows n
+            UNION ALL
+            SELECT to_jsonb(o) FROM old_rows o
+        );
+    END IF;
+
+    IF cardinality(changed) > 0 THEN
+        INSERT INTO fiber_plan_project_version AS v (project_id, version)
+        SELECT p, 1 FROM unnest(fiber_plan_projects(TG_TABLE_NAME, changed)) AS p
+        ORDER BY p
+        ON CONFLICT (project_id) DO UPDATE SET version = v.version + 1, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event
+DO $$
+DECLARE
+    t TEXT;
+    op TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'fiber_splices', 'fiber_splice_trays', 'fiber_patch_connections',
+        'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_version ON %I', t, t);
+        FOREACH op IN ARRAY ARRAY['INSERT', 'UPDATE', 'DELETE'] LOOP
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_version_%s ON %I', t, lower(op), t);
+            EXECUTE format(
+                'CREATE TRIGGER trg_%s_version_%s AFTER %s ON %I
+                 REFERENCING %s
+                 FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version()',
+                t, lower(op), op, t,
+                CASE op
+                    WHEN 'INSERT' THEN 'NEW TABLE AS new_rows'
+                    WHEN 'UPDATE' THEN 'OLD TABLE AS old_rows NEW TABLE AS new_rows'
+                    ELSE 'OLD TABLE AS old_rows'
+                END);
+        END LOOP;
+        IF t NOT LIKE 'ftth_%' THEN
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_version_truncate ON %I', t, t);
+            EXECUTE format(
+                'CREATE TRIGGER trg_%s_version_truncate AFTER TRUNCATE ON %I
+                 FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version()', t, t);
+        END IF;
+    END LOOP;
+END $$;
 
 -- =============================================================================
 -- WORK ORDERS + SMR REPORTING
@@ -340,11 +535,14 @@ CREATE TABLE work_orders (
     verified_at TIMESTAMPTZ,
     verified_by_sub TEXT,
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id()
 );
 CREATE INDEX idx_work_orders_area_geom ON work_orders USING GIST (area_geom);
 CREATE INDEX idx_work_orders_assigned ON work_orders (assigned_to_sub);
 CREATE INDEX idx_work_orders_status ON work_orders (status);
+CREATE INDEX idx_work_orders_project ON work_orders (project_id, created_at DESC, id DESC);
+CREATE INDEX idx_work_orders_created ON work_orders (created_at DESC, id DESC);
 
 -- Work order items (individual tasks within a work order)
 CREATE TABLE work_order_items (
@@ -361,6 +559,7 @@ CREATE TABLE work_order_items (
     completed_by_sub TEXT,
     notes TEXT
 );
+CREATE INDEX idx_work_order_items_work_order ON work_order_items (work_order_id);
 
 -- Construction activity reports (SMR)
 CREATE TABLE smr_reports (
@@ -376,9 +575,11 @@ CREATE TABLE smr_reports (
     issues TEXT,
     geom GEOMETRY(Point, 4326),
     _modified_by_sub TEXT,
-    _modified_at TIMESTAMPTZ DEFAULT NOW()
+    _modified_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id()
 );
 CREATE INDEX idx_smr_reports_geom ON smr_reports USING GIST (geom);
+CREATE INDEX idx_smr_reports_work_order ON smr_reports (work_order_id);
 
 -- Field photos
 CREATE TABLE field_photos (
@@ -409,8 +610,431 @@ CREATE TABLE sync_log (
     features_downloaded INTEGER DEFAULT 0,
     conflicts_resolved INTEGER DEFAULT 0,
     status TEXT DEFAULT 'in_progress',
-    details JSONB
+    details JSONB,
+    -- Snapshot a download's data was read under (delta watermark, see 009)
+    xact_snapshot PG_SNAPSHOT,
+    -- Backend pid of the job queue running an upload merge (see 014)
+    worker_pid INTEGER
+);
+
+-- Resumable (chunked) upload sessions for GPKG and photo uploads
+CREATE TABLE upload_sessions (
+    id TEXT PRIMARY KEY,
+    user_sub TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    total_size BIGINT NOT NULL,
+    sha256 TEXT NOT NULL,
+    received_size BIGINT NOT NULL DEFAULT 0,
+    params JSONB DEFAULT '{}'::jsonb,
+    status TEXT DEFAULT 'open',
+    result JSONB,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX idx_upload_sessions_updated ON upload_sessions (updated_at);
+
+-- =============================================================================
+-- CABLE LENGTHS
+-- =============================================================================
+
+-- Geodesic cable length, maintained on every write. total_len_m is
+-- total_len_override_m when set, else geo_length_m plus slack. A value
+-- written to total_len_m itself is kept as the override, so lengths
+-- entered by users are never replaced; writing NULL clears it.
+CREATE OR REPLACE FUNCTION maintain_cable_length() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.total_len_override_m IS NULL THEN
+            NEW.total_len_override_m := NEW.total_len_m;
+        END IF;
+    ELSIF NEW.total_len_m IS DISTINCT FROM OLD.total_len_m
+          AND NEW.total_len_override_m IS NOT DISTINCT FROM OLD.total_len_override_m THEN
+        NEW.total_len_override_m := NEW.total_len_m;
+    END IF;
+    NEW.geo_length_m := ST_Length(NEW.geom::geography);
+    NEW.total_len_m := COALESCE(NEW.total_len_override_m, NEW.geo_length_m + COALESCE(NEW.slack_m, 0));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_ftth_kablovi_podzemni_length
+    BEFORE INSERT OR UPDATE ON ftth_kablovi_podzemni
+    FOR EACH ROW EXECUTE FUNCTION maintain_cable_length();
+CREATE TRIGGER trg_ftth_kablovi_nadzemni_length
+    BEFORE INSERT OR UPDATE ON ftth_kablovi_nadzemni
+    FOR EACH ROW EXECUTE FUNCTION maintain_cable_length();
+
+-- Cached fiber graphs carry cable lengths; the cable tables' version
+-- triggers are created with the fiber plan ones (FIBER PLAN above).
+
+-- Lengths of both cable tables, looked up by the fiber tracer. length_m
+-- plus slack_m is total_len_m: the entered length when there is one, else
+-- the geodesic length plus slack.
+CREATE VIEW cable_lengths AS
+    SELECT 'ftth_kablovi_podzemni' AS table_name, id,
+           COALESCE(total_len_m - COALESCE(slack_m, 0), geo_length_m) AS length_m, slack_m
+    FROM ftth_kablovi_podzemni
+    UNION ALL
+    SELECT 'ftth_kablovi_nadzemni', id,
+           COALESCE(total_len_m - COALESCE(slack_m, 0), geo_length_m), slack_m
+    FROM ftth_kablovi_nadzemni;
+
+-- =============================================================================
+-- PROJECT BOUNDS
+-- =============================================================================
+
+-- Bounding box as a (never degenerate) Polygon, the type of bounds_geom
+CREATE OR REPLACE FUNCTION project_envelope(b box2d) RETURNS geometry AS $$
+    SELECT ST_MakeEnvelope(ST_XMin(b), ST_YMin(b), ST_XMax(b), ST_YMax(b), 4326);
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+-- Grow projects.bounds_geom to cover inserted or moved features. Bounds
+-- only grow, so they stay a superset of the project's features after
+-- deletes; refresh_project_bounds() recomputes them exactly.
+CREATE OR REPLACE FUNCTION extend_project_bounds() RETURNS trigger AS $$
+BEGIN
+    WITH added AS (
+        SELECT project_id, ST_Extent(geom) AS box
+        FROM new_rows
+        WHERE project_id IS NOT NULL AND geom IS NOT NULL
+        GROUP BY project_id
+    )
+    UPDATE projects p
+    SET bounds_geom = project_envelope(
+        CASE WHEN p.bounds_geom IS NULL THEN a.box
+             ELSE ST_CombineBBox(a.box, p.bounds_geom) END)
+    FROM added a
+    WHERE p.id = a.project_id
+      AND (p.bounds_geom IS NULL OR NOT a.box::geometry @ p.bounds_geom);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Exact bounds from the project's current features
+CREATE OR REPLACE FUNCTION refresh_project_bounds(pid INTEGER) RETURNS void AS $$
+    UPDATE projects SET bounds_geom = (
+        SELECT project_envelope(ST_Extent(geom)) FROM (
+            SELECT geom FROM ftth_okna WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_stubovi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_kablovi_podzemni WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_kablovi_nadzemni WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_trase WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_cevi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_mufovi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_spojevi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_elements WHERE project_id = pid
+            UNION ALL SELECT geom FROM fiber_splice_closures WHERE project_id = pid
+        ) g
+    )
+    WHERE id = pid;
+$$ LANGUAGE sql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures'
+    ] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_bounds_insert AFTER INSERT ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION extend_project_bounds()', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_bounds_update AFTER UPDATE ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION extend_project_bounds()', t, t);
+    END LOOP;
+END $$;
+
+-- =============================================================================
+-- ROW HASHES
+-- =============================================================================
+
+-- md5 over a row's attributes (as canonical jsonb text, without system
+-- columns) and its WKB geometry. Called by the trigger below and by the
+-- bulk merge to hash a staged row before writing it.
+CREATE OR REPLACE FUNCTION row_hash(attrs JSONB, geom GEOMETRY) RETURNS TEXT AS $$
+    SELECT md5(
+        (attrs - 'geom' - '_row_hash' - '_modified_at' - '_modified_by_sub' - '_xid')::text
+        || COALESCE(encode(ST_AsBinary(geom), 'hex'), '')
+    );
+$$ LANGUAGE sql IMMUTABLE;
+
+-- TG_ARGV[0] = 'geom' for tables with a geometry column
+CREATE OR REPLACE FUNCTION maintain_row_hash() RETURNS trigger AS $$
+BEGIN
+    IF TG_NARGS > 0 AND TG_ARGV[0] = 'geom' THEN
+        NEW._row_hash := row_hash(to_jsonb(NEW), NEW.geom);
+    ELSE
+        NEW._row_hash := row_hash(to_jsonb(NEW), NULL);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    -- Named to run after the cable length trigger, whose columns it hashes
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures'
+    ] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_row_hash BEFORE INSERT OR UPDATE ON %I
+             FOR EACH ROW EXECUTE FUNCTION maintain_row_hash(''geom'')', t, t);
+    END LOOP;
+    FOREACH t IN ARRAY ARRAY[
+        'fiber_splice_trays', 'fiber_splices', 'fiber_patch_connections', 'fiber_paths'
+    ] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_row_hash BEFORE INSERT OR UPDATE ON %I
+             FOR EACH ROW EXECUTE FUNCTION maintain_row_hash()', t, t);
+    END LOOP;
+END $$;
+
+-- =============================================================================
+-- CHANGE TRACKING (incremental sync downloads)
+-- =============================================================================
+
+-- Tombstones for deleted features, reported by delta downloads
+CREATE TABLE deleted_features (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    feature_id INTEGER NOT NULL,
+    project_id INTEGER,
+    deleted_at TIMESTAMPTZ DEFAULT NOW(),
+    _xid XID8 DEFAULT pg_current_xact_id()
+);
+CREATE INDEX idx_deleted_features_project ON deleted_features (project_id, deleted_at);
+
+CREATE OR REPLACE FUNCTION log_feature_delete() RETURNS trigger AS $$
+BEGIN
+    -- Not every table has project_id, so read it generically
+    INSERT INTO deleted_features (table_name, feature_id, project_id)
+    VALUES (TG_TABLE_NAME, OLD.id, (to_jsonb(OLD) ->> 'project_id')::INTEGER);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bump _modified_at on every update that does not set it explicitly
+-- (e.g. direct edits from QGIS), and stamp the writing transaction in
+-- _xid, so delta downloads pick the row up. _xid is set on insert by its
+-- column default; deltas compare it with the previous download's snapshot
+-- (sync_log.xact_snapshot), which unlike _modified_at follows commit order.
+CREATE OR REPLACE FUNCTION touch_modified_at() RETURNS trigger AS $$
+BEGIN
+    IF NEW._modified_at IS NOT DISTINCT FROM OLD._modified_at THEN
+        NEW._modified_at := NOW();
+    END IF;
+    NEW._xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures', 'work_orders', 'smr_reports'
+    ] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_log_delete AFTER DELETE ON %I
+             FOR EACH ROW EXECUTE FUNCTION log_feature_delete()', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_touch BEFORE UPDATE ON %I
+             FOR EACH ROW EXECUTE FUNCTION touch_modified_at()', t, t);
+        EXECUTE format(
+            'CREATE INDEX idx_%s_modified_at ON %I (_modified_at)', t, t);
+    END LOOP;
+END $$;
+
+CREATE INDEX idx_deleted_features_xid ON deleted_features (project_id, _xid);
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures', 'work_orders'
+    ] LOOP
+        EXECUTE format('CREATE INDEX idx_%s_xid ON %I (project_id, _xid)', t, t);
+    END LOOP;
+END $$;
+CREATE INDEX idx_smr_reports_xid ON smr_reports (_xid);
+
+-- =============================================================================
+-- CHANGE FEED (pushed to WebSocket clients)
+-- =============================================================================
+
+-- One row per changed feature, written by statement triggers and read by
+-- the API's change feed (WebSocket /ws/changes). Pruned by the API after
+-- CHANGE_FEED_RETENTION_HOURS.
+CREATE TABLE change_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    project_id INTEGER,
+    table_name TEXT NOT NULL,
+    feature_id INTEGER NOT NULL,
+    op CHAR(1) NOT NULL,  -- I(nsert), U(pdate), D(elete)
+    changed_at TIMESTAMPTZ DEFAULT NOW(),
+    -- Writing transaction and the snapshot it wrote the event under: ids
+    -- do not follow commit order, so catch-up also replays the events of
+    -- transactions that were running then (see 015 and changes.feed)
+    _xid XID8 DEFAULT pg_current_xact_id(),
+    xact_snapshot PG_SNAPSHOT DEFAULT pg_current_snapshot()
+);
+CREATE INDEX idx_change_outbox_changed ON change_outbox (changed_at);
+CREATE INDEX idx_change_outbox_xid ON change_outbox (_xid);
+
+-- Project of a row of a table without project_id, through its parent: the
+-- closure of a tray or splice, the element of a patch connection, the
+-- cable of either, the work order of an item. NULL when it cannot be
+-- attributed (e.g. the parent was deleted by the same cascade).
+CREATE OR REPLACE FUNCTION change_project_id(tbl TEXT, r JSONB) RETURNS INTEGER AS $$
+    SELECT CASE tbl
+        WHEN 'fiber_splice_trays' THEN (
+            SELECT c.project_id FROM fiber_splice_closures c
+            WHERE c.id = (r->>'closure_id')::int)
+        WHEN 'fiber_splices' THEN COALESCE(
+            (SELECT c.project_id FROM fiber_splice_trays t
+             JOIN fiber_splice_closures c ON c.id = t.closure_id
+             WHERE t.id = (r->>'tray_id')::int),
+            (SELECT project_id FROM ftth_kablovi_podzemni WHERE id = (r->>'cable_a_fid')::int),
+            (SELECT project_id FROM ftth_kablovi_nadzemni WHERE id = (r->>'cable_a_fid')::int))
+        WHEN 'fiber_patch_connections' THEN COALESCE(
+            (SELECT project_id FROM ftth_elements WHERE id = (r->>'element_fid')::int),
+            (SELECT project_id FROM ftth_kablovi_podzemni WHERE id = (r->>'fiber_cable_fid')::int),
+            (SELECT project_id FROM ftth_kablovi_nadzemni WHERE id = (r->>'fiber_cable_fid')::int))
+        WHEN 'work_order_items' THEN (
+            SELECT w.project_id FROM work_orders w
+            WHERE w.id = (r->>'work_order_id')::int)
+    END;
+$$ LANGUAGE sql STABLE;
+
+-- Records the statement's rows in the outbox and notifies fiberq_changes
+-- with the outbox id range ("first:last"); delivered on commit.
+-- TG_ARGV[0] = 'project' for tables with a project_id column; other rows
+-- are attributed with change_project_id(). Rows without a project are
+-- not recorded, as they cannot be routed to a project's subscribers.
+CREATE OR REPLACE FUNCTION record_changes() RETURNS trigger AS $$
+DECLARE
+    with_project BOOLEAN := TG_NARGS > 0 AND TG_ARGV[0] = 'project';
+    first_id BIGINT;
+    last_id BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' AND with_project THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT o.project_id, TG_TABLE_NAME, o.id, 'D' FROM old_rows o
+            WHERE o.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT p.project_id, TG_TABLE_NAME, p.id, 'D'
+            FROM (SELECT change_project_id(TG_TABLE_NAME, to_jsonb(o)) AS project_id, o.id
+                  FROM old_rows o) p
+            WHERE p.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSIF with_project THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT n.project_id, TG_TABLE_NAME, n.id, left(TG_OP, 1) FROM new_rows n
+            WHERE n.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSE
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT p.project_id, TG_TABLE_NAME, p.id, left(TG_OP, 1)
+            FROM (SELECT change_project_id(TG_TABLE_NAME, to_jsonb(n)) AS project_id, n.id
+                  FROM new_rows n) p
+            WHERE p.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    END IF;
+
+    IF last_id IS NOT NULL THEN
+        PERFORM pg_notify('fiberq_changes', first_id || ':' || last_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+    arg TEXT;
+    op TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures', 'fiber_splice_trays', 'fiber_splices',
+        'fiber_patch_connections', 'fiber_paths', 'work_orders', 'work_order_items'
+    ] LOOP
+        arg := CASE WHEN EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = t
+              AND column_name = 'project_id'
+        ) THEN 'project' ELSE '' END;
+        -- Transition tables need one trigger per event
+        FOREACH op IN ARRAY ARRAY['INSERT', 'UPDATE', 'DELETE'] LOOP
+            EXECUTE format(
+                'CREATE TRIGGER trg_%s_changes_%s AFTER %s ON %I
+                 REFERENCING %s TABLE AS %s
+                 FOR EACH STATEMENT EXECUTE FUNCTION record_changes(%L)',
+                t, lower(op), op, t,
+                CASE WHEN op = 'DELETE' THEN 'OLD' ELSE 'NEW' END,
+                CASE WHEN op = 'DELETE' THEN 'old_rows' ELSE 'new_rows' END,
+                arg);
+        END LOOP;
+    END LOOP;
+END $$;
+
+-- =============================================================================
+-- SCHEMA MIGRATIONS
+-- =============================================================================
+-- Existing databases are upgraded with db/migrate.sh; this schema already
+-- contains the migrations listed here.
+
+CREATE TABLE schema_migrations (
+    version TEXT PRIMARY KEY,
+    applied_at TIMESTAMPTZ DEFAULT NOW()
 );
+INSERT INTO schema_migrations (version) VALUES
+    ('000_change_tracking'),
+    ('001_hot_path_indexes'),
+    ('002_fiber_plan_version'),
+    ('003_materialized_fiber_paths'),
+    ('004_cable_lengths'),
+    ('005_list_keyset_indexes'),
+    ('006_project_bounds'),
+    ('007_row_hash'),
+    ('008_change_feed'),
+    ('009_xact_watermarks'),
+    ('010_upload_sessions'),
+    ('011_change_feed_projects'),
+    ('012_fiber_plan_project_version'),
+    ('013_cable_length_overrides'),
+    ('014_sync_job_owner'),
+    ('015_change_feed_commit_order');
 
 -- =============================================================================
 -- GRANTS (for the fiberq user)
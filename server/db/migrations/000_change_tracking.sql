@@ -0,0 +1,63 @@
+-- =============================================================================
+-- 000: Change tracking for incremental sync downloads
+-- =============================================================================
+-- deleted_features tombstones (written by an AFTER DELETE trigger), the
+-- touch trigger that bumps _modified_at on updates that do not set it, and
+-- the _modified_at indexes used by delta downloads. Numbered 000 so that
+-- databases upgraded from before the migrations directory get these first;
+-- 007 (row hashes) relies on the touch triggers being in place.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- Tombstones for deleted features, reported by delta downloads
+CREATE TABLE IF NOT EXISTS deleted_features (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    feature_id INTEGER NOT NULL,
+    project_id INTEGER,
+    deleted_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_deleted_features_project ON deleted_features (project_id, deleted_at);
+
+CREATE OR REPLACE FUNCTION log_feature_delete() RETURNS trigger AS $$
+BEGIN
+    -- Not every table has project_id, so read it generically
+    INSERT INTO deleted_features (table_name, feature_id, project_id)
+    VALUES (TG_TABLE_NAME, OLD.id, (to_jsonb(OLD) ->> 'project_id')::INTEGER);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bump _modified_at on every update that does not set it explicitly
+-- (e.g. direct edits from QGIS), so delta downloads pick the row up.
+CREATE OR REPLACE FUNCTION touch_modified_at() RETURNS trigger AS $$
+BEGIN
+    IF NEW._modified_at IS NOT DISTINCT FROM OLD._modified_at THEN
+        NEW._modified_at := NOW();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures', 'work_orders', 'smr_reports'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_log_delete ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_log_delete AFTER DELETE ON %I
+             FOR EACH ROW EXECUTE FUNCTION log_feature_delete()', t, t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_touch ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_touch BEFORE UPDATE ON %I
+             FOR EACH ROW EXECUTE FUNCTION touch_modified_at()', t, t);
+        EXECUTE format(
+            'CREATE INDEX IF NOT EXISTS idx_%s_modified_at ON %I (_modified_at)', t, t);
+    END LOOP;
+END $$;
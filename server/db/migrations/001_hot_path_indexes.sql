@@ -0,0 +1,41 @@
+-- =============================================================================
+-- 001: B-tree indexes for fiber-plan and sync hot lookups
+-- =============================================================================
+-- Fiber tracing looks splices up by cable + fiber on either side and patch
+-- connections by element port or by cable + fiber; exports and list
+-- endpoints filter by project_id; work order items are read per order.
+-- None of these had a supporting index, so each lookup was a sequential
+-- scan.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- Fiber plan
+CREATE INDEX IF NOT EXISTS idx_fiber_splices_side_a
+    ON fiber_splices (cable_a_layer_id, cable_a_fid, fiber_a_number);
+CREATE INDEX IF NOT EXISTS idx_fiber_splices_side_b
+    ON fiber_splices (cable_b_layer_id, cable_b_fid, fiber_b_number);
+CREATE INDEX IF NOT EXISTS idx_fiber_patch_connections_port
+    ON fiber_patch_connections (element_fid, port_number);
+CREATE INDEX IF NOT EXISTS idx_fiber_patch_connections_fiber
+    ON fiber_patch_connections (fiber_cable_layer_id, fiber_cable_fid, fiber_number);
+CREATE INDEX IF NOT EXISTS idx_fiber_splice_closures_project
+    ON fiber_splice_closures (project_id);
+CREATE INDEX IF NOT EXISTS idx_fiber_paths_project
+    ON fiber_paths (project_id);
+
+-- Per-project filters (exports, snapshot versions, list endpoints)
+CREATE INDEX IF NOT EXISTS idx_ftth_okna_project ON ftth_okna (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_stubovi_project ON ftth_stubovi (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_kablovi_podzemni_project ON ftth_kablovi_podzemni (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_kablovi_nadzemni_project ON ftth_kablovi_nadzemni (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_trase_project ON ftth_trase (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_cevi_project ON ftth_cevi (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_mufovi_project ON ftth_mufovi (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_spojevi_project ON ftth_spojevi (project_id);
+CREATE INDEX IF NOT EXISTS idx_ftth_elements_project ON ftth_elements (project_id);
+CREATE INDEX IF NOT EXISTS idx_work_orders_project ON work_orders (project_id);
+
+-- Work orders
+CREATE INDEX IF NOT EXISTS idx_work_order_items_work_order ON work_order_items (work_order_id);
+CREATE INDEX IF NOT EXISTS idx_smr_reports_work_order ON smr_reports (work_order_id);
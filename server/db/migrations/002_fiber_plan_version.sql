@@ -0,0 +1,37 @@
+-- =============================================================================
+-- 002: Fiber plan version for cached fiber graphs
+-- =============================================================================
+-- A single counter bumped by statement triggers on every change to
+-- fiber_splices, fiber_splice_trays and fiber_patch_connections. API workers
+-- cache per-project fiber graphs (fiber_plan.graph) and rebuild them when the
+-- counter has moved, whoever made the change.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS fiber_plan_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+INSERT INTO fiber_plan_version DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_fiber_plan_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE fiber_plan_version SET version = version + 1, updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fiber_splices_version ON fiber_splices;
+CREATE TRIGGER trg_fiber_splices_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fiber_splices
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version();
+DROP TRIGGER IF EXISTS trg_fiber_splice_trays_version ON fiber_splice_trays;
+CREATE TRIGGER trg_fiber_splice_trays_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fiber_splice_trays
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version();
+DROP TRIGGER IF EXISTS trg_fiber_patch_connections_version ON fiber_patch_connections;
+CREATE TRIGGER trg_fiber_patch_connections_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fiber_patch_connections
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version();
@@ -0,0 +1,19 @@
+-- =============================================================================
+-- 003: Materialized fiber paths
+-- =============================================================================
+-- fiber_paths rows with status 'traced' are written by fiber_plan.paths, one
+-- per patch port of a project. The splices and fiber ends each path runs
+-- through are stored so a splice or patch change re-traces only the paths
+-- it touches.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+ALTER TABLE fiber_paths ADD COLUMN IF NOT EXISTS splice_ids INTEGER[] DEFAULT '{}';
+ALTER TABLE fiber_paths ADD COLUMN IF NOT EXISTS fiber_keys TEXT[] DEFAULT '{}';
+
+CREATE INDEX IF NOT EXISTS idx_fiber_paths_splices ON fiber_paths USING GIN (splice_ids);
+CREATE INDEX IF NOT EXISTS idx_fiber_paths_fiber_keys ON fiber_paths USING GIN (fiber_keys);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_fiber_paths_traced_port
+    ON fiber_paths (project_id, olt_element_fid, olt_port_number)
+    WHERE status = 'traced';
@@ -0,0 +1,50 @@
+-- =============================================================================
+-- 004: Maintained geodesic cable lengths
+-- =============================================================================
+-- geo_length_m = ST_Length(geom::geography) on both cable tables, kept up to
+-- date by a trigger that also sets total_len_m = geo_length_m + slack_m.
+-- The fiber tracer reads lengths through the cable_lengths view, and cable
+-- length changes invalidate cached fiber graphs.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+ALTER TABLE ftth_kablovi_podzemni ADD COLUMN IF NOT EXISTS geo_length_m REAL;
+ALTER TABLE ftth_kablovi_nadzemni ADD COLUMN IF NOT EXISTS geo_length_m REAL;
+
+CREATE OR REPLACE FUNCTION maintain_cable_length() RETURNS trigger AS $$
+BEGIN
+    NEW.geo_length_m := ST_Length(NEW.geom::geography);
+    NEW.total_len_m := NEW.geo_length_m + COALESCE(NEW.slack_m, 0);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ftth_kablovi_podzemni_length ON ftth_kablovi_podzemni;
+CREATE TRIGGER trg_ftth_kablovi_podzemni_length
+    BEFORE INSERT OR UPDATE ON ftth_kablovi_podzemni
+    FOR EACH ROW EXECUTE FUNCTION maintain_cable_length();
+DROP TRIGGER IF EXISTS trg_ftth_kablovi_nadzemni_length ON ftth_kablovi_nadzemni;
+CREATE TRIGGER trg_ftth_kablovi_nadzemni_length
+    BEFORE INSERT OR UPDATE ON ftth_kablovi_nadzemni
+    FOR EACH ROW EXECUTE FUNCTION maintain_cable_length();
+
+DROP TRIGGER IF EXISTS trg_ftth_kablovi_podzemni_version ON ftth_kablovi_podzemni;
+CREATE TRIGGER trg_ftth_kablovi_podzemni_version
+    AFTER INSERT OR UPDATE OF geom, slack_m OR DELETE ON ftth_kablovi_podzemni
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version();
+DROP TRIGGER IF EXISTS trg_ftth_kablovi_nadzemni_version ON ftth_kablovi_nadzemni;
+CREATE TRIGGER trg_ftth_kablovi_nadzemni_version
+    AFTER INSERT OR UPDATE OF geom, slack_m OR DELETE ON ftth_kablovi_nadzemni
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version();
+
+CREATE OR REPLACE VIEW cable_lengths AS
+    SELECT 'ftth_kablovi_podzemni' AS table_name, id, geo_length_m, slack_m
+    FROM ftth_kablovi_podzemni
+    UNION ALL
+    SELECT 'ftth_kablovi_nadzemni', id, geo_length_m, slack_m
+    FROM ftth_kablovi_nadzemni;
+
+-- Backfill existing cables (the trigger computes the values)
+UPDATE ftth_kablovi_podzemni SET geom = geom;
+UPDATE ftth_kablovi_nadzemni SET geom = geom;
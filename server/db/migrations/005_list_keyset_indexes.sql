@@ -0,0 +1,21 @@
+-- =============================================================================
+-- 005: Indexes matching the keyset order of paginated list endpoints
+-- =============================================================================
+-- List routes page with (sort key) > (cursor) conditions (see pagination.py).
+-- Closures and paths are listed per project by id, work orders newest first
+-- by (created_at, id). The per-project indexes from 001 are widened to
+-- include the sort key. Splices page by (tray_id, position_in_tray) and
+-- (closure_id, tray_number), already covered by their unique constraints.
+--
+-- Apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+DROP INDEX IF EXISTS idx_fiber_splice_closures_project;
+CREATE INDEX idx_fiber_splice_closures_project ON fiber_splice_closures (project_id, id);
+
+DROP INDEX IF EXISTS idx_fiber_paths_project;
+CREATE INDEX idx_fiber_paths_project ON fiber_paths (project_id, id);
+
+DROP INDEX IF EXISTS idx_work_orders_project;
+CREATE INDEX idx_work_orders_project ON work_orders (project_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_work_orders_created ON work_orders (created_at DESC, id DESC);
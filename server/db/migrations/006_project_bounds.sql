@@ -0,0 +1,81 @@
+-- =============================================================================
+-- 006: Maintained project bounds
+-- =============================================================================
+-- projects.bounds_geom covers every feature of the project in the network
+-- tables. Statement-level triggers grow it on insert and update; existing
+-- projects are backfilled exactly with refresh_project_bounds(). The API
+-- uses the bounds to skip vector tiles and export areas outside a project.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- Bounding box as a (never degenerate) Polygon, the type of bounds_geom
+CREATE OR REPLACE FUNCTION project_envelope(b box2d) RETURNS geometry AS $$
+    SELECT ST_MakeEnvelope(ST_XMin(b), ST_YMin(b), ST_XMax(b), ST_YMax(b), 4326);
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+-- Grow projects.bounds_geom to cover inserted or moved features. Bounds
+-- only grow, so they stay a superset of the project's features after
+-- deletes; refresh_project_bounds() recomputes them exactly.
+CREATE OR REPLACE FUNCTION extend_project_bounds() RETURNS trigger AS $$
+BEGIN
+    WITH added AS (
+        SELECT project_id, ST_Extent(geom) AS box
+        FROM new_rows
+        WHERE project_id IS NOT NULL AND geom IS NOT NULL
+        GROUP BY project_id
+    )
+    UPDATE projects p
+    SET bounds_geom = project_envelope(
+        CASE WHEN p.bounds_geom IS NULL THEN a.box
+             ELSE ST_CombineBBox(a.box, p.bounds_geom) END)
+    FROM added a
+    WHERE p.id = a.project_id
+      AND (p.bounds_geom IS NULL OR NOT a.box::geometry @ p.bounds_geom);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Exact bounds from the project's current features
+CREATE OR REPLACE FUNCTION refresh_project_bounds(pid INTEGER) RETURNS void AS $$
+    UPDATE projects SET bounds_geom = (
+        SELECT project_envelope(ST_Extent(geom)) FROM (
+            SELECT geom FROM ftth_okna WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_stubovi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_kablovi_podzemni WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_kablovi_nadzemni WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_trase WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_cevi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_mufovi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_spojevi WHERE project_id = pid
+            UNION ALL SELECT geom FROM ftth_elements WHERE project_id = pid
+            UNION ALL SELECT geom FROM fiber_splice_closures WHERE project_id = pid
+        ) g
+    )
+    WHERE id = pid;
+$$ LANGUAGE sql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_bounds_insert ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_bounds_insert AFTER INSERT ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION extend_project_bounds()', t, t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_bounds_update ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_bounds_update AFTER UPDATE ON %I
+             REFERENCING NEW TABLE AS new_rows
+             FOR EACH STATEMENT EXECUTE FUNCTION extend_project_bounds()', t, t);
+    END LOOP;
+END $$;
+
+-- Backfill existing projects
+DO $$ BEGIN PERFORM refresh_project_bounds(id) FROM projects; END $$;
@@ -0,0 +1,67 @@
+-- =============================================================================
+-- 007: Row hashes
+-- =============================================================================
+-- _row_hash on the network and fiber plan tables: md5 of the row's
+-- attributes and WKB geometry, maintained by a BEFORE trigger. It travels
+-- with exported GeoPackages, and the bulk merge compares it with the hash
+-- of each staged row to leave unchanged features untouched.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- md5 over a row's attributes (as canonical jsonb text, without system
+-- columns) and its WKB geometry. Called by the trigger below and by the
+-- bulk merge to hash a staged row before writing it.
+CREATE OR REPLACE FUNCTION row_hash(attrs JSONB, geom GEOMETRY) RETURNS TEXT AS $$
+    SELECT md5(
+        (attrs - 'geom' - '_row_hash' - '_modified_at' - '_modified_by_sub')::text
+        || COALESCE(encode(ST_AsBinary(geom), 'hex'), '')
+    );
+$$ LANGUAGE sql IMMUTABLE;
+
+-- TG_ARGV[0] = 'geom' for tables with a geometry column
+CREATE OR REPLACE FUNCTION maintain_row_hash() RETURNS trigger AS $$
+BEGIN
+    IF TG_NARGS > 0 AND TG_ARGV[0] = 'geom' THEN
+        NEW._row_hash := row_hash(to_jsonb(NEW), NEW.geom);
+    ELSE
+        NEW._row_hash := row_hash(to_jsonb(NEW), NULL);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    -- Named to run after the cable length trigger, whose columns it hashes
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures'
+    ] LOOP
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS _row_hash TEXT', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_row_hash ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_row_hash BEFORE INSERT OR UPDATE ON %I
+             FOR EACH ROW EXECUTE FUNCTION maintain_row_hash(''geom'')', t, t);
+        -- Backfill without firing the other triggers (touch would move
+        -- _modified_at and make every client download the table again)
+        EXECUTE format('ALTER TABLE %I DISABLE TRIGGER USER', t);
+        EXECUTE format('UPDATE %I t SET _row_hash = row_hash(to_jsonb(t), t.geom)', t);
+        EXECUTE format('ALTER TABLE %I ENABLE TRIGGER USER', t);
+    END LOOP;
+    FOREACH t IN ARRAY ARRAY[
+        'fiber_splice_trays', 'fiber_splices', 'fiber_patch_connections', 'fiber_paths'
+    ] LOOP
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS _row_hash TEXT', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_row_hash ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%s_row_hash BEFORE INSERT OR UPDATE ON %I
+             FOR EACH ROW EXECUTE FUNCTION maintain_row_hash()', t, t);
+        EXECUTE format('ALTER TABLE %I DISABLE TRIGGER USER', t);
+        EXECUTE format('UPDATE %I t SET _row_hash = row_hash(to_jsonb(t), NULL)', t);
+        EXECUTE format('ALTER TABLE %I ENABLE TRIGGER USER', t);
+    END LOOP;
+END $$;
@@ -0,0 +1,100 @@
+-- =============================================================================
+-- 008: Change feed outbox
+-- =============================================================================
+-- Statement triggers on the network, fiber plan and work order tables
+-- record every changed feature in change_outbox and NOTIFY fiberq_changes.
+-- The API fans the events out to WebSocket clients (/ws/changes).
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- One row per changed feature, written by statement triggers and read by
+-- the API's change feed (WebSocket /ws/changes). Pruned by the API after
+-- CHANGE_FEED_RETENTION_HOURS.
+CREATE TABLE IF NOT EXISTS change_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    project_id INTEGER,
+    table_name TEXT NOT NULL,
+    feature_id INTEGER NOT NULL,
+    op CHAR(1) NOT NULL,  -- I(nsert), U(pdate), D(elete)
+    changed_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_change_outbox_changed ON change_outbox (changed_at);
+
+-- Records the statement's rows in the outbox and notifies fiberq_changes
+-- with the outbox id range ("first:last"); delivered on commit.
+-- TG_ARGV[0] = 'project' for tables with a project_id column.
+CREATE OR REPLACE FUNCTION record_changes() RETURNS trigger AS $$
+DECLARE
+    with_project BOOLEAN := TG_NARGS > 0 AND TG_ARGV[0] = 'project';
+    first_id BIGINT;
+    last_id BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' AND with_project THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT o.project_id, TG_TABLE_NAME, o.id, 'D' FROM old_rows o
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT NULL, TG_TABLE_NAME, o.id, 'D' FROM old_rows o
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSIF with_project THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT n.project_id, TG_TABLE_NAME, n.id, left(TG_OP, 1) FROM new_rows n
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSE
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT NULL, TG_TABLE_NAME, n.id, left(TG_OP, 1) FROM new_rows n
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    END IF;
+
+    IF last_id IS NOT NULL THEN
+        PERFORM pg_notify('fiberq_changes', first_id || ':' || last_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+    arg TEXT;
+    op TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures', 'fiber_splice_trays', 'fiber_splices',
+        'fiber_patch_connections', 'fiber_paths', 'work_orders', 'work_order_items'
+    ] LOOP
+        arg := CASE WHEN EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = t
+              AND column_name = 'project_id'
+        ) THEN 'project' ELSE '' END;
+        -- Transition tables need one trigger per event
+        FOREACH op IN ARRAY ARRAY['INSERT', 'UPDATE', 'DELETE'] LOOP
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_changes_%s ON %I', t, lower(op), t);
+            EXECUTE format(
+                'CREATE TRIGGER trg_%s_changes_%s AFTER %s ON %I
+                 REFERENCING %s TABLE AS %s
+                 FOR EACH STATEMENT EXECUTE FUNCTION record_changes(%L)',
+                t, lower(op), op, t,
+                CASE WHEN op = 'DELETE' THEN 'OLD' ELSE 'NEW' END,
+                CASE WHEN op = 'DELETE' THEN 'old_rows' ELSE 'new_rows' END,
+                arg);
+        END LOOP;
+    END LOOP;
+END $$;
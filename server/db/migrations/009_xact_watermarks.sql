@@ -0,0 +1,61 @@
+-- =============================================================================
+-- 009: Commit-ordered change markers for delta downloads
+-- =============================================================================
+-- _xid (xid8) on every change-tracked table and on deleted_features holds
+-- the id of the transaction that last wrote the row: the column default on
+-- insert, the touch trigger on update. Each download stores the snapshot
+-- (pg_current_snapshot()) its data was read under in sync_log.xact_snapshot.
+-- The next delta then sends exactly the rows that were not visible in that
+-- snapshot. _modified_at comes from NOW(), the start of the writing
+-- transaction, so it cannot tell a long transaction that committed after
+-- the download from one that committed before it.
+--
+-- Rows written before this migration keep _xid NULL, which counts as
+-- visible in every snapshot.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- _xid is bookkeeping, not an attribute
+CREATE OR REPLACE FUNCTION row_hash(attrs JSONB, geom GEOMETRY) RETURNS TEXT AS $$
+    SELECT md5(
+        (attrs - 'geom' - '_row_hash' - '_modified_at' - '_modified_by_sub' - '_xid')::text
+        || COALESCE(encode(ST_AsBinary(geom), 'hex'), '')
+    );
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION touch_modified_at() RETURNS trigger AS $$
+BEGIN
+    IF NEW._modified_at IS NOT DISTINCT FROM OLD._modified_at THEN
+        NEW._modified_at := NOW();
+    END IF;
+    NEW._xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'ftth_okna', 'ftth_stubovi', 'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni',
+        'ftth_trase', 'ftth_cevi', 'ftth_mufovi', 'ftth_spojevi', 'ftth_elements',
+        'fiber_splice_closures', 'work_orders', 'smr_reports', 'deleted_features'
+    ] LOOP
+        -- Added without a default first so existing rows stay NULL (no rewrite)
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS _xid XID8', t);
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN _xid SET DEFAULT pg_current_xact_id()', t);
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = t
+              AND column_name = 'project_id'
+        ) THEN
+            EXECUTE format('CREATE INDEX IF NOT EXISTS idx_%s_xid ON %I (project_id, _xid)', t, t);
+        ELSE
+            EXECUTE format('CREATE INDEX IF NOT EXISTS idx_%s_xid ON %I (_xid)', t, t);
+        END IF;
+    END LOOP;
+END $$;
+
+ALTER TABLE sync_log ADD COLUMN IF NOT EXISTS xact_snapshot PG_SNAPSHOT;
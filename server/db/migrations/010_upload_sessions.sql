@@ -0,0 +1,24 @@
+-- =============================================================================
+-- 010: Resumable upload sessions
+-- =============================================================================
+-- Session state of chunked GPKG and photo uploads (/sync/uploads), shared
+-- by all API workers.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    user_sub TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    total_size BIGINT NOT NULL,
+    sha256 TEXT NOT NULL,
+    received_size BIGINT NOT NULL DEFAULT 0,
+    params JSONB DEFAULT '{}'::jsonb,
+    status TEXT DEFAULT 'open',
+    result JSONB,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions (updated_at);
@@ -0,0 +1,95 @@
+-- =============================================================================
+-- 011: Attribute every change feed event to a project
+-- =============================================================================
+-- Trays, splices, patch connections and work order items have no
+-- project_id; their outbox rows were recorded without one and sent to
+-- every subscriber. They are now attributed through their parent rows,
+-- and rows that cannot be attributed are not recorded. The triggers from
+-- 008 call record_changes() by name and are left as they are.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- Project of a row of a table without project_id, through its parent: the
+-- closure of a tray or splice, the element of a patch connection, the
+-- cable of either, the work order of an item. NULL when it cannot be
+-- attributed (e.g. the parent was deleted by the same cascade).
+CREATE OR REPLACE FUNCTION change_project_id(tbl TEXT, r JSONB) RETURNS INTEGER AS $$
+    SELECT CASE tbl
+        WHEN 'fiber_splice_trays' THEN (
+            SELECT c.project_id FROM fiber_splice_closures c
+            WHERE c.id = (r->>'closure_id')::int)
+        WHEN 'fiber_splices' THEN COALESCE(
+            (SELECT c.project_id FROM fiber_splice_trays t
+             JOIN fiber_splice_closures c ON c.id = t.closure_id
+             WHERE t.id = (r->>'tray_id')::int),
+            (SELECT project_id FROM ftth_kablovi_podzemni WHERE id = (r->>'cable_a_fid')::int),
+            (SELECT project_id FROM ftth_kablovi_nadzemni WHERE id = (r->>'cable_a_fid')::int))
+        WHEN 'fiber_patch_connections' THEN COALESCE(
+            (SELECT project_id FROM ftth_elements WHERE id = (r->>'element_fid')::int),
+            (SELECT project_id FROM ftth_kablovi_podzemni WHERE id = (r->>'fiber_cable_fid')::int),
+            (SELECT project_id FROM ftth_kablovi_nadzemni WHERE id = (r->>'fiber_cable_fid')::int))
+        WHEN 'work_order_items' THEN (
+            SELECT w.project_id FROM work_orders w
+            WHERE w.id = (r->>'work_order_id')::int)
+    END;
+$$ LANGUAGE sql STABLE;
+
+-- Records the statement's rows in the outbox and notifies fiberq_changes
+-- with the outbox id range ("first:last"); delivered on commit.
+-- TG_ARGV[0] = 'project' for tables with a project_id column; other rows
+-- are attributed with change_project_id(). Rows without a project are
+-- not recorded, as they cannot be routed to a project's subscribers.
+CREATE OR REPLACE FUNCTION record_changes() RETURNS trigger AS $$
+DECLARE
+    with_project BOOLEAN := TG_NARGS > 0 AND TG_ARGV[0] = 'project';
+    first_id BIGINT;
+    last_id BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' AND with_project THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT o.project_id, TG_TABLE_NAME, o.id, 'D' FROM old_rows o
+            WHERE o.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT p.project_id, TG_TABLE_NAME, p.id, 'D'
+            FROM (SELECT change_project_id(TG_TABLE_NAME, to_jsonb(o)) AS project_id, o.id
+                  FROM old_rows o) p
+            WHERE p.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSIF with_project THEN
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT n.project_id, TG_TABLE_NAME, n.id, left(TG_OP, 1) FROM new_rows n
+            WHERE n.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    ELSE
+        WITH ins AS (
+            INSERT INTO change_outbox (project_id, table_name, feature_id, op)
+            SELECT p.project_id, TG_TABLE_NAME, p.id, left(TG_OP, 1)
+            FROM (SELECT change_project_id(TG_TABLE_NAME, to_jsonb(n)) AS project_id, n.id
+                  FROM new_rows n) p
+            WHERE p.project_id IS NOT NULL
+            RETURNING id
+        )
+        SELECT min(id), max(id) INTO first_id, last_id FROM ins;
+    END IF;
+
+    IF last_id IS NOT NULL THEN
+        PERFORM pg_notify('fiberq_changes', first_id || ':' || last_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Events recorded without a project reached every subscriber
+DELETE FROM change_outbox WHERE project_id IS NULL;
@@ -0,0 +1,137 @@
+-- =============================================================================
+-- 012: Fiber plan version per project
+-- =============================================================================
+-- The single fiber_plan_version row was bumped by every splice, tray,
+-- patch and cable write in every project, so all of them serialized on its
+-- row lock and every write invalidated every project's cached graph. The
+-- statement triggers now bump fiber_plan_project_version for the projects
+-- whose graph contains the changed rows. fiber_plan_version stays for
+-- TRUNCATE, which has no rows to attribute.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+-- Fiber plan version per project, bumped by every change to the splices,
+-- trays, patches or cables of the project's fiber graph. In-memory fiber
+-- graphs (fiber_plan.graph) are rebuilt when the sum of their project's
+-- version and the global fiber_plan_version (bumped only by TRUNCATE)
+-- moves. Writers of different projects never wait on each other's bump.
+CREATE TABLE IF NOT EXISTS fiber_plan_project_version (
+    project_id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Projects whose fiber graph contains any of ``changed`` (rows of ``tbl``
+-- as JSONB), by the membership rules of fiber_plan.graph: splices in a
+-- project's closures or on its cables, patches on its elements or cables,
+-- and the cables (with their lengths) reached through either.
+CREATE OR REPLACE FUNCTION fiber_plan_projects(tbl TEXT, changed JSONB[]) RETURNS INTEGER[] AS $$
+    WITH r AS (
+        SELECT j FROM unnest(changed) AS j
+    ),
+    cables AS (
+        SELECT (j->>'cable_a_fid')::int AS fid FROM r WHERE tbl = 'fiber_splices'
+        UNION SELECT (j->>'cable_b_fid')::int FROM r WHERE tbl = 'fiber_splices'
+        UNION SELECT (j->>'fiber_cable_fid')::int FROM r WHERE tbl = 'fiber_patch_connections'
+        UNION SELECT (j->>'id')::int FROM r
+              WHERE tbl IN ('ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni')
+    ),
+    closures AS (
+        SELECT (j->>'closure_id')::int AS id FROM r WHERE tbl = 'fiber_splice_trays'
+        UNION SELECT t.closure_id FROM r
+              JOIN fiber_splice_trays t ON t.id = (r.j->>'tray_id')::int
+              WHERE tbl = 'fiber_splices'
+        -- Graphs that reach one of the cables through their splices
+        UNION SELECT t.closure_id FROM fiber_splices s
+              JOIN fiber_splice_trays t ON t.id = s.tray_id
+              WHERE s.cable_a_fid IN (SELECT fid FROM cables)
+                 OR s.cable_b_fid IN (SELECT fid FROM cables)
+    )
+    SELECT array_agg(DISTINCT p ORDER BY p) FROM (
+        SELECT project_id FROM fiber_splice_closures WHERE id IN (SELECT id FROM closures)
+        UNION SELECT project_id FROM ftth_kablovi_podzemni WHERE id IN (SELECT fid FROM cables)
+        UNION SELECT project_id FROM ftth_kablovi_nadzemni WHERE id IN (SELECT fid FROM cables)
+        -- Deleted cables are gone from their table
+        UNION SELECT (j->>'project_id')::int FROM r
+              WHERE tbl IN ('ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni')
+        UNION SELECT e.project_id FROM r
+              JOIN ftth_elements e ON e.id = (r.j->>'element_fid')::int
+              WHERE tbl = 'fiber_patch_connections'
+        -- Graphs that reach one of the cables through their patches
+        UNION SELECT e.project_id FROM fiber_patch_connections pc
+              JOIN ftth_elements e ON e.id = pc.element_fid
+              WHERE pc.fiber_cable_fid IN (SELECT fid FROM cables)
+    ) AS x(p)
+    WHERE p IS NOT NULL;
+$$ LANGUAGE sql STABLE;
+
+-- Statement trigger; needs the transition tables new_rows / old_rows.
+-- Project rows are locked in id order, so concurrent bumps cannot deadlock.
+CREATE OR REPLACE FUNCTION bump_fiber_plan_version() RETURNS trigger AS $$
+DECLARE
+    changed JSONB[];
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE fiber_plan_version SET version = version + 1, updated_at = NOW();
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        changed := ARRAY(SELECT to_jsonb(n) FROM new_rows n);
+    ELSIF TG_OP = 'DELETE' THEN
+        changed := ARRAY(SELECT to_jsonb(o) FROM old_rows o);
+    ELSIF TG_TABLE_NAME IN ('ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni') THEN
+        -- Graphs carry only the cables' lengths
+        changed := ARRAY(
+            SELECT to_jsonb(n) FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.geom IS DISTINCT FROM o.geom OR n.slack_m IS DISTINCT FROM o.slack_m
+        );
+    ELSE
+        changed := ARRAY(
+            SELECT to_jsonb(n) FROM new_rows n
+            UNION ALL
+            SELECT to_jsonb(o) FROM old_rows o
+        );
+    END IF;
+
+    IF cardinality(changed) > 0 THEN
+        INSERT INTO fiber_plan_project_version AS v (project_id, version)
+        SELECT p, 1 FROM unnest(fiber_plan_projects(TG_TABLE_NAME, changed)) AS p
+        ORDER BY p
+        ON CONFLICT (project_id) DO UPDATE SET version = v.version + 1, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event
+DO $$
+DECLARE
+    t TEXT;
+    op TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'fiber_splices', 'fiber_splice_trays', 'fiber_patch_connections',
+        'ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_version ON %I', t, t);
+        FOREACH op IN ARRAY ARRAY['INSERT', 'UPDATE', 'DELETE'] LOOP
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_version_%s ON %I', t, lower(op), t);
+            EXECUTE format(
+                'CREATE TRIGGER trg_%s_version_%s AFTER %s ON %I
+                 REFERENCING %s
+                 FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version()',
+                t, lower(op), op, t,
+                CASE op
+                    WHEN 'INSERT' THEN 'NEW TABLE AS new_rows'
+                    WHEN 'UPDATE' THEN 'OLD TABLE AS old_rows NEW TABLE AS new_rows'
+                    ELSE 'OLD TABLE AS old_rows'
+                END);
+        END LOOP;
+        IF t NOT LIKE 'ftth_%' THEN
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_version_truncate ON %I', t, t);
+            EXECUTE format(
+                'CREATE TRIGGER trg_%s_version_truncate AFTER TRUNCATE ON %I
+                 FOR EACH STATEMENT EXECUTE FUNCTION bump_fiber_plan_version()', t, t);
+        END IF;
+    END LOOP;
+END $$;
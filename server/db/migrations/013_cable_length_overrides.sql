@@ -0,0 +1,150 @@
+-- =============================================================================
+-- 013: Keep user-entered cable lengths; bump fiber plans on length changes
+-- =============================================================================
+-- 004 recomputed total_len_m = geo_length_m + slack_m on every write and
+-- dropped lengths entered by users. The entered length is now kept in
+-- total_len_override_m (a write to total_len_m sets it), and total_len_m
+-- falls back to the computed length only without one. Values overwritten
+-- by 004 cannot be restored. Since 004 every stored total_len_m is the
+-- computed length, so there is nothing to backfill: overrides start empty
+-- and no cable row is rewritten (which would move its _modified_at).
+--
+-- The fiber tracer and graphs read cable lengths through cable_lengths,
+-- now as length_m (total_len_m less slack), so traces add up to the cable
+-- length users see, entered or computed.
+--
+-- Cable writes bumped the fiber plan version of the cable's project on
+-- every insert and delete and on every geometry write. They now bump only
+-- the projects whose graphs refer to the cable, and an update only when
+-- total_len_m or slack_m actually changed.
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+ALTER TABLE ftth_kablovi_podzemni ADD COLUMN IF NOT EXISTS total_len_override_m REAL;
+ALTER TABLE ftth_kablovi_nadzemni ADD COLUMN IF NOT EXISTS total_len_override_m REAL;
+
+-- Renames a column, which CREATE OR REPLACE VIEW cannot
+DROP VIEW IF EXISTS cable_lengths;
+-- Lengths of both cable tables, looked up by the fiber tracer. length_m
+-- plus slack_m is total_len_m: the entered length when there is one, else
+-- the geodesic length plus slack.
+CREATE VIEW cable_lengths AS
+    SELECT 'ftth_kablovi_podzemni' AS table_name, id,
+           COALESCE(total_len_m - COALESCE(slack_m, 0), geo_length_m) AS length_m, slack_m
+    FROM ftth_kablovi_podzemni
+    UNION ALL
+    SELECT 'ftth_kablovi_nadzemni', id,
+           COALESCE(total_len_m - COALESCE(slack_m, 0), geo_length_m), slack_m
+    FROM ftth_kablovi_nadzemni;
+
+-- Geodesic cable length, maintained on every write. total_len_m is
+-- total_len_override_m when set, else geo_length_m plus slack. A value
+-- written to total_len_m itself is kept as the override, so lengths
+-- entered by users are never replaced; writing NULL clears it.
+CREATE OR REPLACE FUNCTION maintain_cable_length() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.total_len_override_m IS NULL THEN
+            NEW.total_len_override_m := NEW.total_len_m;
+        END IF;
+    ELSIF NEW.total_len_m IS DISTINCT FROM OLD.total_len_m
+          AND NEW.total_len_override_m IS NOT DISTINCT FROM OLD.total_len_override_m THEN
+        NEW.total_len_override_m := NEW.total_len_m;
+    END IF;
+    NEW.geo_length_m := ST_Length(NEW.geom::geography);
+    NEW.total_len_m := COALESCE(NEW.total_len_override_m, NEW.geo_length_m + COALESCE(NEW.slack_m, 0));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Projects whose fiber graph contains any of ``changed`` (rows of ``tbl``
+-- as JSONB), by the membership rules of fiber_plan.graph: splices in a
+-- project's closures or on its cables, patches on its elements or cables
+-- or on a cable its splices reach, and the lengths of all those cables.
+-- A cable no splice or patch refers to is in no graph.
+CREATE OR REPLACE FUNCTION fiber_plan_projects(tbl TEXT, changed JSONB[]) RETURNS INTEGER[] AS $$
+    WITH r AS (
+        SELECT j FROM unnest(changed) AS j
+    ),
+    changed_cables AS (
+        SELECT (j->>'id')::int AS fid, (j->>'project_id')::int AS project_id FROM r
+        WHERE tbl IN ('ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni')
+    ),
+    -- Cables that graphs reach through their splices
+    reached AS (
+        SELECT fid FROM changed_cables
+        UNION SELECT (j->>'fiber_cable_fid')::int FROM r WHERE tbl = 'fiber_patch_connections'
+    ),
+    splices AS (
+        SELECT (j->>'tray_id')::int AS tray_id, (j->>'cable_a_fid')::int AS cable_a_fid,
+               (j->>'cable_b_fid')::int AS cable_b_fid
+        FROM r WHERE tbl = 'fiber_splices'
+        UNION
+        SELECT tray_id, cable_a_fid, cable_b_fid FROM fiber_splices
+        WHERE cable_a_fid IN (SELECT fid FROM reached) OR cable_b_fid IN (SELECT fid FROM reached)
+    ),
+    patches AS (
+        SELECT (j->>'element_fid')::int AS element_fid, (j->>'fiber_cable_fid')::int AS cable_fid
+        FROM r WHERE tbl = 'fiber_patch_connections'
+        UNION
+        SELECT element_fid, fiber_cable_fid FROM fiber_patch_connections
+        WHERE fiber_cable_fid IN (SELECT fid FROM changed_cables)
+    ),
+    closures AS (
+        SELECT (j->>'closure_id')::int AS id FROM r WHERE tbl = 'fiber_splice_trays'
+        UNION SELECT t.closure_id FROM splices s JOIN fiber_splice_trays t ON t.id = s.tray_id
+    ),
+    cables AS (
+        SELECT cable_a_fid AS fid FROM splices
+        UNION SELECT cable_b_fid FROM splices
+        UNION SELECT cable_fid FROM patches
+    )
+    SELECT array_agg(DISTINCT p ORDER BY p) FROM (
+        SELECT project_id FROM fiber_splice_closures WHERE id IN (SELECT id FROM closures)
+        UNION SELECT project_id FROM ftth_elements WHERE id IN (SELECT element_fid FROM patches)
+        UNION SELECT project_id FROM ftth_kablovi_podzemni WHERE id IN (SELECT fid FROM cables)
+        UNION SELECT project_id FROM ftth_kablovi_nadzemni WHERE id IN (SELECT fid FROM cables)
+        -- Deleted cables are gone from their table
+        UNION SELECT project_id FROM changed_cables WHERE fid IN (SELECT fid FROM cables)
+    ) AS x(p)
+    WHERE p IS NOT NULL;
+$$ LANGUAGE sql STABLE;
+
+-- Statement trigger; needs the transition tables new_rows / old_rows.
+-- Project rows are locked in id order, so concurrent bumps cannot deadlock.
+CREATE OR REPLACE FUNCTION bump_fiber_plan_version() RETURNS trigger AS $$
+DECLARE
+    changed JSONB[];
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE fiber_plan_version SET version = version + 1, updated_at = NOW();
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        changed := ARRAY(SELECT to_jsonb(n) FROM new_rows n);
+    ELSIF TG_OP = 'DELETE' THEN
+        changed := ARRAY(SELECT to_jsonb(o) FROM old_rows o);
+    ELSIF TG_TABLE_NAME IN ('ftth_kablovi_podzemni', 'ftth_kablovi_nadzemni') THEN
+        -- Graphs carry only the cables' lengths
+        changed := ARRAY(
+            SELECT to_jsonb(n) FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.total_len_m IS DISTINCT FROM o.total_len_m
+               OR n.slack_m IS DISTINCT FROM o.slack_m
+        );
+    ELSE
+        changed := ARRAY(
+            SELECT to_jsonb(n) FROM new_rows n
+            UNION ALL
+            SELECT to_jsonb(o) FROM old_rows o
+        );
+    END IF;
+
+    IF cardinality(changed) > 0 THEN
+        INSERT INTO fiber_plan_project_version AS v (project_id, version)
+        SELECT p, 1 FROM unnest(fiber_plan_projects(TG_TABLE_NAME, changed)) AS p
+        ORDER BY p
+        ON CONFLICT (project_id) DO UPDATE SET version = v.version + 1, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,13 @@
+-- =============================================================================
+-- 014: Owner of queued upload merges
+-- =============================================================================
+-- Upload merges run in the in-process job queue of one API worker. A worker
+-- that crashed or was restarted left its jobs 'queued' or 'in_progress'
+-- forever. sync_log.worker_pid records the backend pid of the connection
+-- the owning queue holds open while it runs; a starting queue fails every
+-- unfinished job whose owner is no longer connected (see sync.jobs).
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+ALTER TABLE sync_log ADD COLUMN IF NOT EXISTS worker_pid INTEGER;
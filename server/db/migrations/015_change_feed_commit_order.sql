@@ -0,0 +1,18 @@
+-- =============================================================================
+-- 015: Commit-ordered catch-up of the change feed
+-- =============================================================================
+-- Outbox ids come from a sequence when the row is inserted, not when its
+-- transaction commits. A reconnecting client that passes the last id it
+-- saw (?after=) missed every event with a lower id whose transaction
+-- committed later. Each outbox row now records its transaction (_xid) and
+-- the snapshot taken when it was written. Every transaction that could
+-- still commit an event with a lower id was running then, so it is not
+-- visible in that snapshot. The catch-up sends those events along with the
+-- ids after it (see changes.feed).
+--
+-- Idempotent; apply with db/migrate.sh (search_path = fiberq, public).
+-- =============================================================================
+
+ALTER TABLE change_outbox ADD COLUMN IF NOT EXISTS _xid XID8 DEFAULT pg_current_xact_id();
+ALTER TABLE change_outbox ADD COLUMN IF NOT EXISTS xact_snapshot PG_SNAPSHOT DEFAULT pg_current_snapshot();
+CREATE INDEX IF NOT EXISTS idx_change_outbox_xid ON change_outbox (_xid);